@@ -0,0 +1,175 @@
+"""
+Lookup tables for the 8-bit ALU.
+
+Each operation has a pair of tables, one holding the result byte and one the
+packed F byte, so an instruction is a couple of lookups instead of computing
+each flag. The tables are bytes objects, indexed as follows:
+
+    ADD_*  -> ADD and ADC. carry << 16 | op1 << 8 | op2, 2 x 128 KB.
+    SUB_*  -> SUB and SBC. carry << 16 | op1 << 8 | op2, 2 x 128 KB.
+    CP_FLAGS -> CP, which only sets F. op1 << 8 | op2, 64 KB.
+    INC_*  -> INC. carry << 8 | value, 2 x 512 B.
+    DEC_*  -> DEC. carry << 8 | value, 2 x 512 B.
+    DAA_*  -> DAA. A << 3 | N, H and C as bits 2-0, 2 x 2 KB.
+    SHIFTS -> The CB prefixed rotates and shifts, RLC, RRC, RL, RR, SLA,
+              SRA, SWAP and SRL, each with a pair of tables indexed by
+              carry << 8 | value, 2 x 512 B each.
+
+carry is the C flag as 0 or 1. As FLAG_C is bit 4 of F, (F & FLAG_C) << 12
+is the carry already shifted in to place for ADD_* and SUB_*, and
+(F & FLAG_C) << 4 for INC_* and DEC_*. About 590 KB in total, built once when
+this module is imported.
+"""
+from registers import FLAG_C, FLAG_H, FLAG_N, FLAG_Z
+
+
+def _add(op1, op2, carry):
+    op2 += carry
+    ret = op1 + op2
+    f = 0
+    if ret > 255:
+        f |= FLAG_C
+    if ((op1 & 0xF) + (op2 & 0xF) & 0x10) > 0:
+        f |= FLAG_H
+    if ret == 0:
+        f |= FLAG_Z
+    return ret & 0xFF, f
+
+
+def _sub(op1, op2, carry):
+    op2 += carry
+    ret = op1 - op2
+    f = FLAG_N
+    if ret < 0:
+        f |= FLAG_C
+    if (((op1 & 0xF) - (op2 & 0xF)) & 0x10) > 0:
+        f |= FLAG_H
+    if ret == 0:
+        f |= FLAG_Z
+    return ret & 0xFF, f
+
+
+def _cp(op1, op2):
+    f = FLAG_N
+    if op1 == op2:
+        f |= FLAG_Z
+    if (((op1 & 0xF) - (op2 & 0xF)) & 0x10) == 0:
+        f |= FLAG_H
+    if op1 < op2:
+        f |= FLAG_C
+    return f
+
+
+def _inc(value, carry):
+    ret = (value + 1) & 0xFF
+    f = FLAG_C if carry else 0
+    if ret == 0:
+        f |= FLAG_Z
+    if ((ret & 0xF) + 1 & 0x10) > 0:
+        f |= FLAG_H
+    return ret, f
+
+
+def _dec(value, carry):
+    ret = (value - 1) & 0xFF
+    f = (FLAG_C if carry else 0) | FLAG_N
+    if value == 1:
+        f |= FLAG_Z
+    return ret, f
+
+
+def _daa(value, flags):
+    """
+    Credit to: http://forums.nesdev.com/viewtopic.php?t=9088
+    User: DParrot
+    Accessed: March 2nd, 2015
+    Written: Jul 29, 2010
+    :param flags: N, H and C as bits 2-0.
+    """
+    op1 = value
+    f_reg = flags << 4
+
+    if f_reg & FLAG_N:
+        if f_reg & FLAG_H or (op1 * 0xF) > 0x9:
+            op1 += 0x06
+        if f_reg & FLAG_C or op1 > 0x9F:
+            op1 += 0x60
+    else:
+        if f_reg & FLAG_H:
+            op1 = (op1 - 0x6) & 0xFF
+        if f_reg & FLAG_C:
+            op1 -= 0x60
+
+    f_reg &= ~0xa0  # & with complement of Z and H position
+
+    if (op1 & 0x100) == 0x100:
+        f_reg |= 0x10
+
+    op1 &= 0xFF
+
+    if op1 == 0:
+        f_reg |= 0x80
+
+    return op1, f_reg
+
+
+def _rotate(name, value, carry):
+    """
+    :return: (result, flags) of one of the SHIFTS.
+    """
+    if name == "RLC":
+        ret, out = (value << 1 | value >> 7) & 0xFF, value >> 7
+    elif name == "RRC":
+        ret, out = (value >> 1 | value << 7) & 0xFF, value & 1
+    elif name == "RL":
+        ret, out = (value << 1 | carry) & 0xFF, value >> 7
+    elif name == "RR":
+        ret, out = value >> 1 | carry << 7, value & 1
+    elif name == "SLA":
+        ret, out = (value << 1) & 0xFF, value >> 7
+    elif name == "SRA":
+        ret, out = value >> 1 | value & 0x80, value & 1
+    elif name == "SWAP":
+        ret, out = (value << 4 | value >> 4) & 0xFF, 0
+    else:
+        ret, out = value >> 1, value & 1
+
+    f = FLAG_C if out else 0
+    if ret == 0:
+        f |= FLAG_Z
+    return ret, f
+
+
+def _tables(entries):
+    """
+    :param entries: (result, flags) of every index, in order.
+    :return: (results, flags) tables.
+    """
+    entries = list(entries)
+    return bytes(e[0] for e in entries), bytes(e[1] for e in entries)
+
+
+ADD_RESULT, ADD_FLAGS = _tables(_add(op1, op2, carry)
+                                for carry in range(2)
+                                for op1 in range(256)
+                                for op2 in range(256))
+
+SUB_RESULT, SUB_FLAGS = _tables(_sub(op1, op2, carry)
+                                for carry in range(2)
+                                for op1 in range(256)
+                                for op2 in range(256))
+
+CP_FLAGS = bytes(_cp(op1, op2) for op1 in range(256) for op2 in range(256))
+
+INC_RESULT, INC_FLAGS = _tables(_inc(value, carry)
+                                for carry in range(2) for value in range(256))
+
+DEC_RESULT, DEC_FLAGS = _tables(_dec(value, carry)
+                                for carry in range(2) for value in range(256))
+
+DAA_RESULT, DAA_FLAGS = _tables(_daa(value, flags)
+                                for value in range(256) for flags in range(8))
+
+SHIFTS = {name: _tables(_rotate(name, value, carry)
+                        for carry in range(2) for value in range(256))
+          for name in ("RLC", "RRC", "RL", "RR", "SLA", "SRA", "SWAP", "SRL")}
@@ -0,0 +1,226 @@
+"""
+Translation cache for the CPU.
+
+Straight-line runs of guest code are decoded once in to a Block, which holds
+the handler, address and size of every instruction in the run, and is then
+replayed by CPU.run without touching the opcode tables again.
+
+Blocks are keyed by (bank, PC):
+    0x0000-0x3FFF -> Fixed ROM bank, never invalidated.
+    0x4000-0x7FFF -> Switchable ROM bank. Each bank has its own table, and
+                     switching banks swaps the active table.
+    0xC000-0xDFFF -> Work RAM. Invalidated when a covered address is written.
+    0xFF80-0xFFFE -> High RAM. Invalidated when a covered address is written.
+
+Code running anywhere else is decoded on every visit and never cached.
+
+Common runs of instructions in a block are replaced by a single fused
+handler when it is decoded, see fusion.py.
+"""
+import logging
+import loops
+from fusion import Fusion
+
+# Instructions which may change the program counter or the interrupt state
+# end a block, so that everything after them is decoded from the new state.
+TERMINATORS = frozenset([
+    "JP", "JR", "CALL", "RET", "RETI", "RST", "HALT", "STOP", "EI", "DI",
+])
+
+# Upper bound on the number of instructions in a single block.
+MAX_BLOCK_SIZE = 64
+
+
+class Block(object):
+    """
+    A decoded run of instructions.
+    """
+    __slots__ = ("start", "end", "ops", "cycles", "loop")
+
+    def __init__(self, start, end, ops, cycles, loop=None):
+        """
+        :param start: Address of the first instruction.
+        :param end: Address one past the last byte of the last instruction.
+        :param ops: Tuple of (pc, handler, size) for each instruction.
+        :param cycles: Sum of the cycles of every instruction in the block.
+        :param loop: How the block loops back to itself, see loops.classify.
+        """
+        self.start = start
+        self.end = end
+        self.ops = ops
+        self.cycles = cycles
+        self.loop = loop
+
+
+class BlockCache(object):
+
+    def __init__(self, cpu, mem, codes):
+        """
+        :type cpu: CPU
+        :type mem: MemoryController
+        :type codes: OpcodeParser
+        """
+        self._log = logging.getLogger("BlockCache")
+        self._cpu = cpu
+        self._mem = mem
+        self._codes = codes
+
+        self._fixed = {}
+        self._banks = {}
+        self._banked = self._banks.setdefault(mem.rom_bank, {})
+        self._ram = {}
+        # Start addresses of the RAM blocks which cover each page.
+        self._ram_pages = {}
+
+        # Replaces common runs of instructions with superinstructions.
+        self.fusion = Fusion(cpu, mem)
+
+        mem.block_cache = self
+
+    def lookup(self, pc):
+        """
+        Returns the block starting at pc, decoding it if it is not cached.
+        :param pc: The address of the first instruction of the block.
+        :return: Block
+        """
+        if pc < 0x4000:
+            table = self._fixed
+        elif pc < 0x8000:
+            table = self._banked
+        elif 0xC000 <= pc <= 0xDFFF or 0xFF80 <= pc <= 0xFFFE:
+            table = self._ram
+        else:
+            return self.decode(pc)
+
+        block = table.get(pc)
+        if block is None:
+            block = self.decode(pc)
+            table[pc] = block
+            if table is self._ram:
+                self._mark_code_pages(block)
+        return block
+
+    def select_bank(self, bank):
+        """
+        Swaps the table used for the 0x4000-0x7FFF region. Called by the
+        memory controller whenever the ROM bank changes.
+        :param bank: The newly selected ROM bank.
+        """
+        self._banked = self._banks.setdefault(bank, {})
+
+    def invalidate(self, byte):
+        """
+        Drops every RAM block which covers the written address. Writes to the
+        rest of a page holding code, e.g. the stack next to a routine in high
+        RAM, only look at the blocks on that page.
+        :param byte: The address which was written.
+        """
+        starts = self._ram_pages.get(byte >> 8)
+        if not starts:
+            return
+        ram = self._ram
+        for block in [ram[pc] for pc in starts]:
+            if block.start <= byte < block.end:
+                del ram[block.start]
+                self._drop(block)
+
+    def _drop(self, block):
+        """
+        Forgets a RAM block's pages, clearing the mark of those which no
+        longer hold any code.
+        """
+        code_pages = self._mem.code_pages
+        for p in self._pages_of(block):
+            starts = self._ram_pages[p]
+            starts.discard(block.start)
+            if not starts:
+                del self._ram_pages[p]
+                code_pages[p] = 0
+
+    def clear(self):
+        """
+        Drops every cached block.
+        """
+        self._fixed.clear()
+        self._banks.clear()
+        self._banked = self._banks.setdefault(self._mem.rom_bank, {})
+        self._ram.clear()
+        self._ram_pages.clear()
+        for p in range(0x100):
+            self._mem.code_pages[p] = 0
+
+    @staticmethod
+    def _pages_of(block):
+        return [p & 0xFF for p in range(block.start >> 8, ((block.end - 1) >> 8) + 1)]
+
+    def _mark_code_pages(self, block):
+        code_pages = self._mem.code_pages
+        for p in self._pages_of(block):
+            code_pages[p] = 1
+            self._ram_pages.setdefault(p, set()).add(block.start)
+
+    def decode(self, start, limit=MAX_BLOCK_SIZE):
+        """
+        Decodes the block starting at start, without caching it. The block
+        ends early before any of the CPU's breakpoints.
+        :param start: The address of the first instruction.
+        :param limit: The maximum number of instructions in the block.
+        :return: Block
+        """
+        read = self._mem.read
+        handlers = self._cpu.instructions.map
+        cb_handlers = self._cpu.instructions.cb_map
+        instructions = self._codes.instructions
+        cb_instructions = self._codes.cb_instructions
+        breakpoints = self._cpu.breakpoints
+
+        ops = []
+        instrs = []
+        decoded = []
+        cycles = 0
+        pc = start
+        while True:
+            data = read(pc)
+            if data == 0xCB:
+                cb = read(pc + 1)
+                instr = cb_instructions[cb]
+                func = cb_handlers[cb]
+                name = instr.op_name
+                size = instr.bytes
+                cycles += instr.cycles[0]
+            else:
+                instr = instructions[data]
+                if type(instr) is int:
+                    # Undefined opcode, skip over it.
+                    func = self._undefined
+                    name = None
+                    size = 1
+                    decoded = None
+                else:
+                    func = handlers[data]
+                    name = instr.op_name
+                    size = instr.bytes
+                    cycles += instr.cycles[0]
+
+            ops.append((pc, func, size))
+            instrs.append(instr if name is not None else None)
+            if decoded is not None:
+                decoded.append((pc, instr))
+            pc += size
+
+            if name in TERMINATORS or len(ops) >= limit:
+                break
+            if pc in breakpoints:
+                break
+            # Don't let a block run across a bank boundary.
+            if (pc >> 14) != (start >> 14):
+                break
+
+        loop = None
+        if decoded:
+            loop = loops.classify(start, decoded, read)
+        return Block(start, pc, tuple(self.fusion.fuse(ops, instrs)), cycles, loop)
+
+    @staticmethod
+    def _undefined():
+        pass
@@ -1,6 +1,9 @@
 import logging
 import os.path
 
+# Size of a ROM bank, mapped at 0x0000-0x3FFF or 0x4000-0x7FFF.
+ROM_BANK_SIZE = 0x4000
+
 
 class CartridgeType(object):
 
@@ -63,7 +66,9 @@ class CartridgeType(object):
             0x03: (256 * 1024, 16),
             0x04: (512 * 1024, 32),
             0x05: (1024 * 1024, 64),
-            0x06: (2048 * 2014, 128),
+            0x06: (2048 * 1024, 128),
+            0x07: (4096 * 1024, 256),
+            0x08: (8192 * 1024, 512),
             0x52: (1152 * 1024, 72),
             0x53: (1280 * 1024, 80),
             0x54: (1536 * 1024, 96),
@@ -99,6 +104,10 @@ class Cartridge(object):
         self.title = self._get_title()
         self.cartridge_type = self._data[0x147]
         self.cartridge_type_string = self._get_cartridge_type()
+        self.has_battery = "BATT" in self.cartridge_type_string
+
+        # Where battery backed RAM is saved, next to the ROM.
+        self.save_path = os.path.splitext(filename)[0] + ".sav"
 
         self.designation = self._data[0x013F:0x0142].decode("utf-8")
         self.color_compatible = self._data[0x0143]
@@ -115,6 +124,9 @@ class Cartridge(object):
             self.ram_type
         )
 
+        # The ROM, split in to banks once, see get_rom_bank.
+        self._rom_banks = self._slice_rom_banks()
+
         self.destination = "JA" if self._data[0x14A] == 0 else "NA"
         self.rom_version = self._data[0x014C]
         self._log.debug(str(self))
@@ -122,7 +134,7 @@ class Cartridge(object):
     def __str__(self):
         output = "Rom variable summary:\n"
         for ele in self.__dict__:
-            if ele == "_data":
+            if ele in ("_data", "_rom_banks"):
                 continue
 
             value = self.__dict__[ele]
@@ -147,6 +159,28 @@ class Cartridge(object):
     def get_data(self):
         return self._data
 
+    def get_rom_bank(self, bank):
+        """
+        :param bank: The bank number. Like the real memory controllers, bits
+                     beyond the number of banks in the ROM are ignored.
+        :return: A memoryview of the 16 KB bank.
+        """
+        return self._rom_banks[bank % len(self._rom_banks)]
+
+    def _slice_rom_banks(self):
+        """
+        :return: A memoryview of each 16 KB bank of the ROM. There are at
+                 least two, and a short last bank is padded with 0xFF.
+        """
+        count = max(2, -(-len(self._data) // ROM_BANK_SIZE))
+        data = self._data
+        if len(data) != count * ROM_BANK_SIZE:
+            data = data + b"\xFF" * (count * ROM_BANK_SIZE - len(data))
+
+        view = memoryview(data)
+        return [view[bank * ROM_BANK_SIZE:(bank + 1) * ROM_BANK_SIZE]
+                for bank in range(count)]
+
     def _get_title(self):
         log = self._log.getChild("_get_title")
 
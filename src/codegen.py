@@ -0,0 +1,451 @@
+"""
+Generates the opcode handlers used by InstructionMap.
+
+Every instruction loaded by the OpcodeParser, un-prefixed or CB prefixed, is
+matched against SEMANTICS by its mnemonic and the kinds of its operands, e.g.
+"LD B C" -> ("LD", "r", "r").
+The matching entry is either:
+    - A Python template, which is formatted with the operands baked in (as
+      register indices, flag masks, etc.) and becomes the body of a handler.
+    - "@helper" or "@helper(args)", which binds an InstructionMap helper
+      directly (with functools.partial when it takes arguments).
+
+Instructions without an entry, and undefined opcodes, are no-ops.
+
+The generated source is compiled once and the code object is cached in the
+user's cache directory, keyed by a hash of the source and the interpreter's
+bytecode version.
+"""
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os.path
+from registers import *
+
+# Kept in the user's cache directory, out of the source tree.
+CACHE_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or
+                          os.path.join(os.path.expanduser("~"), ".cache"),
+                          "geeboy", "handlers.cache")
+
+REGISTERS = {"A": A, "B": B, "C": C, "D": D, "E": E, "H": H, "L": L}
+PAIRS = {"BC": BC, "DE": DE, "HL": HL, "AF": AF}
+CONDITIONS = {
+    "NZ": (FLAG_Z, 0),
+    "Z": (FLAG_Z, 1),
+    "NC": (FLAG_C, 0),
+    "C": (FLAG_C, 1),
+}
+BRANCHES = ("JP", "JR", "CALL", "RET")
+BIT_OPS = ("BIT", "RES", "SET")
+SHIFTS = ("RLC", "RRC", "RL", "RR", "SLA", "SRA", "SWAP", "SRL")
+
+# Tables of alu.py bound in to the generated handlers.
+ALU_TABLES = ("ADD_RESULT", "ADD_FLAGS", "SUB_RESULT", "SUB_FLAGS", "CP_FLAGS",
+              "INC_RESULT", "INC_FLAGS", "DEC_RESULT", "DEC_FLAGS",
+              "DAA_RESULT", "DAA_FLAGS")
+
+_PAIR_READ = "(r[{hi}] << 8 | r[{lo}])"
+
+
+def relative_target(pc, offset):
+    """
+    The address a JR jumps to. Every JR handler, and everything else which
+    decodes one, e.g. fusion.py and loops.py, goes through this.
+    :param pc: The address of the JR.
+    :param offset: Its operand, a signed byte relative to the end of the JR.
+    :return: The address.
+    """
+    return (pc + 2 + (offset - 0x100 if offset & 0x80 else offset)) & 0xFFFF
+
+
+SEMANTICS = {
+    # 8-bit loads
+    ("LD", "r", "r"): "r[{r1}] = r[{r2}]",
+    ("LD", "r", "d8"): "r[{r1}] = read(cpu.pc + 1)",
+    ("LD", "r", "(rr)"): "r[{r1}] = read(r[{hi2}] << 8 | r[{lo2}])",
+    ("LD", "(rr)", "r"): "write(r[{hi1}] << 8 | r[{lo1}], r[{r2}])",
+    ("LD", "(rr)", "d8"): "write({pair1}, read(cpu.pc + 1))",
+    ("LD", "r", "(a16)"): "r[{r1}] = read(read16(cpu.pc + 1))",
+    ("LD", "(a16)", "r"): "write(read16(cpu.pc + 1), r[{r2}])",
+    ("LD", "r", "(C)"): "r[{r1}] = read(0xFF00 + r[{C}])",
+    ("LD", "(C)", "r"): "write(0xFF00 + r[{C}], r[{r2}])",
+    ("LDH", "r", "(a8)"): "r[{r1}] = read(0xFF00 + read(cpu.pc + 1))",
+    ("LDH", "(a8)", "r"): "write(0xFF00 + read(cpu.pc + 1), r[{r2}])",
+    ("LD", "(HL+)", "r"): """
+        hl = r[{H}] << 8 | r[{L}]
+        write(hl, r[{r2}])
+        hl += 1
+        r[{H}] = (hl >> 8) & 0xFF
+        r[{L}] = hl & 0xFF
+    """,
+    ("LD", "r", "(HL+)"): """
+        hl = r[{H}] << 8 | r[{L}]
+        r[{r1}] = read(hl)
+        hl += 1
+        r[{H}] = (hl >> 8) & 0xFF
+        r[{L}] = hl & 0xFF
+    """,
+    ("LD", "(HL-)", "r"): """
+        hl = r[{H}] << 8 | r[{L}]
+        write(hl, r[{r2}])
+        hl -= 1
+        r[{H}] = (hl >> 8) & 0xFF
+        r[{L}] = hl & 0xFF
+    """,
+    ("LD", "r", "(HL-)"): """
+        hl = r[{H}] << 8 | r[{L}]
+        r[{r1}] = read(hl)
+        hl -= 1
+        r[{H}] = (hl >> 8) & 0xFF
+        r[{L}] = hl & 0xFF
+    """,
+
+    # 16-bit loads
+    ("LD", "rr", "d16"): """
+        value = read16(cpu.pc + 1)
+        r[{hi1}] = value >> 8
+        r[{lo1}] = value & 0xFF
+    """,
+    ("LD", "SP", "d16"): "@ld_sp_im16",
+    ("LD", "SP", "rr"): "@ld_sp_rc({rc2})",
+    ("LD", "(a16)", "SP"): "@ld_mim16_sp",
+    ("LD", "rr", "SP+r8"): "@ldhl_sp_im8",
+    ("PUSH", "rr"): "@push({rc1})",
+    ("POP", "rr"): "@pop({rc1})",
+
+    # Jumps, calls and returns
+    ("JP", "a16"): "cpu.pc = read16(cpu.pc + 1) - 3",
+    ("JP", "cc", "a16"): """
+        if {test}:
+            cpu.pc = read16(cpu.pc + 1) - 3
+    """,
+    ("JP", "(rr)"): "@jp_mrc({rc1})",
+    ("JR", "r8"): "cpu.pc = relative_target(cpu.pc, read(cpu.pc + 1)) - 2",
+    ("JR", "cc", "r8"): """
+        if {test}:
+            cpu.pc = relative_target(cpu.pc, read(cpu.pc + 1)) - 2
+    """,
+    ("CALL", "a16"): "@call",
+    ("CALL", "cc", "a16"): "@call_cc({flag}, {val})",
+    ("RET",): "@ret",
+    ("RET", "cc"): "@ret_cc({flag}, {val})",
+    ("RETI",): "@reti",
+    ("RST", "n"): "@rst_im8({n})",
+
+    # 8-bit arithmetic, see alu.py for the table layouts
+    ("ADD", "r", "r"): "i = r[{A}] << 8 | r[{r2}]\n{add}",
+    ("ADD", "r", "d8"): "i = r[{A}] << 8 | read(cpu.pc + 1)\n{add}",
+    ("ADD", "r", "(rr)"): "i = r[{A}] << 8 | read({pair2})\n{add}",
+    ("ADC", "r", "r"): "i = {carry16} | r[{A}] << 8 | r[{r2}]\n{add}",
+    ("ADC", "r", "d8"): "i = {carry16} | r[{A}] << 8 | read(cpu.pc + 1)\n{add}",
+    ("ADC", "r", "(rr)"): "i = {carry16} | r[{A}] << 8 | read({pair2})\n{add}",
+    ("SUB", "r"): "i = r[{A}] << 8 | r[{r1}]\n{sub}",
+    ("SUB", "d8"): "i = r[{A}] << 8 | read(cpu.pc + 1)\n{sub}",
+    ("SUB", "(rr)"): "i = r[{A}] << 8 | read({pair1})\n{sub}",
+    ("SBC", "r", "r"): "i = {carry16} | r[{A}] << 8 | r[{r2}]\n{sub}",
+    ("SBC", "r", "d8"): "i = {carry16} | r[{A}] << 8 | read(cpu.pc + 1)\n{sub}",
+    ("SBC", "r", "(rr)"): "i = {carry16} | r[{A}] << 8 | read({pair2})\n{sub}",
+    ("CP", "r"): "r[{F}] = CP_FLAGS[r[{A}] << 8 | r[{r1}]]",
+    ("CP", "d8"): "r[{F}] = CP_FLAGS[r[{A}] << 8 | read(cpu.pc + 1)]",
+    ("CP", "(rr)"): "r[{F}] = CP_FLAGS[r[{A}] << 8 | read({pair1})]",
+    ("INC", "r"): """
+        i = (r[{F}] & {FLAG_C}) << 4 | r[{r1}]
+        r[{F}] = INC_FLAGS[i]
+        r[{r1}] = INC_RESULT[i]
+    """,
+    ("DEC", "r"): """
+        i = (r[{F}] & {FLAG_C}) << 4 | r[{r1}]
+        r[{F}] = DEC_FLAGS[i]
+        r[{r1}] = DEC_RESULT[i]
+    """,
+    ("INC", "(rr)"): "@inc_mrc({rc1})",
+    ("DEC", "(rr)"): "@dec_mrc({rc1})",
+
+    # 8-bit logic
+    ("AND", "r"): "r[{A}] = ret = r[{A}] & r[{r1}]\n{and}",
+    ("AND", "d8"): "r[{A}] = ret = r[{A}] & read(cpu.pc + 1)\n{and}",
+    ("AND", "(rr)"): "r[{A}] = ret = r[{A}] & read({pair1})\n{and}",
+    ("OR", "r"): "r[{A}] = ret = r[{A}] | r[{r1}]\n{or}",
+    ("OR", "d8"): "r[{A}] = ret = r[{A}] | read(cpu.pc + 1)\n{or}",
+    ("OR", "(rr)"): "r[{A}] = ret = r[{A}] | read({pair1})\n{or}",
+    ("XOR", "r"): "r[{A}] = ret = r[{A}] ^ r[{r1}]\n{or}",
+    ("XOR", "d8"): "r[{A}] = ret = r[{A}] ^ read(cpu.pc + 1)\n{or}",
+    ("XOR", "(rr)"): "r[{A}] = ret = r[{A}] ^ read({pair1})\n{or}",
+
+    # 16-bit arithmetic
+    ("INC", "rr"): """
+        ret = ((r[{hi1}] << 8 | r[{lo1}]) + 1) & 0xFFFF
+        r[{hi1}] = ret >> 8
+        r[{lo1}] = ret & 0xFF
+    """,
+    ("DEC", "rr"): """
+        ret = ((r[{hi1}] << 8 | r[{lo1}]) - 1) & 0xFFFF
+        r[{hi1}] = ret >> 8
+        r[{lo1}] = ret & 0xFF
+    """,
+    ("INC", "SP"): "@inc_sp",
+    ("DEC", "SP"): "@dec_sp",
+    ("ADD", "rr", "rr"): "@add_hl_rc({rc2})",
+    ("ADD", "rr", "SP"): "@add_hl_sp",
+
+    # Miscellaneous
+    ("NOP",): "@nop",
+    ("HALT",): "@halt",
+    ("STOP", "0"): "@stop",
+    ("DI",): "@di",
+    ("EI",): "@ei",
+    ("DAA",): """
+        i = r[{A}] << 3 | (r[{F}] >> 4) & 0x7
+        r[{F}] = DAA_FLAGS[i]
+        r[{A}] = DAA_RESULT[i]
+    """,
+    ("CPL",): "@cpl",
+    ("CCF",): "@ccf",
+    ("SCF",): "@scf",
+
+    # CB prefixed bit operations
+    ("BIT", "b", "r"): "r[{F}] = r[{F}] & {FLAG_C} | ({FLAG_H} if r[{r2}] & {mask} else {FLAG_ZH})",
+    ("BIT", "b", "(rr)"): "r[{F}] = r[{F}] & {FLAG_C} | ({FLAG_H} if read({pair2}) & {mask} else {FLAG_ZH})",
+    ("RES", "b", "r"): "r[{r2}] &= {unmask}",
+    ("RES", "b", "(rr)"): """
+        address = {pair2}
+        write(address, read(address) & {unmask})
+    """,
+    ("SET", "b", "r"): "r[{r2}] |= {mask}",
+    ("SET", "b", "(rr)"): """
+        address = {pair2}
+        write(address, read(address) | {mask})
+    """,
+}
+
+# CB prefixed rotates and shifts, which look up their SHIFTS table in alu.py.
+for _name in SHIFTS:
+    SEMANTICS[(_name, "r")] = """
+        i = (r[{F}] & {FLAG_C}) << 4 | r[{r1}]
+        r[{F}] = {shift}_FLAGS[i]
+        r[{r1}] = {shift}_RESULT[i]
+    """
+    SEMANTICS[(_name, "(rr)")] = """
+        address = {pair1}
+        i = (r[{F}] & {FLAG_C}) << 4 | read(address)
+        r[{F}] = {shift}_FLAGS[i]
+        write(address, {shift}_RESULT[i])
+    """
+
+# Shared tails of the ALU templates, which look up the index i in alu.py.
+FRAGMENTS = {
+    "add": """
+        r[{F}] = ADD_FLAGS[i]
+        r[{A}] = ADD_RESULT[i]
+    """,
+    "sub": """
+        r[{F}] = SUB_FLAGS[i]
+        r[{A}] = SUB_RESULT[i]
+    """,
+    "and": "r[{F}] = {FLAG_Z} | {FLAG_H} if ret == 0 else {FLAG_H}",
+    "or": "r[{F}] = {FLAG_Z} if ret == 0 else 0",
+}
+
+
+def _dedent(text):
+    lines = [line for line in text.split("\n") if line.strip()]
+    indent = min(len(line) - len(line.lstrip()) for line in lines)
+    return [line[indent:] for line in lines]
+
+
+def _expand(template):
+    """
+    :return: The lines of a template, with any FRAGMENTS markers replaced.
+    """
+    lines = []
+    for line in _dedent(template):
+        marker = line.strip()
+        if marker[1:-1] in FRAGMENTS and marker == "{" + marker[1:-1] + "}":
+            indent = line[:len(line) - len(line.lstrip())]
+            lines.extend(indent + fragment
+                         for fragment in _dedent(FRAGMENTS[marker[1:-1]]))
+        else:
+            lines.append(line)
+    return lines
+
+
+def _classify(mnemonic, index, operand):
+    """
+    :return: The kind of an operand, as used in the SEMANTICS keys.
+    """
+    if index == 0 and mnemonic in BRANCHES and operand in CONDITIONS:
+        return "cc"
+    if index == 0 and mnemonic in BIT_OPS:
+        return "b"
+    if operand in REGISTERS:
+        return "r"
+    if operand in PAIRS:
+        return "rr"
+    if operand[0] == "(" and operand[1:-1] in PAIRS:
+        return "(rr)"
+    if mnemonic == "RST":
+        return "n"
+    return operand
+
+
+def _fields(instr):
+    """
+    :return: The values substituted in to an instruction's template.
+    """
+    fields = {"A": A, "F": F, "C": C, "H": H, "L": L,
+              "FLAG_Z": hex(FLAG_Z), "FLAG_N": hex(FLAG_N),
+              "FLAG_H": hex(FLAG_H), "FLAG_C": hex(FLAG_C),
+              "FLAG_ZH": hex(FLAG_Z | FLAG_H),
+              "carry16": "(r[{}] & {}) << 12".format(F, hex(FLAG_C))}
+    if instr.op_name in SHIFTS:
+        fields["shift"] = instr.op_name
+
+    for i, operand in enumerate(instr.ops, 1):
+        kind = _classify(instr.op_name, i - 1, operand)
+        if kind == "r":
+            fields["r{}".format(i)] = REGISTERS[operand]
+        elif kind in ("rr", "(rr)"):
+            pair = PAIRS[operand.strip("()")]
+            fields["rc{}".format(i)] = pair
+            fields["hi{}".format(i)] = pair[0]
+            fields["lo{}".format(i)] = pair[1]
+            fields["pair{}".format(i)] = _PAIR_READ.format(hi=pair[0],
+                                                           lo=pair[1])
+        elif kind == "cc":
+            flag, val = CONDITIONS[operand]
+            fields["flag"] = hex(flag)
+            fields["val"] = val
+            test = "r[{}] & {}".format(F, hex(flag))
+            fields["test"] = test if val else "not ({})".format(test)
+        elif kind == "n":
+            fields["n"] = hex(int(operand[:-1], 16))
+        elif kind == "b":
+            fields["mask"] = hex(1 << int(operand))
+            fields["unmask"] = hex(~(1 << int(operand)) & 0xFF)
+    return fields
+
+
+def _key(instr):
+    kinds = [_classify(instr.op_name, i, op) for i, op in enumerate(instr.ops)]
+    return tuple([instr.op_name] + kinds)
+
+
+def _handlers(instructions, prefix, body):
+    """
+    Appends the definitions of the handlers of a page of instructions to body.
+    :param prefix: Prefix of the handlers' names.
+    :return: The names of the 256 handlers.
+    """
+    names = []
+    for opcode, instr in enumerate(instructions):
+        name = "{}_{:02x}".format(prefix, opcode)
+        names.append(name)
+        semantics = None
+        if type(instr) is not int:
+            semantics = SEMANTICS.get(_key(instr))
+
+        if semantics is None:
+            body.append("{} = _unimplemented".format(name))
+            continue
+
+        fields = _fields(instr)
+        if semantics[0] == "@":
+            helper, _, args = semantics[1:].partition("(")
+            if args:
+                body.append("{} = partial(im.{}, {})  # {}".format(
+                    name, helper, args[:-1].format(**fields), instr))
+            else:
+                body.append("{} = im.{}  # {}".format(name, helper, instr))
+            continue
+
+        body.append("def {}():  # {}".format(name, instr))
+        for line in _expand(semantics):
+            body.append("    " + line.format(**fields))
+    return names
+
+
+def generate_source(codes):
+    """
+    Generates the source of a build(im, cpu, mem) function, which returns the
+    lists of 256 handlers for the un-prefixed and the CB prefixed opcodes. The
+    function expects the alu module and relative_target as globals.
+    :type codes: OpcodeParser
+    :return: The generated source.
+    """
+    body = []
+    names = _handlers(codes.instructions, "op", body)
+    cb_names = _handlers(codes.cb_instructions, "cb", body)
+
+    lines = [
+        "def build(im, cpu, mem):",
+        "    r = cpu.r",
+        "    read = mem.read",
+        "    read16 = mem.read16",
+        "    write = mem.write",
+    ]
+    lines.extend("    {0} = alu.{0}".format(name) for name in ALU_TABLES)
+    lines.extend("    {0}_RESULT, {0}_FLAGS = alu.SHIFTS[\"{0}\"]".format(name)
+                 for name in SHIFTS)
+    lines += [
+        "",
+        "    def _unimplemented():",
+        "        pass",
+        "",
+    ]
+    lines.extend("    " + line for line in body)
+    for page, page_names in (("ops", names), ("cb_ops", cb_names)):
+        lines.append("")
+        lines.append("    {} = [".format(page))
+        lines.extend("        {},".format(name) for name in page_names)
+        lines.append("    ]")
+    lines.append("    return ops, cb_ops")
+    return "\n".join(lines) + "\n"
+
+
+def _load_code(source, path):
+    """
+    Compiles the source, reusing the cached code object at path when it was
+    compiled from the same source by the same interpreter version.
+    """
+    log = logging.getLogger("codegen")
+    key = hashlib.sha1(importlib.util.MAGIC_NUMBER +
+                       source.encode("utf-8")).digest()
+
+    if path and os.path.isfile(path):
+        with open(path, "rb") as handle:
+            data = handle.read()
+        if data[:len(key)] == key:
+            try:
+                return marshal.loads(data[len(key):])
+            except (EOFError, ValueError, TypeError):
+                log.warning("Discarding corrupt handler cache [{}].".format(path))
+
+    code = compile(source, "<generated handlers>", "exec")
+    if path:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as handle:
+                handle.write(key + marshal.dumps(code))
+        except OSError as e:
+            log.debug("Unable to write handler cache [{}]: {}".format(path, e))
+    return code
+
+
+def build_handlers(im, cpu, mem, codes, cache_path=CACHE_PATH):
+    """
+    Builds the opcode handlers for a CPU.
+    :type im: InstructionMap
+    :type cpu: CPU
+    :type mem: MemoryController
+    :type codes: OpcodeParser
+    :param cache_path: Where to cache the compiled handlers, None to disable.
+    :return: (handlers, cb_handlers), lists of 256 handlers indexed by the
+             opcode, or by the opcode following the 0xCB prefix.
+    """
+    from functools import partial
+    import alu
+
+    namespace = {"partial": partial, "alu": alu, "relative_target": relative_target}
+    exec(_load_code(generate_source(codes), cache_path), namespace)
+    return namespace["build"](im, cpu, mem)
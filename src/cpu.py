@@ -1,4 +1,11 @@
 import logging
+from alu import *
+from blockcache import BlockCache
+from loops import COUNTDOWN
+from codegen import build_handlers
+from registers import *
+from scheduler import NEVER, Scheduler
+from timer import Timer
 
 
 class InstructionMap(object):
@@ -10,387 +17,24 @@ class InstructionMap(object):
         :param cpu:
         :return:
         """
-        self.map = []
-        self._prepare_instruction_map()
         self.c = cpu
         self.m = mem
+        self.map = []
+        self.cb_map = []
+        self._prepare_instruction_map()
 
     def _prepare_instruction_map(self):
-        self.map = [
-            # 00
-            lambda: self.nop(),                 # [00] NOP
-            lambda: self.ld_rc_im16("BC"),      # [01] LD BC d16
-            lambda: self.ld_mrc_r("BC", "A"),   # [02] LD (BC) A
-            lambda: self.inc_rc("BC"),          # [03] INC BC
-            lambda: self.inc_r("B"),            # [04] INC B
-            lambda: self.dec_r("B"),            # [05] DEC B
-            lambda: self.ld_r_im8("B"),         # [06] LD B d8
-            lambda: None,                       # [07] RLCA
-            lambda: self.ld_mim16_sp(),         # [08] LD (a16) SP
-            lambda: self.add_hl_rc("BC"),       # [09] ADD HL BC
-            lambda: self.ld_r_mrc("A", "BC"),   # [0a] LD A (BC)
-            lambda: self.dec_rc("BC"),          # [0b] DEC BC
-            lambda: self.inc_r("C"),            # [0c] INC C
-            lambda: self.dec_r("C"),            # [0d] DEC C
-            lambda: self.ld_r_im8("C"),         # [0e] LD C d8
-            lambda: None,                       # [0f] RRCA
-
-            # 10
-            lambda: self.stop(),                # [10] STOP 0
-            lambda: self.ld_rc_im16("DE"),      # [11] LD DE d16
-            lambda: self.ld_mrc_r("DE", "A"),   # [12] LD (DE) A
-            lambda: self.inc_rc("DE"),          # [13] INC DE
-            lambda: self.inc_r("D"),            # [14] INC D
-            lambda: self.dec_r("D"),            # [15] DEC D
-            lambda: self.ld_r_im8("D"),         # [16] LD D d8
-            lambda: None,     # [17] RLA
-            lambda: self.jp_oim8(),             # [18] JR r8
-            lambda: self.add_hl_rc("DE"),       # [19] ADD HL DE
-            lambda: self.ld_r_mrc("A", "DE"),   # [1a] LD A (DE)
-            lambda: self.dec_rc("DE"),          # [1b] DEC DE
-            lambda: self.inc_r("E"),            # [1c] INC E
-            lambda: self.dec_r("E"),            # [1d] DEC E
-            lambda: self.ld_r_im8("E"),         # [1e] LD E d8
-            lambda: None,     # [1f] RRA
-
-            # 20
-            lambda: self.jp_cc_oim8("Z", 0),    # [20] JR NZ r8
-            lambda: self.ld_rc_im16("HL"),      # [21] LD HL d16
-            lambda: self.ld_hli_r("A"),         # [22] LD (HL+) A
-            lambda: self.inc_rc("HL"),          # [23] INC HL
-            lambda: self.inc_r("H"),            # [24] INC H
-            lambda: self.dec_r("H"),            # [25] DEC H
-            lambda: self.ld_r_im8("H"),         # [26] LD H d8
-            lambda: self.daa(),                 # [27] DAA
-            lambda: self.jp_cc_oim8("Z", 1),    # [28] JR Z r8
-            lambda: self.add_hl_rc("HL"),       # [29] ADD HL HL
-            lambda: self.ld_r_hli("A"),         # [2a] LD A (HL+)
-            lambda: self.dec_rc("HL"),          # [2b] DEC HL
-            lambda: self.inc_r("L"),            # [2c] INC L
-            lambda: self.dec_r("L"),            # [2d] DEC L
-            lambda: self.ld_r_im8("L"),         # [2e] LD L d8
-            lambda: self.cpl(),                 # [2f] CPL
-
-            # 30
-            lambda: self.jp_cc_oim8("C", 0),    # [30] JR NC r8
-            lambda: self.ld_sp_im16(),          # [31] LD SP d16
-            lambda: self.ld_hld_r("A"),         # [32] LD (HL-) A
-            lambda: self.inc_sp(),              # [33] INC SP
-            lambda: self.inc_mrc("HL"),         # [34] INC (HL)
-            lambda: self.dec_mrc("HL"),         # [35] DEC (HL)
-            lambda: self.ld_mrc_im8("HL"),      # [36] LD (HL) d8
-            lambda: self.scf(),                 # [37] SCF
-            lambda: self.jp_cc_oim8("C", 1),    # [38] JR C r8
-            lambda: self.add_hl_sp(),           # [39] ADD HL SP
-            lambda: self.ld_r_hld("A"),         # [3a] LD A (HL-)
-            lambda: self.dec_sp(),              # [3b] DEC SP
-            lambda: self.inc_r("A"),            # [3c] INC A
-            lambda: self.dec_r("A"),            # [3d] DEC A
-            lambda: self.ld_r_im8("A"),         # [3e] LD A d8
-            lambda: self.ccf(),                 # [3f] CCF
-
-            # 40
-            lambda: self.ld_r_r("B", "B"),      # [40] LD B B
-            lambda: self.ld_r_r("B", "C"),      # [41] LD B C
-            lambda: self.ld_r_r("B", "D"),      # [42] LD B D
-            lambda: self.ld_r_r("B", "E"),      # [43] LD B E
-            lambda: self.ld_r_r("B", "H"),      # [44] LD B H
-            lambda: self.ld_r_r("B", "L"),      # [45] LD B L
-            lambda: self.ld_r_mrc("B", "HL"),   # [46] LD B (HL)
-            lambda: self.ld_r_r("B", "A"),      # [47] LD B A
-            lambda: self.ld_r_r("C", "B"),      # [48] LD C B
-            lambda: self.ld_r_r("C", "C"),      # [49] LD C C
-            lambda: self.ld_r_r("C", "D"),      # [4a] LD C D
-            lambda: self.ld_r_r("C", "E"),      # [4b] LD C E
-            lambda: self.ld_r_r("C", "H"),      # [4c] LD C H
-            lambda: self.ld_r_r("C", "L"),      # [4d] LD C L
-            lambda: self.ld_r_mrc("C", "HL"),   # [4e] LD C (HL)
-            lambda: self.ld_r_r("C", "A"),      # [4f] LD C A
-
-            # 50
-            lambda: self.ld_r_r("D", "B"),      # [50] LD D B
-            lambda: self.ld_r_r("D", "C"),      # [51] LD D C
-            lambda: self.ld_r_r("D", "D"),      # [52] LD D D
-            lambda: self.ld_r_r("D", "E"),      # [53] LD D E
-            lambda: self.ld_r_r("D", "H"),      # [54] LD D H
-            lambda: self.ld_r_r("D", "L"),      # [55] LD D L
-            lambda: self.ld_r_mrc("D", "HL"),   # [56] LD D (HL)
-            lambda: self.ld_r_r("D", "A"),      # [57] LD D A
-            lambda: self.ld_r_r("E", "B"),      # [58] LD E B
-            lambda: self.ld_r_r("E", "C"),      # [59] LD E C
-            lambda: self.ld_r_r("E", "D"),      # [5a] LD E D
-            lambda: self.ld_r_r("E", "E"),      # [5b] LD E E
-            lambda: self.ld_r_r("E", "H"),      # [5c] LD E H
-            lambda: self.ld_r_r("E", "L"),      # [5d] LD E L
-            lambda: self.ld_r_mrc("E", "HL"),   # [5e] LD E (HL)
-            lambda: self.ld_r_r("E", "A"),      # [5f] LD E A
-
-            # 60
-            lambda: self.ld_r_r("H", "B"),      # [60] LD H B
-            lambda: self.ld_r_r("H", "C"),      # [61] LD H C
-            lambda: self.ld_r_r("H", "D"),      # [62] LD H D
-            lambda: self.ld_r_r("H", "E"),      # [63] LD H E
-            lambda: self.ld_r_r("H", "H"),      # [64] LD H H
-            lambda: self.ld_r_r("H", "L"),      # [65] LD H L
-            lambda: self.ld_r_mrc("H", "HL"),   # [66] LD H (HL)
-            lambda: self.ld_r_r("H", "A"),      # [67] LD H A
-            lambda: self.ld_r_r("L", "B"),      # [68] LD L B
-            lambda: self.ld_r_r("L", "C"),      # [69] LD L C
-            lambda: self.ld_r_r("L", "D"),      # [6a] LD L D
-            lambda: self.ld_r_r("L", "E"),      # [6b] LD L E
-            lambda: self.ld_r_r("L", "H"),      # [6c] LD L H
-            lambda: self.ld_r_r("L", "L"),      # [6d] LD L L
-            lambda: self.ld_r_mrc("L", "HL"),   # [6e] LD L (HL)
-            lambda: self.ld_r_r("L", "A"),      # [6f] LD L A
-
-            # 70
-            lambda: self.ld_mrc_r("HL", "B"),   # [70] LD (HL) B
-            lambda: self.ld_mrc_r("HL", "C"),   # [71] LD (HL) C
-            lambda: self.ld_mrc_r("HL", "D"),   # [72] LD (HL) D
-            lambda: self.ld_mrc_r("HL", "E"),   # [73] LD (HL) E
-            lambda: self.ld_mrc_r("HL", "H"),   # [74] LD (HL) H
-            lambda: self.ld_mrc_r("HL", "L"),   # [75] LD (HL) L
-            lambda: self.halt(),                # [76] HALT
-            lambda: self.ld_mrc_r("HL", "A"),   # [77] LD (HL) A
-            lambda: self.ld_r_r("A", "B"),      # [78] LD A B
-            lambda: self.ld_r_r("A", "C"),      # [79] LD A C
-            lambda: self.ld_r_r("A", "D"),      # [7a] LD A D
-            lambda: self.ld_r_r("A", "E"),      # [7b] LD A E
-            lambda: self.ld_r_r("A", "H"),      # [7c] LD A H
-            lambda: self.ld_r_r("A", "L"),      # [7d] LD A L
-            lambda: self.ld_r_mrc("A", "HL"),   # [7e] LD A (HL)
-            lambda: self.ld_r_r("A", "A"),      # [7f] LD A A
-
-            # 80
-            lambda: self.add_r_r("A", "B"),     # [80] ADD A B
-            lambda: self.add_r_r("A", "C"),     # [81] ADD A C
-            lambda: self.add_r_r("A", "D"),     # [82] ADD A D
-            lambda: self.add_r_r("A", "E"),     # [83] ADD A E
-            lambda: self.add_r_r("A", "H"),     # [84] ADD A H
-            lambda: self.add_r_r("A", "L"),     # [85] ADD A L
-            lambda: self.add_r_mrc("A", "HL"),  # [86] ADD A (HL)
-            lambda: self.add_r_r("A", "A"),     # [87] ADD A A
-            lambda: self.adc_r_r("A", "B"),     # [88] ADC A B
-            lambda: self.adc_r_r("A", "C"),     # [89] ADC A C
-            lambda: self.adc_r_r("A", "D"),     # [8a] ADC A D
-            lambda: self.adc_r_r("A", "E"),     # [8b] ADC A E
-            lambda: self.adc_r_r("A", "H"),     # [8c] ADC A H
-            lambda: self.adc_r_r("A", "L"),     # [8d] ADC A L
-            lambda: self.adc_r_mrc("A", "HL"),  # [8e] ADC A (HL)
-            lambda: self.adc_r_r("A", "A"),     # [8f] ADC A A
-
-            # 90
-            lambda: self.sub_r_r("A", "B"),     # [90] SUB B
-            lambda: self.sub_r_r("A", "C"),     # [91] SUB C
-            lambda: self.sub_r_r("A", "D"),     # [92] SUB D
-            lambda: self.sub_r_r("A", "E"),     # [93] SUB E
-            lambda: self.sub_r_r("A", "H"),     # [94] SUB H
-            lambda: self.sub_r_r("A", "L"),     # [95] SUB L
-            lambda: self.sub_r_mrc("A", "HL"),  # [96] SUB (HL)
-            lambda: self.sub_r_r("A", "A"),     # [97] SUB A
-            lambda: self.sbc_r_r("A", "B"),     # [98] SBC A B
-            lambda: self.sbc_r_r("A", "C"),     # [99] SBC A C
-            lambda: self.sbc_r_r("A", "D"),     # [9a] SBC A D
-            lambda: self.sbc_r_r("A", "E"),     # [9b] SBC A E
-            lambda: self.sbc_r_r("A", "H"),     # [9c] SBC A H
-            lambda: self.sbc_r_r("A", "L"),     # [9d] SBC A L
-            lambda: self.sbc_r_mrc("A", "HL"),  # [9e] SBC A (HL)
-            lambda: self.sbc_r_r("A", "A"),     # [9f] SBC A A
-
-            # A0
-            lambda: self.and_r_r("A", "B"),     # [a0] AND B
-            lambda: self.and_r_r("A", "C"),     # [a1] AND C
-            lambda: self.and_r_r("A", "D"),     # [a2] AND D
-            lambda: self.and_r_r("A", "E"),     # [a3] AND E
-            lambda: self.and_r_r("A", "H"),     # [a4] AND H
-            lambda: self.and_r_r("A", "L"),     # [a5] AND L
-            lambda: self.and_r_mrc("A", "HL"),  # [a6] AND (HL)
-            lambda: self.and_r_r("A", "A"),     # [a7] AND A
-            lambda: self.xor_r_r("A", "B"),     # [a8] XOR B
-            lambda: self.xor_r_r("A", "C"),     # [a9] XOR C
-            lambda: self.xor_r_r("A", "D"),     # [aa] XOR D
-            lambda: self.xor_r_r("A", "E"),     # [ab] XOR E
-            lambda: self.xor_r_r("A", "H"),     # [ac] XOR H
-            lambda: self.xor_r_r("A", "L"),     # [ad] XOR L
-            lambda: self.xor_r_mrc("A", "HL"),  # [ae] XOR (HL)
-            lambda: self.xor_r_r("A", "A"),     # [af] XOR A
-
-            # B0
-            lambda: self.or_r_r("A", "B"),      # [b0] OR B
-            lambda: self.or_r_r("A", "C"),      # [b1] OR C
-            lambda: self.or_r_r("A", "D"),      # [b2] OR D
-            lambda: self.or_r_r("A", "E"),      # [b3] OR E
-            lambda: self.or_r_r("A", "H"),      # [b4] OR H
-            lambda: self.or_r_r("A", "L"),      # [b5] OR L
-            lambda: self.or_r_mrc("A", "HL"),   # [b6] OR (HL)
-            lambda: self.or_r_r("A", "A"),      # [b7] OR A
-            lambda: self.cp_r_r("A", "B"),      # [b8] CP B
-            lambda: self.cp_r_r("A", "C"),      # [b9] CP C
-            lambda: self.cp_r_r("A", "D"),      # [ba] CP D
-            lambda: self.cp_r_r("A", "E"),      # [bb] CP E
-            lambda: self.cp_r_r("A", "H"),      # [bc] CP H
-            lambda: self.cp_r_r("A", "L"),      # [bd] CP L
-            lambda: self.cp_r_mrc("A", "HL"),   # [be] CP (HL)
-            lambda: self.cp_r_r("A", "A"),      # [bf] CP A
-
-            # C0
-            lambda: self.ret_cc("Z", 0),        # [c0] RET NZ
-            lambda: self.pop("BC"),             # [c1] POP BC
-            lambda: self.jp_cc_im16("Z", 0),    # [c2] JP NZ a16
-            lambda: self.jp_im16(),             # [c3] JP a16
-            lambda: self.call_cc("Z", 0),       # [c4] CALL NZ a16
-            lambda: self.push("BC"),            # [c5] PUSH BC
-            lambda: self.add_r_im8("A"),        # [c6] ADD A d8
-            lambda: self.rst_im8(0x0),          # [c7] RST 00H
-            lambda: self.ret_cc("Z", 1),        # [c8] RET Z
-            lambda: self.ret(),                 # [c9] RET
-            lambda: self.jp_cc_im16("Z", 1),    # [ca] JP Z a16
-            lambda: None,     # [cb] PREFIX CB  >> PREFIX FUNCTION
-            lambda: self.call_cc("Z", 1),       # [cc] CALL Z a16
-            lambda: self.call(),                # [cd] CALL a16
-            lambda: self.adc_r_im8("A"),        # [ce] ADC A d8
-            lambda: self.rst_im8(0x08),         # [cf] RST 08H
-
-            # D0
-            lambda: self.ret_cc("C", 0),        # [d0] RET NC
-            lambda: self.pop("DE"),             # [d1] POP DE
-            lambda: self.jp_cc_im16("C", 0),    # [d2] JP NC a16
-            lambda: None,                       # Not defined.
-            lambda: self.call_cc("C", 0),       # [d4] CALL NC a16
-            lambda: self.push("DE"),            # [d5] PUSH DE
-            lambda: self.sub_r_im8("A"),        # [d6] SUB d8
-            lambda: self.rst_im8(0x10),         # [d7] RST 10H
-            lambda: self.ret_cc("C", 1),        # [d8] RET C
-            lambda: self.reti(),                # [d9] RETI
-            lambda: self.jp_cc_im16("C", 1),    # [da] JP C a16
-            lambda: None,                       # Not defined.
-            lambda: self.call_cc("C", 1),       # [dc] CALL C a16
-            lambda: None,                       # Not defined.
-            lambda: self.sbc_r_im8("A"),        # [de] SBC A d8
-            lambda: self.rst_im8(0x18),         # [df] RST 18H
-
-            # E0
-            lambda: self.ld_oim8_r("A"),        # [e0] LDH (a8) A
-            lambda: self.pop("HL"),             # [e1] POP HL
-            lambda: self.ld_omr_r("C", "A"),    # [e2] LD (C) A
-            lambda: None,                       # Not defined.
-            lambda: None,                       # Not defined.
-            lambda: self.push("HL"),            # [e5] PUSH HL
-            lambda: self.and_r_im8("A"),        # [e6] AND d8
-            lambda: self.rst_im8(0x20),         # [e7] RST 20H
-            lambda: None,     # [e8] ADD SP r8
-            lambda: self.jp_mrc("HL"),          # [e9] JP (HL)
-            lambda: self.ld_mim16_r("A"),       # [ea] LD (a16) A
-            lambda: None,                       # Not defined.
-            lambda: None,                       # Not defined.
-            lambda: None,                       # Not defined.
-            lambda: self.xor_r_im8("A"),        # [ee] XOR d8
-            lambda: self.rst_im8(0x28),         # [ef] RST 28H
-
-            # F0
-            lambda: self.ld_r_oim8("A"),        # [f0] LDH A (a8)
-            lambda: self.pop("AF"),             # [f1] POP AF
-            lambda: self.ld_r_omr("A", "C"),    # [f2] LD A (C)
-            lambda: self.di(),                  # [f3] DI
-            lambda: None,                       # Not defined.
-            lambda: self.push("AF"),            # [f5] PUSH AF
-            lambda: self.or_r_im8("A"),         # [f6] OR d8
-            lambda: self.rst_im8(0x30),         # [f7] RST 30H
-            lambda: self.ldhl_sp_im8(),         # [f8] LD HL SP+r8
-            lambda: self.ld_sp_rc("HL"),        # [f9] LD SP HL
-            lambda: self.ld_r_mim16("A"),       # [fa] LD A (a16)
-            lambda: self.ei(),                  # [fb] EI
-            lambda: None,                       # Not defined.
-            lambda: None,                       # Not defined.
-            lambda: self.cp_r_im8("A"),         # [fe] CP d8
-            lambda: self.rst_im8(0x38),         # [ff] RST 38H
-        ]
+        """
+        Builds the un-prefixed and CB prefixed opcode handlers from the loaded
+        instruction set, see codegen.py for the semantics of each instruction.
+        """
+        self.map, self.cb_map = build_handlers(self, self.c, self.m, self.c.ops)
 
     def combo_s(self, rc):
-        return self.combo(rc[0], rc[1])
-
-    def combo(self, r1, r2):
-        return self.c.r[r1] << 8 | self.c.r[r2]
+        return self.c.r.pair(rc)
 
     def get_im16(self):
-        mem = (self.m.read(self.c.pc + 1)) | (self.m.read(self.c.pc + 2) << 8)
-        #mem = (self.m.read(self.c.pc + 1) << 8) | self.m.read(self.c.pc + 2)
-        return mem
-
-    def ld_r_im8(self, reg):
-        self.c.r[reg] = (self.m.read(self.c.pc + 1)) & 0xFF
-
-    def ld_r_r(self, r1, r2):
-        self.c.r[r1] = self.c.r[r2]
-
-    def ld_r_mrc(self, r1, rc):
-        """Load a register with a memory reference in a register combo (e.g. (HL))"""
-        self.c.r[r1] = self.m.read(self.combo_s(rc))
-
-    def ld_mrc_r(self, rc, r1):
-        self.m.write(self.combo_s(rc), self.c.r[r1])
-
-    def ld_r_mim16(self, r1):
-        mem = self.get_im16()
-        self.c.r[r1] = self.m.read(mem)
-
-    def ld_r_im16(self, r1):
-        """Load a register with an immediate value"""
-        self.c.r[r1] = self.m.read(self.c.pc + 1)
-
-    def ld_mim16_r(self, r1):
-        """Load an immediate memory address with a register value."""
-        mem = self.get_im16()
-        self.m.write(mem, self.c.r[r1])
-
-    def ld_r_omr(self, r1, r2):
-        """Load a register with a value at 0xFF00 + r2."""
-        self.c.r[r1] = self.m.read(0xFF00 + self.c.r[r2])
-
-    def ld_omr_r(self, r1, r2):
-        self.m.write(0xFF00 + self.c.r[r1], self.c.r[r2])
-
-    def ld_r_oim8(self, r1):
-        self.c.r[r1] = self.m.read(0xFF00 + self.m.read(self.c.pc + 1))
-
-    def ld_oim8_r(self, r1):
-        self.m.write(0xFF00 + self.m.read(self.c.pc + 1), self.c.r[r1])
-
-    def ld_rc_im16(self, rc):
-        self.c.r[rc[1]] = self.m.read(self.c.pc + 1)
-        self.c.r[rc[0]] = self.m.read(self.c.pc + 2)
-
-    def ld_hli_r(self, r1):
-        hl = self.combo_s("HL")
-        self.m.write(hl, self.c.r[r1])
-
-        hl += 1
-        self.c.r["H"] = (hl >> 8) & 0xFF
-        self.c.r["L"] = hl & 0xFF
-
-    def ld_r_hli(self, r1):
-        hl = self.combo_s("HL")
-        self.c.r[r1] = self.m.read(hl)
-
-        hl += 1
-        self.c.r["H"] = (hl >> 8) & 0xFF
-        self.c.r["L"] = hl & 0xFF
-
-    def ld_hld_r(self, r1):
-        hl = self.combo_s("HL")
-        self.m.write(hl, r1)
-
-        hl -= 1
-        self.c.r["H"] = (hl >> 8) & 0xFF
-        self.c.r["L"] = hl & 0xFF
-
-    def ld_r_hld(self, r1):
-        hl = self.combo_s("HL")
-        self.c.r[r1] = self.m.read(hl)
-
-        hl -= 1
-        self.c.r["H"] = (hl >> 8) & 0xFF
-        self.c.r["L"] = hl & 0xFF
+        return self.m.read16(self.c.pc + 1)
 
     def ld_sp_rc(self, rc):
         self.c.sp = self.combo_s(rc)
@@ -401,8 +45,8 @@ class InstructionMap(object):
         if n > 127:
             n = -((~n + 1) & 255)
         n += self.c.sp
-        self.c.r["H"] = (n >> 8) & 0xFF
-        self.c.r["L"] = n & 0xFF
+        self.c.r[H] = (n >> 8) & 0xFF
+        self.c.r[L] = n & 0xFF
         # TODO: Implement the flags for this operation.
 
     def ld_sp_im16(self):
@@ -414,82 +58,49 @@ class InstructionMap(object):
         self.m.write(mem, (self.c.sp >> 8) & 0xFF)
         self.m.write(mem+1, self.c.sp & 0xFF)
 
-    def ld_mrc_im8(self, rc):
-        mem = self.m.read(self.c.pc + 1)
-        self.c.r[rc[0]] = 0
-        self.c.r[rc[1]] = mem
-
     def push(self, rc):
         """Pushes the value from a register pair on to the stack."""
-        self.c.push((self.c.r[rc[0]] << 4) & (self.c.r[rc[1]] & 0xFF))
+        self.c.push(self.c.r.pair(rc))
 
     def pop(self, rc):
-        """Pops two bytes off of the stack."""
-        self.c.r[rc[1]] = self.m.read(self.c.sp)
-        self.c.r[rc[0]] = self.m.read(self.c.sp+1)
-        self.c.sp += 2
+        """Pops two bytes off of the stack in to a register pair."""
+        self.c.r.set_pair(rc, self.c.pop())
 
-        # Update the flags if we need to.
-        if rc[1] == "F":
-            self.c.set_f_register(self.c.r["F"])
+        # The lower nibble of F is always zero.
+        if rc[1] == F:
+            self.c.r[F] &= 0xF0
 
     """
     Note that for each of the *JUMP* instructions, we subtract the byte size of the instruction
     to negate the Program Counter increment.
     """
 
-    def jp_im16(self):
-        self.c.pc = self.get_im16() - 3
-
-    def jp_cc_im16(self, flag, val):
-        f = self.c.f[flag]
-        if f == val:
-            self.c.pc = self.get_im16() - 3
-
     def jp_mrc(self, rc):
         self.c.pc = self.m.read(self.combo_s(rc)) - 1
 
-    def jp_oim8(self):
-        op2 = self.m.read(self.c.pc + 1)
-        if op2 > 127:
-            op2 = -((~op2 + 1) & 255)
-        new_pc = self.c.pc + op2 - 2
-        self.c.pc = new_pc
-
-    def jp_cc_oim8(self, flag, val):
-        f = self.c.f[flag]
-        if f == val:
-            op2 = self.m.read(self.c.pc + 1)  # Signed
-            if op2 > 127:
-                op2 = -(((~op2) + 1) & 255) + 2  # TODO: Figure out why this hack is needed.
-            self.c.pc = self.c.pc + op2 - 2
+    """
+    The stack holds the address execution returns to, which ret sets the
+    Program Counter to, less the size of the return instruction.
+    """
 
     def call(self):
-        self.m.write(self.c.sp - 1, (self.c.pc >> 8) & 0xFF)
-        self.m.write(self.c.sp - 2, self.c.pc & 0xFF)
-        self.c.sp -= 2
-
+        self.c.push(self.c.pc + 3)
         self.c.pc = self.get_im16() - 3
 
     def call_cc(self, flag, val):
-        f = self.c.f[flag]
+        f = 1 if self.c.r[F] & flag else 0
         if f == val:
             self.call()
 
     def rst_im8(self, off):
-        self.m.write(self.c.sp - 1, (self.c.pc >> 8) & 0xFF)
-        self.m.write(self.c.sp - 2, self.c.pc & 0xFF)
-        self.c.sp -= 2
-
-        self.c.pc = off + self.m.read(self.c.pc + 1) - 2
+        self.c.push(self.c.pc + 1)
+        self.c.pc = off - 1
 
     def ret(self):
-        self.c.pc = (self.m.read(self.c.sp + 1) << 8) | self.m.read(self.c.sp) - 1
-        self.c.pc += self.c.ops.instructions[self.m.read(self.c.pc)].bytes
-        self.c.sp += 2
+        self.c.pc = self.c.pop() - 1
 
     def ret_cc(self, flag, val):
-        f = self.c.f[flag]
+        f = 1 if self.c.r[F] & flag else 0
         if f == val:
             self.ret()
 
@@ -499,356 +110,81 @@ class InstructionMap(object):
 
     """ALU Functions"""
 
-    """Addition"""
-    def _add_flags(self, op1, op2, res):
-        self.c.f["C"] = 1 if res > 255 else 0
-        self.c.f["H"] = 1 if ((op1 & 0xF) + (op2 & 0xF) & 0x10) > 0 else 0
-        self.c.f["Z"] = 1 if res == 0 else 0
-        self.c.f["N"] = 0
+    """Increments and decrements, see alu.py for the tables"""
+    def _carry(self):
+        return (self.c.r[F] & FLAG_C) >> 4
 
-    def _add_8b(self, op1, op2):
-        res = op1 + op2
-        self._add_flags(op1, op2, res)
-        return res & 0xFF
-
-    def add_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1)
-        ret = self._add_8b(op1, op2) & 0xFF
-        self.c.r[r1] = ret
-
-    def add_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2]
-        ret = self._add_8b(op1, op2) & 0xFF
-        self.c.r[r1] = ret
-
-    def add_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc))
-        ret = self._add_8b(op1, op2) & 0xFF
-        self.c.r[r1] = ret
-
-    def adc_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1) + self.c.f["C"]
-        ret = self._add_8b(op1, op2) & 0xFF
-        self.c.r[r1] = ret
-
-    def adc_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2] + self.c.f["C"]
-        ret = self._add_8b(op1, op2) & 0xFF
-        self.c.r[r1] = ret
-
-    def adc_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc)) + self.c.f["C"]
-        ret = self._add_8b(op1, op2) & 0xFF
-        self.c.r[r1] = ret
-
-    def _inc_flags(self, op1):
-        self.c.f['Z'] = 1 if op1 == 0 else 0
-        self.c.f['N'] = 0
-        self.c.f['H'] = 1 if ((op1 & 0xF) + 1 & 0x10) > 0 else 0
-
-    def inc_r(self, r1):
-        op1 = self.c.r[r1]
-        op1 += 1
-        self._inc_flags(op1 & 0xFF)
-        self.c.r[r1] = op1 & 0xFF
+    def _inc_8b(self, op1):
+        i = self._carry() << 8 | op1
+        self.c.r[F] = INC_FLAGS[i]
+        return INC_RESULT[i]
+
+    def _dec_8b(self, op1):
+        i = self._carry() << 8 | op1
+        self.c.r[F] = DEC_FLAGS[i]
+        return DEC_RESULT[i]
 
     def inc_mrc(self, rc):
-        op1 = self.m.read(self.combo_s(rc))
-        op1 += 1
-        self._inc_flags(op1)
-        self.m.write(self.combo_s(rc), op1 & 0xFF)
-
-    """Subtraction"""
-    def _sub_8b(self, op1, op2):
-        ret = op1 - op2
-        self._sub_flags(op1, op2, ret)
-        return ret
-
-    def _sub_flags(self, op1, op2, ret):
-        self.c.f["C"] = 1 if ret < 0 else 0
-        self.c.f["H"] = 1 if (((op1 & 0xF) - (op2 & 0xF)) & 0x10) > 0 else 0
-        self.c.f["N"] = 1
-        self.c.f["Z"] = 1 if ret == 0 else 0
-
-    def sub_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2]
-        ret = self._sub_8b(op1, op2)
-        self.c.r[r1] = ret & 0xFF
-
-    def sub_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc))
-        ret = self._sub_8b(op1, op2)
-        self.c.r[r1] = ret & 0xFF
-
-    def sub_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1)
-        ret = self._sub_8b(op1, op2)
-        self.c.r[r1] = ret & 0xFF
-
-    def sbc_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2] + self.c.f["C"]
-        ret = self._sub_8b(op1, op2)
-        self.c.r[r1] = ret & 0xFF
-
-    def sbc_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc)) + self.c.f["C"]
-        ret = self._sub_8b(op1, op2)
-        self.c.r[r1] = ret & 0xFF
-
-    def sbc_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1) + self.c.f["C"]
-        ret = self._sub_8b(op1, op2)
-        self.c.r[r1] = ret & 0xFF
-
-    def dec_r(self, r1):
-        op1 = self.c.r[r1]
-        ret = op1 - 1
-        self.c.f["Z"] = 1 if ret == 0 else 0
-        self.c.f["N"] = 1
-        self.c.f["H"] = 0   # TODO: Clarify
-
-        self.c.r[r1] = ret & 0xFF
-
-    def _cp_flags(self, op1, op2, ret):
-        self.c.f['Z'] = 1 if ret == 0 else 0
-        self.c.f['N'] = 1
-        self.c.f['H'] = 1 if (((op1 & 0xF) - (op2 & 0xF)) & 0x10) == 0 else 0
-        self.c.f['C'] = 1 if op1 < op2 else 0
-
-    def cp_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2]
-        ret = op1 - op2
-        self._cp_flags(op1, op2, ret)
-
-    def cp_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc))
-        self._cp_flags(op1, op2, op1-op2)
-
-    def cp_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1)
-        self._cp_flags(op1, op2, op1-op2)
-
-    """Bitwise Operations"""
-
-    def _and_flags(self, ret):
-        self.c.f["Z"] = 1 if ret == 0 else 0
-        self.c.f["N"] = 0
-        self.c.f["H"] = 1
-        self.c.f["C"] = 0
-
-    def and_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2]
-        ret = (op1 & op2) & 0xFF
-        self._and_flags(ret)
-        self.c.r[r1] = ret
-
-    def and_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc))
-        ret = (op1 & op2) & 0xFF
-        self._and_flags(ret)
-        self.c.r[r1] = ret
-
-    def and_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1)
-        ret = (op1 & op2) & 0xFF
-        self._and_flags(ret)
-        self.c.r[r1] = ret
-
-    def _or_flags(self, ret):
-        self.c.f["Z"] = 1 if ret == 0 else 0
-        self.c.f["N"] = 0
-        self.c.f["H"] = 0
-        self.c.f["C"] = 0
-
-    def or_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2]
-        ret = (op1 | op2) & 0xFF
-        self._or_flags(ret)
-        self.c.r[r1] = ret
-
-    def or_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc))
-        ret = (op1 | op2) & 0xFF
-        self._or_flags(ret)
-        self.c.r[r1] = ret
-
-    def or_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1)
-        ret = (op1 | op2) & 0xFF
-        self._or_flags(ret)
-        self.c.r[r1] = ret
-
-    def xor_r_r(self, r1, r2):
-        op1 = self.c.r[r1]
-        op2 = self.c.r[r2]
-        ret = (op1 ^ op2) & 0xFF
-        self._or_flags(ret)
-        self.c.r[r1] = ret
-
-    def xor_r_mrc(self, r1, rc):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.combo_s(rc))
-        ret = (op1 ^ op2) & 0xFF
-        self._or_flags(ret)
-        self.c.r[r1] = ret
-
-    def xor_r_im8(self, r1):
-        op1 = self.c.r[r1]
-        op2 = self.m.read(self.c.pc + 1)
-        ret = (op1 ^ op2) & 0xFF
-        self._or_flags(ret)
-        self.c.r[r1] = ret
+        address = self.combo_s(rc)
+        self.m.write(address, self._inc_8b(self.m.read(address)))
+
+    def dec_mrc(self, rc):
+        address = self.combo_s(rc)
+        self.m.write(address, self._dec_8b(self.m.read(address)))
 
     """ 16 bit ALU """
 
     def _set_rc(self, rc, value):
-        self.c.r[rc[0]] = (value & 0xFF00) >> 16
-        self.c.r[rc[1]] = (value & 0xFF)
+        self.c.r.set_pair(rc, value)
 
     def _add_16b(self, op1, op2):
         res = op1 + op2
-        self.c.f["N"] = 0
-        self.c.f["H"] = 1 if (((op1 & 0xF00) >> 16) + ((op2 & 0xF00) >> 16) & 0x10) > 0 else 0
-        self.c.f["C"] = 1 if res > 0xFFFF else 0
+        f = self.c.r[F] & FLAG_Z
+        if (((op1 & 0xF00) >> 16) + ((op2 & 0xF00) >> 16) & 0x10) > 0:
+            f |= FLAG_H
+        if res > 0xFFFF:
+            f |= FLAG_C
+        self.c.r[F] = f
         return res
 
     def add_hl_rc(self, rc):
-        op1 = self.combo_s("HL")
+        op1 = self.combo_s(HL)
         op2 = self.combo_s(rc)
 
         res = self._add_16b(op1, op2) & 0xFFFF
-        self._set_rc("HL", res)
+        self._set_rc(HL, res)
 
     def add_hl_sp(self):
-        op1 = self.combo_s("HL")
+        op1 = self.combo_s(HL)
         op2 = self.c.sp
 
         res = self._add_16b(op1, op2) & 0xFFFF
-        self._set_rc("HL", res)
-
-    def add_sp_im8(self):
-        op1 = self.c.sp
-        op2 = self.m.read(self.c.pc + 1)  # Signed
-        op2 = -((~op2 + 1) & 0xFF) if op2 > 127 else op2  # Sign the value
-
-        self.c.f["Z"] = 0
-        self.c.f["N"] = 0
-        self.c.f["H"] = 0  # TODO Investigate further.
-        self.c.f["C"] = 0  # TODO Investigate further
-
-        res = (op1 + op2) & 0xFFFF
-        self.c.sp = res
-
-    def inc_rc(self, rc):
-        op1 = self.combo_s(rc)
-        res = (op1 + 1) & 0xFFFF
-        self._set_rc(rc, res)
+        self._set_rc(HL, res)
 
     def inc_sp(self):
         op1 = self.c.sp
         res = (op1 + 1) & 0xFFFF
         self.c.sp = res
 
-    def dec_rc(self, rc):
-        op1 = self.combo_s(rc)
-        res = (op1 - 1) & 0xFFFF
-        self._set_rc(rc, res)
-
     def dec_sp(self):
         op1 = self.c.sp
         res = (op1 - 1) & 0xFFFF
         self.c.sp = res
 
     """ Miscellaneous Functions """
-    def swap(self, r1):
-        op1 = self.c.r[r1]
-        res = ((op1 & 0xF) << 4) | ((op1 & 0xF0) >> 4)
-        self.c.f["Z"] = 1 if res == 0 else 0
-        self.c.f["N"] = 0
-        self.c.f["H"] = 0
-        self.c.f["C"] = 0
-        self.c.r[r1] = res
-
-    def swap_mhl(self):
-        op1 = self.m.read(self.combo_s("HL"))
-        res = ((op1 & 0xF) << 4) | ((op1 & 0xF0) >> 4)
-        self.m.write(self.combo_s("HL"), res & 0xFF)
-
-    def daa(self):
-        """Credit to: http://forums.nesdev.com/viewtopic.php?t=9088
-        User: DParrot
-        Accessed: March 2nd, 2015
-        Written: Jul 29, 2010"""
-
-        op1 = self.c.r["A"]
-
-        if self.c.f["N"] == 1:
-            if self.c.f["H"] == 1 or (op1 * 0xF) > 0x9:
-                op1 += 0x06
-            if self.c.f["C"] == 1 or op1 > 0x9F:
-                op1 += 0x60
-        else:
-            if self.c.f["H"] == 1:
-                op1 = (op1 - 0x6) & 0xFF
-            if self.c.f["C"] == 1:
-                op1 -= 0x60
-
-        f_reg = self.c.get_f_register()
-        f_reg &= ~0xa0  # & with complement of Z and H position
-
-        if (op1 & 0x100) == 0x100:
-            f_reg |= 0x10
-
-        op1 &= 0xFF
-
-        if op1 == 0:
-            f_reg |= 0x80
-
-        self.c.set_f_register(f_reg)
-        self.c.r["A"] = op1
-
     def cpl(self):
-        op1 = self.c.r["A"]
+        op1 = self.c.r[A]
         res = ~op1 & 0xFF
-        self.c.f["N"] = 1
-        self.c.f["H"] = 1
+        self.c.r[F] |= FLAG_N | FLAG_H
 
-        self.c.r["A"] = res
+        self.c.r[A] = res
 
     def ccf(self):
-        if self.c.f["C"] == 1:
-            self.c.f["C"] = 0
-        else:
-            self.c.f["C"] = 1
-
-        self.c.f["N"] = 0
-        self.c.f["H"] = 0
+        f = self.c.r[F]
+        self.c.r[F] = (f & FLAG_Z) | (~f & FLAG_C)
 
     def scf(self):
-        self.c.f["N"] = 0
-        self.c.f["H"] = 0
-        self.c.f["C"] = 1
+        self.c.r[F] = (self.c.r[F] & FLAG_Z) | FLAG_C
 
     def nop(self):
         pass
@@ -870,7 +206,20 @@ class InstructionMap(object):
         self.m.interrupts_enabled = True
 
 
+class StopReason(object):
+    """
+    Why a call to CPU.step, CPU.run_cycles or CPU.run_frame returned.
+    """
+    STEP = "step"               # A single instruction was executed.
+    CYCLES = "cycles"           # The cycle budget was used up.
+    FRAME = "frame"             # The screen reached vblank.
+    BREAKPOINT = "breakpoint"   # The PC reached a breakpoint.
+    HALT = "halt"               # The CPU is halted, waiting for an interrupt.
+
+
 class CPU(object):
+    # Layout of get_state: registers, sp, pc, halt, cycles.
+    STATE_FORMAT = "<8sHHBQ"
 
     def __init__(self, cart, mem, ops, screen):
         """
@@ -889,113 +238,226 @@ class CPU(object):
         self.screen = screen
         self._log = logging.getLogger("CPU")
         self.halt = False
-        self.r = {
-            "A": 0,
-            "F": 0,
-            "B": 0,
-            "C": 0,
-            "D": 0,
-            "E": 0,
-            "H": 0,
-            "L": 0,
-        }
+        # Indexed by the register constants, e.g. self.r[A]. The flags are
+        # kept packed in self.r[F], see registers.py.
+        self.r = Registers()
 
         self.sp = 0xFFFE    # Per GBCPUMan page 64
         self.pc = 0x100      # We start at 100.
-        self.f = {
-            "Z": 0,   # Zero bit
-            "N": 0,   # Subtract
-            "H": 0,   # Half-carry
-            "C": 0,   # Carry
-        }
+
+        # Total number of cycles executed. This is the clock which every
+        # peripheral schedules its events against.
+        self.cycles = 0
+        self.scheduler = Scheduler()
+        self.timer = Timer(self, self.mem)
+
+        # Addresses at which run_cycles/run_frame stop, see add_breakpoint.
+        self.breakpoints = set()
 
         self.instructions = InstructionMap(self, self.mem)
+        self.blocks = BlockCache(self, self.mem, self.ops)
 
     def push(self, value):
-        self.mem.write(self.sp - 1, (value >> 4) & 0xFF)
+        self.mem.write(self.sp - 1, (value >> 8) & 0xFF)
         self.mem.write(self.sp - 2, value & 0xFF)
-        self.sp -= 2
+        self.sp = (self.sp - 2) & 0xFFFF
 
     def pop(self):
-        pass
+        value = self.mem.read(self.sp) | self.mem.read(self.sp + 1) << 8
+        self.sp = (self.sp + 2) & 0xFFFF
+        return value
 
     def vblank(self):
+        # Any interrupt wakes the CPU from HALT/STOP.
+        self.halt = False
 
-        # push pc.
+        # Interrupts are only taken between blocks, so pc is already the
+        # address of the next instruction, which RETI returns to.
         self.push(self.pc)
         self.pc = 0x40
 
     def run(self):
+        """
+        Runs the CPU forever.
+        """
+        while True:
+            self.run_frame()
+
+    def step(self):
+        """
+        Executes a single instruction.
+        :return: (cycles executed, StopReason)
+        """
+        start = self.cycles
+        if self.halt and self.mem.interrupts_enabled:
+            self._skip_to(self.scheduler.deadline)
+            return self.cycles - start, StopReason.HALT
+
+        self._execute_block(self.blocks.decode(self.pc, 1))
+        if self.cycles >= self.scheduler.deadline:
+            self.scheduler.run(self.cycles)
+        return self.cycles - start, StopReason.STEP
+
+    def run_cycles(self, cycles):
+        """
+        Runs until at least the given number of cycles have been executed.
+        The budget is only checked between blocks, so the count returned may
+        overshoot it by up to one block.
+        :param cycles: The cycle budget.
+        :return: (cycles executed, StopReason)
+        """
+        return self._run(cycles, False)
+
+    def run_frame(self):
+        """
+        Runs until the screen reaches the end of the current frame.
+        :return: (cycles executed, StopReason)
+        """
+        return self._run(None, True)
+
+    def add_breakpoint(self, pc):
+        """
+        Makes run_cycles and run_frame stop before executing the instruction
+        at pc. Blocks are split at breakpoints, so the cache is cleared.
+        :param pc: The address of the instruction.
+        """
+        self.breakpoints.add(pc)
+        self.blocks.clear()
+
+    def remove_breakpoint(self, pc):
+        self.breakpoints.discard(pc)
+        self.blocks.clear()
+
+    def _run(self, cycles, frame):
+        blocks = self.blocks
+        breakpoints = self.breakpoints
+        scheduler = self.scheduler
+        screen = self.screen
+
+        start = self.cycles
+        end = start + cycles if cycles is not None else NEVER
+        frames = screen.frames
+
+        # Don't stop on a breakpoint we're resuming from.
+        resume = self.pc
 
         while True:
-            # Get the next instruction from the ROM
-            # Run the instruction
             if self.halt and self.mem.interrupts_enabled:
-                # TODO: Handle interrupts, and handle
-                # the HALT issue on Gameboy as specified
+                # Nothing happens until the next interrupt, so jump straight
+                # to it instead of spinning.
+                # TODO: Handle the HALT issue on Gameboy as specified
                 # on page 20 of the Gameboy CPU manual.
-                continue
-
-            data = self.mem.read(self.pc)
-            if data == 0xCB:
-                if self.mem.read(self.pc + 1) == 0x87:
-                    self.r["A"] &= ((self.mem.read(self.pc + 2) & 0xF) ** 2)
-                    self.pc += 2
-                    continue
-                else:
-                    self._log.debug("[{:02x}] CB not implemented yet.".format(self.pc))
-                    skip_instr = self.ops.cb_instructions[self.mem.read(self.pc+1)]
-                    self.pc += skip_instr.bytes
-                    self._log.debug("Skipped instruction: {}".format(skip_instr))
-                    continue
-
-            func = self.instructions.map[data]
-            instr = self.ops.instructions[data]
-            if type(instr) is int:
-                self.pc += 1
-                continue
-
-            #self._log.debug("Instruction: 0x{:02x}: [0x{:02x}] -> {}".format(self.pc, data, instr))
-            try:
-                if func:
-                    func()
-                    self.set_f_register(self.get_f_register())
-                    self.screen.tick(instr.cycles[0])
-                    #self.stack_dump()
+                if not self._skip_to(min(scheduler.deadline, end)):
+                    return self.cycles - start, StopReason.HALT
+            else:
+                if breakpoints and self.pc in breakpoints and self.pc != resume:
+                    return self.cycles - start, StopReason.BREAKPOINT
+                resume = None
+
+                block = blocks.lookup(self.pc)
+                if block.loop is not None and block.start not in breakpoints:
+                    self._run_loop(block, end)
                 else:
-                    self._log.info("NOT IMPLEMENTED: [{:02x}]".format(data))
-                    continue
-            except Exception as e:
-                self.stack_dump()
-                self._log.exception(e)
-                self._log.fatal("Unable to continue")
-
-            self.pc += instr.bytes
-            self.pc &= 0xFFFF       # Ensure we don't overflow.
-
-            #input()
-
-    def get_f_register(self):
-        rep = ((self.f["Z"] & 0x1) << 7) | ((self.f["N"] & 0x1) << 6) | \
-                ((self.f["H"] & 0x1) << 5) | ((self.f["C"] & 0x1) << 4)
-        return rep
-
-    def set_f_register(self, f):
-        self.f["Z"] = (f & 0b10000000) >> 7
-        self.f["N"] = (f & 0b01000000) >> 6
-        self.f["H"] = (f & 0b00100000) >> 5
-        self.f["C"] = (f & 0b00010000) >> 4
-        self.r["F"] = f & 0xF0
+                    self._execute_block(block)
+
+            if self.cycles >= scheduler.deadline:
+                scheduler.run(self.cycles)
+
+            if frame and screen.frames != frames:
+                return self.cycles - start, StopReason.FRAME
+            if self.cycles >= end:
+                return self.cycles - start, StopReason.CYCLES
+
+    def _run_loop(self, block, end):
+        """
+        Runs a block which loops back to itself, skipping over iterations
+        whose outcome is already known, see loops.py. Iterations are only
+        skipped up to the next event or the end of the cycle budget, so the
+        result is the same as running them one by one.
+        :param block: The block, with a loop.
+        :param end: The cycle at which the current run ends.
+        """
+        kind, arg = block.loop
+        r = self.r
+        cycles = block.cycles
+        if kind == COUNTDOWN:
+            # Every iteration but the last can be skipped, the last is run to
+            # set the flags.
+            target = min(self.scheduler.deadline, end)
+            skip = min((r[arg] or 0x100) - 1, -((self.cycles - target) // cycles) - 1)
+            if skip > 0:
+                r[arg] = (r[arg] - skip) & 0xFF
+                self.cycles += skip * cycles
+            self._execute_block(block)
+            return
+
+        start = self.cycles
+        registers = bytes(r)
+        sp = self.sp
+        self._execute_block(block)
+        if self.pc != block.start or self.sp != sp or r != registers:
+            return
+
+        # The next iteration does exactly the same as this one, until
+        # something it reads changes.
+        target = min(self.scheduler.deadline, end)
+        for address in arg:
+            target = min(target, self.mem.next_change(address(r), start))
+        if target != NEVER:
+            skip = -((self.cycles - target) // cycles)
+            if skip > 0:
+                self.cycles += skip * cycles
+
+    def _skip_to(self, cycle):
+        """
+        Advances time without executing anything, firing any events due.
+        :param cycle: The cycle to skip to.
+        :return: False if there was nothing to skip to.
+        """
+        if cycle == NEVER:
+            return False
+        self.cycles = max(self.cycles, cycle)
+        self.scheduler.run(self.cycles)
+        return True
+
+    def _execute_block(self, block):
+        pc = size = 0
+        try:
+            for pc, func, size in block.ops:
+                # Handlers read their operands relative to the PC.
+                self.pc = pc
+                func()
+        except Exception as e:
+            self.stack_dump()
+            self._log.exception(e)
+            self._log.fatal("Unable to continue")
+
+        # Only the last instruction of a block can move the PC, everything
+        # before it falls through to the next instruction.
+        self.pc += size
+        self.pc &= 0xFFFF       # Ensure we don't overflow.
+        self.cycles += block.cycles
+
+    def get_state(self):
+        """
+        :return: The values packed by STATE_FORMAT, see state.py.
+        """
+        return bytes(self.r), self.sp, self.pc, self.halt, self.cycles
+
+    def set_state(self, values):
+        """
+        :param values: Values unpacked by STATE_FORMAT.
+        """
+        registers, self.sp, self.pc, halt, self.cycles = values
+        self.r[:] = registers
+        self.halt = bool(halt)
 
     def stack_dump(self):
         message = ""
         message += "STACK TRACE " + ("=" * 66) + "\n"
         message += "Registers: \n"
-        for r in self.r:
-            if self.r[r] is not None:
-                message += "   {}: 0x{:02x}\n".format(r, self.r[r])
-            else:
-                message += "   {}: {}\n".format(r, "ERR")
+        for r, name in enumerate(NAMES):
+            message += "   {}: 0x{:02x}\n".format(name, self.r[r])
         message += "   {}: 0x{:02x}\n".format("sp", self.sp)
         message += "   {}: 0x{:02x}\n".format("pc", self.pc)
         self._log.error(message)
@@ -0,0 +1,312 @@
+"""
+Superinstructions.
+
+When a block is decoded, runs of instructions which match one of PATTERNS are
+replaced by a single fused handler, which does the work of the whole run in
+one call. Operands are read once, when the block is decoded, which is safe as
+blocks are dropped when the code they were decoded from is written to.
+
+A fused handler takes the place of the run's first instruction in the block,
+with the size of the whole run, so that it behaves like one long instruction:
+it is entered with the PC at its first byte, and a branch which is taken
+moves the PC to its target minus the size.
+
+Each pattern is a sequence of instructions, written the way Instruction
+prints them, e.g. "JR NZ r8", where an operand may also be one of:
+    r  -> Any 8-bit register.
+    rr -> Any register pair, in brackets for a memory operand, e.g. "(rr)".
+    cc -> Any condition.
+
+Fusion.sites counts how many runs each pattern replaced. With profile set,
+Fusion.executed also counts how often each fused handler ran, and
+Fusion.pairs how often each pair of instructions which wasn't fused ran one
+after the other, which shows the patterns worth adding.
+"""
+from collections import Counter
+
+from alu import CP_FLAGS, DEC_FLAGS, DEC_RESULT
+from codegen import CONDITIONS, PAIRS, REGISTERS, relative_target
+from registers import *
+
+
+def _match(tokens, instr):
+    """
+    :param tokens: A pattern's instruction, split in to tokens, e.g.
+                   ["DEC", "r"].
+    :type instr: Instruction
+    """
+    if instr is None:
+        return False
+    if tokens[0] != instr.op_name or len(tokens) - 1 != len(instr.ops):
+        return False
+    for token, operand in zip(tokens[1:], instr.ops):
+        if token == "r":
+            matched = operand in REGISTERS
+        elif token == "rr" or token == "(rr)":
+            matched = operand.strip("()") in PAIRS and \
+                      (operand[0] == "(") == (token[0] == "(")
+        elif token == "cc":
+            matched = operand in CONDITIONS
+        else:
+            matched = token == operand
+        if not matched:
+            return False
+    return True
+
+
+class Run(object):
+    """
+    The run of instructions a fused handler is built for.
+    """
+
+    def __init__(self, fusion, ops, instrs):
+        """
+        :param ops: (pc, handler, size) of each instruction.
+        :param instrs: Instruction of each.
+        """
+        self.cpu = fusion.cpu
+        self.r = fusion.cpu.r
+        self.read = fusion.mem.read
+        self.write = fusion.mem.write
+        self.ops = ops
+        self.instrs = instrs
+        self.start = ops[0][0]
+        self.size = ops[-1][0] + ops[-1][2] - self.start
+
+    def operand(self, index):
+        """
+        :return: The 8-bit immediate of the index-th instruction.
+        """
+        return self.read(self.ops[index][0] + 1)
+
+    def branch(self):
+        """
+        Decodes the conditional jump ending the run.
+        :return: (flag, expected value of r[F] & flag, PC to set when taken)
+        """
+        pc = self.ops[-1][0]
+        instr = self.instrs[-1]
+        if instr.op_name == "JR":
+            target = relative_target(pc, self.read(pc + 1))
+        else:
+            target = self.cpu.mem.read16(pc + 1)
+        flag, val = CONDITIONS[instr.ops[0]]
+        return flag, flag if val else 0, target - self.size
+
+
+def _countdown(run):
+    """
+    DEC r / JR NZ, a delay loop.
+    """
+    r, cpu = run.r, run.cpu
+    reg = REGISTERS[run.instrs[0].ops[0]]
+    _, _, jump = run.branch()
+
+    def fused():
+        i = (r[F] & FLAG_C) << 4 | r[reg]
+        r[F] = DEC_FLAGS[i]
+        value = r[reg] = DEC_RESULT[i]
+        if value:
+            cpu.pc = jump
+    return fused
+
+
+def _compare(run):
+    """
+    CP d8 or CP r, followed by a conditional jump.
+    """
+    r, cpu = run.r, run.cpu
+    flag, want, jump = run.branch()
+    operand = run.instrs[0].ops[0]
+
+    if operand in REGISTERS:
+        reg = REGISTERS[operand]
+
+        def fused():
+            f = r[F] = CP_FLAGS[r[A] << 8 | r[reg]]
+            if (f & flag) == want:
+                cpu.pc = jump
+        return fused
+
+    value = run.operand(0)
+
+    def fused():
+        f = r[F] = CP_FLAGS[r[A] << 8 | value]
+        if (f & flag) == want:
+            cpu.pc = jump
+    return fused
+
+
+def _poll(run):
+    """
+    LDH A,(a8) / CP d8, followed by a conditional jump. Waiting for a
+    hardware register, e.g. LY, to reach a value.
+    """
+    r, cpu, read = run.r, run.cpu, run.read
+    address = 0xFF00 + run.operand(0)
+    value = run.operand(1)
+    flag, want, jump = run.branch()
+
+    def fused():
+        a = r[A] = read(address)
+        f = r[F] = CP_FLAGS[a << 8 | value]
+        if (f & flag) == want:
+            cpu.pc = jump
+    return fused
+
+
+def _test_pair(run):
+    """
+    LD A,r / OR r, followed by a conditional jump. Testing a 16-bit counter
+    for zero.
+    """
+    r, cpu = run.r, run.cpu
+    first = REGISTERS[run.instrs[0].ops[1]]
+    second = REGISTERS[run.instrs[1].ops[0]]
+    flag, want, jump = run.branch()
+
+    def fused():
+        # OR A reads the A which was just loaded.
+        r[A] = r[first]
+        a = r[A] = r[A] | r[second]
+        f = r[F] = 0 if a else FLAG_Z
+        if (f & flag) == want:
+            cpu.pc = jump
+    return fused
+
+
+def _branch_after(run):
+    """
+    Any instruction, followed by a conditional jump on the flags it set.
+    """
+    r, cpu = run.r, run.cpu
+    first = run.ops[0][1]
+    flag, want, jump = run.branch()
+
+    def fused():
+        first()
+        if (r[F] & flag) == want:
+            cpu.pc = jump
+    return fused
+
+
+def _copy(run):
+    """
+    LD A,(HL+) / LD (rr),A, copying memory a byte at a time.
+    """
+    r, read, write = run.r, run.read, run.write
+    hi, lo = PAIRS[run.instrs[1].ops[0].strip("()")]
+
+    def fused():
+        hl = r[H] << 8 | r[L]
+        a = r[A] = read(hl)
+        hl += 1
+        r[H] = (hl >> 8) & 0xFF
+        r[L] = hl & 0xFF
+        write(r[hi] << 8 | r[lo], a)
+    return fused
+
+
+# (name, instructions, builder). Longer patterns are tried first, and the
+# first which matches is used.
+PATTERNS = [
+    ("poll", ("LDH A (a8)", "CP d8", "JR cc r8"), _poll),
+    ("test_pair", ("LD A r", "OR r", "JR cc r8"), _test_pair),
+    ("test_pair", ("LD A r", "OR r", "JP cc a16"), _test_pair),
+    ("countdown", ("DEC r", "JR NZ r8"), _countdown),
+    ("compare", ("CP d8", "JR cc r8"), _compare),
+    ("compare", ("CP d8", "JP cc a16"), _compare),
+    ("compare", ("CP r", "JR cc r8"), _compare),
+    ("compare", ("CP r", "JP cc a16"), _compare),
+    ("branch_after", ("DEC r", "JR cc r8"), _branch_after),
+    ("branch_after", ("INC r", "JR cc r8"), _branch_after),
+    ("branch_after", ("AND d8", "JR cc r8"), _branch_after),
+    ("branch_after", ("OR r", "JR cc r8"), _branch_after),
+    ("copy", ("LD A (HL+)", "LD (rr) A"), _copy),
+]
+
+# The PATTERNS, split in to tokens, by the mnemonic they start with.
+_BY_MNEMONIC = {}
+for _name, _specs, _builder in PATTERNS:
+    _tokens = [spec.split() for spec in _specs]
+    _BY_MNEMONIC.setdefault(_tokens[0][0], []).append((_name, _tokens, _builder))
+
+
+class Fusion(object):
+
+    def __init__(self, cpu, mem):
+        """
+        :type cpu: CPU
+        :type mem: MemoryController
+        """
+        self.cpu = cpu
+        self.mem = mem
+
+        # Set to False to decode blocks without fusing anything.
+        self.enabled = True
+        # Set to count executions, see the module docstring. Both only apply
+        # to blocks decoded afterwards.
+        self.profile = False
+
+        self.sites = Counter()
+        self.executed = Counter()
+        self.pairs = Counter()
+
+    def fuse(self, ops, instrs):
+        """
+        Replaces every run of instructions which matches a pattern.
+        :param ops: List of (pc, handler, size) of each instruction of a block.
+        :param instrs: Instruction of each, or None for undefined opcodes.
+        :return: The new list of ops.
+        """
+        if not self.enabled:
+            return ops
+
+        fused = []
+        i = 0
+        while i < len(ops):
+            instr = instrs[i]
+            patterns = _BY_MNEMONIC.get(instr.op_name, ()) if instr is not None else ()
+            for name, specs, builder in patterns:
+                n = len(specs)
+                if i + n <= len(ops) and \
+                        all(_match(spec, instr) for spec, instr in zip(specs, instrs[i:i + n])):
+                    run = Run(self, ops[i:i + n], instrs[i:i + n])
+                    handler = builder(run)
+                    self.sites[name] += 1
+                    if self.profile:
+                        handler = self._counted(self.executed, name, handler)
+                    fused.append((run.start, handler, run.size))
+                    i += n
+                    break
+            else:
+                op = ops[i]
+                if self.profile and i > 0 and instrs[i - 1] is not None and instrs[i] is not None:
+                    key = (str(instrs[i - 1]), str(instrs[i]))
+                    op = (op[0], self._counted(self.pairs, key, op[1]), op[2])
+                fused.append(op)
+                i += 1
+        return fused
+
+    @staticmethod
+    def _counted(counter, key, handler):
+        def counted():
+            counter[key] += 1
+            handler()
+        return counted
+
+    def report(self, limit=10):
+        """
+        :param limit: Number of unfused pairs to list.
+        :return: A summary of which patterns fired, and, when profiling, the
+                 most frequent pairs which weren't fused.
+        """
+        lines = ["Fused sites:"]
+        for name, count in self.sites.most_common():
+            lines.append("    {:<16} {:>8} sites {:>12} runs".format(
+                name, count, self.executed[name]))
+        if self.profile:
+            lines.append("Most frequent unfused pairs:")
+            for (first, second), count in self.pairs.most_common(limit):
+                lines.append("    {:<16} / {:<16} {:>12}".format(first, second, count))
+        return "\n".join(lines)
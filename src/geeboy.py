@@ -2,8 +2,13 @@ import logging
 from cartridge import Cartridge
 from cpu import CPU
 from instruction import OpcodeParser
-from mem import mbc1
+from mem import create_mapper
+from recorder import FrameRecorder
+from rewind import Rewind
 from screen import Screen
+from sharedframe import SharedFramebuffer
+import state
+from turbo import Turbo
 
 
 class GeeBoy(object):
@@ -20,13 +25,126 @@ class GeeBoy(object):
 
         self._screen = Screen()
 
-        self._mem = mbc1.MBC1(self._cartridge, self._screen)
+        self._mem = create_mapper(self._cartridge, self._screen,
+                                  self._cartridge.save_path)
         self._cpu = CPU(self._cartridge, self._mem, self._codes, self._screen)
 
         self._screen.set_cpu(self._cpu)
+        self._rewind = None
+        self._shared = None
+        self._turbo = None
+
+    def run(self):
+        """
+        Runs the emulator forever.
+        """
         self._cpu.run()
 
+    def step(self):
+        """
+        Executes a single instruction, see CPU.step.
+        """
+        return self._cpu.step()
+
+    def run_cycles(self, cycles):
+        """
+        Runs for at least the given number of cycles, see CPU.run_cycles.
+        """
+        return self._cpu.run_cycles(cycles)
+
+    def run_frame(self):
+        """
+        Runs until the end of the current frame, see CPU.run_frame.
+        """
+        return self._cpu.run_frame()
+
+    def save_state(self):
+        """
+        :return: The state of the machine, see state.py.
+        """
+        return state.save_state(self._cpu)
+
+    def load_state(self, data):
+        """
+        Restores a state returned by save_state.
+        """
+        state.load_state(self._cpu, data)
+
+    def enable_rewind(self, interval=60, budget=32 * 1024 * 1024):
+        """
+        Starts recording a state every interval frames, see rewind.py.
+        :param interval: Number of frames between two states.
+        :param budget: Maximum number of bytes of states to keep.
+        """
+        if self._rewind is not None:
+            self._rewind.close()
+        self._rewind = Rewind(self._cpu, interval, budget)
+
+    def share_framebuffer(self, name=None, path=None):
+        """
+        Publishes every frame to shared memory or an mmap'd file, see
+        sharedframe.py.
+        :param name: Name of the shared memory block.
+        :param path: File to mmap instead.
+        :return: SharedFramebuffer
+        """
+        if self._shared is not None:
+            self._shared.close()
+        self._shared = SharedFramebuffer(self._screen, name, path)
+        return self._shared
+
+    def record(self, sink, queue_size=64, drop=True):
+        """
+        Records every frame to a sink in the background, see recorder.py.
+        :param sink: Where to write frames, e.g. a recorder.PNGSink.
+        :param queue_size: Number of frames which may wait for the sink.
+        :param drop: Drop frames when the sink falls behind, instead of
+                     waiting for it.
+        :return: FrameRecorder, which must be closed to finish the recording.
+        """
+        return FrameRecorder(self._screen, sink, queue_size, drop)
+
+    def enable_turbo(self, skip=4, target_fps=None):
+        """
+        Only shows every skip-th frame, or adapts the skip to reach
+        target_fps emulated frames per second, see turbo.py.
+        """
+        self.disable_turbo()
+        self._turbo = Turbo(self._screen, skip, target_fps)
+        return self._turbo
+
+    def disable_turbo(self):
+        if self._turbo is not None:
+            self._turbo.close()
+            self._turbo = None
+
+    def close(self):
+        """
+        Flushes battery backed RAM to its save file, and stops everything
+        which runs alongside the emulator.
+        """
+        self.disable_turbo()
+        if self._rewind is not None:
+            self._rewind.close()
+            self._rewind = None
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+        self._mem.close()
+
+    def rewind(self, count=1):
+        """
+        Goes back count recorded states, see Rewind.rewind.
+        """
+        if self._rewind is None:
+            return 0
+        return self._rewind.rewind(count)
+
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     gb = GeeBoy()
+    try:
+        gb.run()
+    finally:
+        gb.close()
@@ -0,0 +1,137 @@
+"""
+Detection of loops whose iterations can be skipped.
+
+A block which ends in a conditional jump back to its own start is a loop. Two
+kinds of loop are recognised when the block is decoded:
+
+    COUNTDOWN -> A delay loop such as "SUB 1 / JP NZ" or "DEC B / JR NZ".
+                 The number of iterations left is the counter itself, so all
+                 but the last iteration can be applied in one go.
+    IDLE      -> A loop which only reads memory and changes registers, such
+                 as polling LY or an interrupt flag. If an iteration leaves
+                 the registers as they were, every following iteration does
+                 the same until something it reads changes, which can only
+                 happen at a scheduled event or when a hardware register
+                 changes with time.
+
+Skipping is done by the CPU, in whole iterations, so the cycle count, the
+registers and the points at which events fire are the same as if every
+iteration had been executed.
+"""
+from codegen import relative_target
+from registers import *
+
+COUNTDOWN = 0
+IDLE = 1
+
+# Conditions which may branch back to the start of a loop.
+CONDITIONS = frozenset(["NZ", "Z", "NC", "C"])
+
+# Instructions which may appear in an idle loop, as long as they don't write
+# to memory. Everything else either writes memory or changes control flow.
+IDLE_OPS = frozenset([
+    "NOP", "LD", "LDH", "INC", "DEC", "ADD", "ADC", "SUB", "SBC", "AND", "XOR",
+    "OR", "CP", "CPL", "SCF", "CCF", "DAA", "BIT",
+])
+
+# Instructions whose first operand is written to. The memory operands of
+# every other instruction, e.g. "CP (HL)" or "BIT 7 (HL)", are only read.
+DESTINATION_OPS = frozenset(["LD", "LDH", "INC", "DEC"])
+
+# Registers, or register pairs, which are read through by a memory operand.
+ADDRESS_PAIRS = {
+    "(HL)": HL,
+    "(HL+)": HL,
+    "(HL-)": HL,
+    "(BC)": BC,
+    "(DE)": DE,
+}
+
+
+def _target(pc, instr, read):
+    """
+    :return: The address jumped to by the JR/JP at pc.
+    """
+    if instr.op_name == "JR":
+        return relative_target(pc, read(pc + 1))
+    return read(pc + 1) | read(pc + 2) << 8
+
+
+def _address(pc, operand, read):
+    """
+    :return: A function of the registers which returns the address read by
+             the memory operand of the instruction at pc.
+    """
+    if operand in ADDRESS_PAIRS:
+        rc = ADDRESS_PAIRS[operand]
+        return lambda r: r[rc[0]] << 8 | r[rc[1]]
+    if operand == "(C)":
+        return lambda r: 0xFF00 + r[C]
+
+    if operand == "(a8)":
+        address = 0xFF00 + read(pc + 1)
+    else:
+        address = read(pc + 1) | read(pc + 2) << 8
+    return lambda r: address
+
+
+def _countdown(body, read):
+    """
+    :return: The register counted down by the body, or None.
+    """
+    if len(body) != 1:
+        return None
+
+    pc, instr = body[0]
+    if instr.op_name == "DEC" and instr.ops[0] in NAMES and instr.ops[0] != "F":
+        return NAMES.index(instr.ops[0])
+    if instr.op_name == "SUB" and instr.ops[0] == "d8" and read(pc + 1) == 1:
+        return A
+    return None
+
+
+def _reads(body, read):
+    """
+    :return: The addresses read by the body, as functions of the registers,
+             or None if the body does anything other than read memory and
+             change registers.
+    """
+    reads = []
+    for pc, instr in body:
+        if instr.op_name not in IDLE_OPS:
+            return None
+
+        for i, operand in enumerate(instr.ops):
+            if not operand.startswith("("):
+                continue
+            if i == 0 and instr.op_name in DESTINATION_OPS:
+                return None
+            reads.append(_address(pc, operand, read))
+    return tuple(reads)
+
+
+def classify(start, decoded, read):
+    """
+    Works out whether a block can have its iterations skipped.
+    :param start: The address of the first instruction of the block.
+    :param decoded: List of (pc, Instruction) for each instruction in the block.
+                    CB prefixed instructions use their CB instruction.
+    :param read: Function used to read the block's operands.
+    :return: (COUNTDOWN, register), (IDLE, reads) or None.
+    """
+    pc, last = decoded[-1]
+    if last.op_name not in ("JR", "JP") or last.operands != 2 or last.ops[0] not in CONDITIONS:
+        return None
+    if _target(pc, last, read) != start:
+        return None
+
+    body = decoded[:-1]
+    if last.ops[0] == "NZ":
+        register = _countdown(body, read)
+        if register is not None:
+            return COUNTDOWN, register
+
+    reads = _reads(body, read)
+    if reads is not None:
+        return IDLE, reads
+    return None
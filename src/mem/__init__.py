@@ -0,0 +1,47 @@
+import logging
+
+from mem.mbc1 import MBC1
+from mem.mbc3 import MBC3
+from mem.mbc5 import MBC5
+from mem.romonly import ROMOnly
+
+# Memory controller used by each cartridge type, see CartridgeType.
+MAPPERS = {
+    0x00: ROMOnly,
+    0x08: ROMOnly,
+    0x09: ROMOnly,
+    0x01: MBC1,
+    0x02: MBC1,
+    0x03: MBC1,
+    0x0F: MBC3,
+    0x10: MBC3,
+    0x11: MBC3,
+    0x12: MBC3,
+    0x13: MBC3,
+    0x19: MBC5,
+    0x1A: MBC5,
+    0x1B: MBC5,
+    0x1C: MBC5,
+    0x1D: MBC5,
+    0x1E: MBC5,
+}
+
+
+def create_mapper(cart, screen, save_path=None):
+    """
+    Creates the memory controller for a cartridge, picked by its type.
+    Cartridges of any other type, e.g. MBC2 or HuC1, get an MBC1, which is
+    what every cartridge got before the other mappers were added.
+    :type cart: Cartridge
+    :type screen: Screen
+    :param save_path: The save file of battery backed RAM, e.g.
+                      Cartridge.save_path. None to not persist it.
+    :return: MemoryController
+    """
+    mapper = MAPPERS.get(cart.cartridge_type)
+    if mapper is None:
+        logging.getLogger("Mapper").warning(
+            "Cartridge type [{:02x}] {} is not supported, using MBC1."
+            .format(cart.cartridge_type, cart.cartridge_type_string))
+        mapper = MBC1
+    return mapper(cart, screen, save_path)
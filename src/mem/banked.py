@@ -0,0 +1,142 @@
+import logging
+from mem.battery import BatteryRAM
+from mem.memory import MemoryController
+
+
+class BankedMapper(MemoryController):
+    """
+    Base of the cartridge memory controllers.
+
+    Writes to 0x0000-0x7FFF go to the controller's banking registers, which
+    a subclass declares in REGISTERS as (first address, last address, method
+    name) ranges. Each range is routed straight to its method by the page
+    table, and every range must start and end on a 256 byte page boundary.
+
+    After a register changes, the subclass calls _update_banks, which asks
+    _banks for the ROM and RAM bank the registers select, and maps them. All
+    reads and writes of ROM and cartridge RAM then go through the page table,
+    the same for every controller.
+
+    When the cartridge has a battery and a save file is given, its RAM is
+    the mapped save file, see battery.py. If the save file can't be opened,
+    e.g. in a read-only directory, RAM is kept in memory only.
+    """
+
+    # Banking registers, as (first, last, method name). Writes to ROM
+    # outside of every range are ignored.
+    REGISTERS = ()
+
+    # Attributes holding the banking registers, saved after RAM enabled.
+    BANK_STATE = ()
+
+    # Appends RAM enabled. Subclasses append one "H" for each of BANK_STATE.
+    STATE_FORMAT = MemoryController.STATE_FORMAT + "B"
+
+    def __init__(self, cart, screen, save_path=None):
+        """
+        :type cart: Cartridge
+        :type screen: Screen
+        :param save_path: The save file of battery backed RAM, e.g.
+                          Cartridge.save_path. None to not persist it.
+        """
+        log = logging.getLogger(type(self).__name__)
+
+        self.battery = None
+        if save_path is not None and cart.ram_size and cart.has_battery:
+            try:
+                self.battery = BatteryRAM(cart.ram_size, save_path, screen)
+            except OSError as e:
+                log.warning("Unable to open the save file [{}], RAM won't be "
+                            "saved: {}".format(save_path, e))
+
+        super().__init__(cart, screen,
+                         self.battery.ram if self.battery is not None else None)
+        self._log = log
+
+        # The RAM itself is allocated by MemoryController, or is the save
+        # file, only use it if the cartridge actually has it.
+        self.has_ram = self.cart.ram_size > 0
+        self.ram_enabled = True
+        self.ram_bank = 0
+
+        self.map_handlers(0x00, 0x7F, write=self._write_unused)
+        for first, last, name in self.REGISTERS:
+            self.map_handlers(first >> 8, last >> 8, write=getattr(self, name))
+        self.map_handlers(0xA0, 0xBF, read=self._read_external_memory,
+                          write=self._write_external_memory)
+
+        self.map_rom_bank(0, 0)
+        self._update_banks(True)
+
+    def _banks(self):
+        """
+        :return: (ROM bank at 0x4000-0x7FFF, RAM bank at 0xA000-0xBFFF) as
+                 selected by the banking registers. The RAM bank is None when
+                 no RAM is selected.
+        """
+        return 1, 0
+
+    def _update_banks(self, remap=False):
+        """
+        Maps the banks selected by the banking registers.
+        :param remap: Map the ROM bank even if it didn't change.
+        """
+        rom_bank, self.ram_bank = self._banks()
+        if rom_bank != self.rom_bank or remap:
+            self.rom_bank = rom_bank
+            self.map_rom_bank(1, rom_bank)
+            if self.block_cache is not None:
+                self.block_cache.select_bank(rom_bank)
+
+        ram_bank = self.ram_bank if self.has_ram else None
+        self.map_ram_bank(ram_bank, self.ram_enabled)
+
+    def get_state(self):
+        return super().get_state() + (int(self.ram_enabled),) + \
+            tuple(getattr(self, name) for name in self.BANK_STATE)
+
+    def set_state(self, values):
+        count = len(self.BANK_STATE)
+        super().set_state(values[:2])
+        self.ram_enabled = bool(values[2])
+        for name, value in zip(self.BANK_STATE, values[3:3 + count]):
+            setattr(self, name, value)
+        self._update_banks(True)
+
+    def _write_ram_enable(self, byte, value):
+        """
+        Writing 0xA to the low nibble enables cartridge RAM, anything else
+        disables it.
+        """
+        self.ram_enabled = value & 0x0F == 0x0A
+        self._update_banks()
+
+    def _write_unused(self, byte, value):
+        pass
+
+    def close(self):
+        """
+        Flushes and unmaps the save file. Cartridge RAM carries on in memory,
+        from a copy of the save file.
+        """
+        if self.battery is None:
+            return
+        self.battery.flush()
+        self.use_external_ram(bytearray(self.battery.ram))
+        self._update_banks()
+        self.battery.close()
+        self.battery = None
+
+    def _write_external_memory(self, byte, value):
+        # Only reached when RAM is disabled, or the selected bank is missing.
+        if not self.ram_enabled:
+            self._log.error("Attempted to write to RAM when RAM is not enabled.")
+        else:
+            self._log.error("Attempted to write to RAM outside of the boundaries"
+                            " of RAM [{:02x}]".format(byte))
+
+    def _read_external_memory(self, byte):
+        # Only reached when the selected bank is missing.
+        self._log.error("Attempted to read out of bounds of RAM "
+                        "[{:02x}]".format(byte))
+        return 0
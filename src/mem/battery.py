@@ -0,0 +1,100 @@
+"""
+Battery backed cartridge RAM.
+
+The RAM of a cartridge with a battery is kept in its .sav file, which is
+mmap'd when the cartridge is loaded. The mapping itself backs cartridge RAM,
+so the memory controller's page table points straight in to it, and a write
+to cartridge RAM costs the same as a write to any other RAM.
+
+Writes are in the file's page cache as soon as they are made. Every interval
+frames, and when the RAM is closed, the 256 byte pages which differ from a
+copy of what was last flushed are found with NumPy, and only those are
+flushed to disk. A flush with nothing dirty is one comparison of the RAM.
+"""
+import logging
+import mmap
+import os.path
+
+import numpy as np
+
+# Size of the pages compared and flushed.
+PAGE_SIZE = 0x100
+
+# Frames between two flushes, about a second.
+FLUSH_FRAMES = 60
+
+
+class BatteryRAM(object):
+
+    def __init__(self, size, path, screen=None, interval=FLUSH_FRAMES):
+        """
+        Maps the save file, creating or extending it if needed.
+        :param size: The size of cartridge RAM, a multiple of PAGE_SIZE.
+        :param path: The save file.
+        :type screen: Screen
+        :param screen: Flushes every interval frames of it, if given.
+        :param interval: Number of frames between two flushes.
+        :raises OSError: If the save file can't be opened or created.
+        """
+        self._log = logging.getLogger("BatteryRAM")
+        self.path = path
+
+        exists = os.path.isfile(path)
+        with open(path, "r+b" if exists else "w+b") as handle:
+            # Save files may carry more than the RAM, e.g. MBC3 clock data,
+            # which is left as it is.
+            if os.fstat(handle.fileno()).st_size < size:
+                handle.truncate(size)
+            self.ram = mmap.mmap(handle.fileno(), size)
+        if exists:
+            self._log.info("Loaded {} bytes from [{}].".format(size, path))
+
+        # What was last flushed, to find the pages written since.
+        self._flushed = np.frombuffer(self.ram, dtype=np.uint8).copy()
+
+        self._screen = screen
+        self._interval = interval
+        self._frames = 0
+        if screen is not None:
+            screen.add_vblank_listener(self._vblank)
+
+    def _vblank(self):
+        self._frames += 1
+        if self._frames >= self._interval:
+            self._frames = 0
+            self.flush()
+
+    def flush(self):
+        """
+        Flushes the pages written since the last flush to disk.
+        """
+        ram = np.frombuffer(self.ram, dtype=np.uint8)
+        dirty = (ram.reshape(-1, PAGE_SIZE) !=
+                 self._flushed.reshape(-1, PAGE_SIZE)).any(axis=1)
+        pages = np.flatnonzero(dirty)
+        if not len(pages):
+            return
+
+        # Runs of consecutive dirty pages, as [first, last] pairs.
+        breaks = np.flatnonzero(np.diff(pages) != 1)
+        firsts = np.concatenate(([pages[0]], pages[breaks + 1]))
+        lasts = np.concatenate((pages[breaks], [pages[-1]]))
+        for first, last in zip(firsts.tolist(), lasts.tolist()):
+            start, stop = first * PAGE_SIZE, (last + 1) * PAGE_SIZE
+            self._flushed[start:stop] = ram[start:stop]
+            # Flushes have to start on a boundary of the system's pages.
+            aligned = start - start % mmap.PAGESIZE
+            self.ram.flush(aligned, stop - aligned)
+
+    def close(self):
+        """
+        Flushes what is left, and unmaps the save file. Every view of ram
+        must have been released.
+        """
+        if self.ram.closed:
+            return
+        if self._screen is not None:
+            self._screen.remove_vblank_listener(self._vblank)
+            self._screen = None
+        self.flush()
+        self.ram.close()
@@ -0,0 +1,85 @@
+from mem.banked import BankedMapper
+
+
+class MBC3(BankedMapper):
+    """
+    MBC3, with up to 128 ROM banks and 4 RAM banks.
+
+    The 0x4000-0x5FFF register selects either a RAM bank (0x00-0x03) or one
+    of the five real time clock registers (0x08-0x0C), which are then read
+    and written at 0xA000-0xBFFF. Writing 0x00 then 0x01 to 0x6000-0x7FFF
+    latches the clock registers, and reads return the latched copy. The
+    clock registers hold what was written to them, the clock itself doesn't
+    run.
+    """
+
+    REGISTERS = (
+        (0x0000, 0x1FFF, "_write_ram_enable"),
+        (0x2000, 0x3FFF, "_write_rom_bank"),
+        (0x4000, 0x5FFF, "_write_ram_bank"),
+        (0x6000, 0x7FFF, "_write_latch"),
+    )
+
+    BANK_STATE = ("rom_select", "ram_select", "latch")
+
+    RTC_FIRST = 0x08
+    RTC_LAST = 0x0C
+    RTC_SIZE = RTC_LAST - RTC_FIRST + 1
+
+    # Appends the clock registers, and their latched copy.
+    STATE_FORMAT = BankedMapper.STATE_FORMAT + "HHH{0}s{0}s".format(RTC_SIZE)
+
+    def __init__(self, cart, screen, save_path=None):
+        self.rom_select = 1
+        self.ram_select = 0
+        self.rtc = bytearray(self.RTC_SIZE)
+        self.rtc_latched = bytearray(self.RTC_SIZE)
+
+        # The last value written to the latch register.
+        self.latch = 0xFF
+        super().__init__(cart, screen, save_path)
+
+    def get_state(self):
+        return super().get_state() + (bytes(self.rtc), bytes(self.rtc_latched))
+
+    def set_state(self, values):
+        super().set_state(values[:-2])
+        self.rtc[:], self.rtc_latched[:] = values[-2:]
+
+    def _banks(self):
+        ram_bank = self.ram_select if self.ram_select <= 0x03 else None
+        return self.rom_select, ram_bank
+
+    def _write_rom_bank(self, byte, value):
+        self.rom_select = value & 0x7F or 1
+        self._update_banks()
+
+    def _write_ram_bank(self, byte, value):
+        self.ram_select = value & 0x0F
+        self._update_banks()
+
+    def _write_latch(self, byte, value):
+        if self.latch == 0x00 and value == 0x01:
+            self.rtc_latched[:] = self.rtc
+        self.latch = value
+
+    def _rtc_register(self):
+        """
+        :return: The index of the selected clock register in rtc, or None.
+        """
+        if self.RTC_FIRST <= self.ram_select <= self.RTC_LAST:
+            return self.ram_select - self.RTC_FIRST
+        return None
+
+    def _read_external_memory(self, byte):
+        register = self._rtc_register()
+        if register is not None:
+            return self.rtc_latched[register]
+        return super()._read_external_memory(byte)
+
+    def _write_external_memory(self, byte, value):
+        register = self._rtc_register()
+        if register is not None and self.ram_enabled:
+            self.rtc[register] = value & 0xFF
+            return
+        super()._write_external_memory(byte, value)
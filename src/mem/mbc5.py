@@ -0,0 +1,39 @@
+from mem.banked import BankedMapper
+
+
+class MBC5(BankedMapper):
+    """
+    MBC5, with up to 512 ROM banks and 16 RAM banks. Unlike the MBC1 and
+    MBC3, bank 0 can be mapped at 0x4000-0x7FFF too.
+    """
+
+    REGISTERS = (
+        (0x0000, 0x1FFF, "_write_ram_enable"),
+        (0x2000, 0x2FFF, "_write_rom_low"),
+        (0x3000, 0x3FFF, "_write_rom_high"),
+        (0x4000, 0x5FFF, "_write_ram_bank"),
+    )
+
+    BANK_STATE = ("rom_select", "ram_select")
+    STATE_FORMAT = BankedMapper.STATE_FORMAT + "HH"
+
+    def __init__(self, cart, screen, save_path=None):
+        self.rom_select = 1
+        self.ram_select = 0
+        super().__init__(cart, screen, save_path)
+
+    def _banks(self):
+        return self.rom_select, self.ram_select
+
+    def _write_rom_low(self, byte, value):
+        self.rom_select = (self.rom_select & 0x100) | value
+        self._update_banks()
+
+    def _write_rom_high(self, byte, value):
+        self.rom_select = (value & 0x1) << 8 | (self.rom_select & 0xFF)
+        self._update_banks()
+
+    def _write_ram_bank(self, byte, value):
+        # Bit 3 drives the rumble motor on carts which have one.
+        self.ram_select = value & 0x0F
+        self._update_banks()
@@ -1,5 +1,13 @@
 import logging
+import struct
 from cartridge import Cartridge
+from scheduler import NEVER
+
+# Reads a little endian 16-bit value out of a buffer, at an offset.
+_unpack_16 = struct.Struct("<H").unpack_from
+
+# Page table entries of the unmapped 0xA000-0xBFFF region.
+_NO_RAM_PAGES = [None] * 0x20
 
 
 class MemoryOutOfBoundsError(Exception):
@@ -11,35 +19,283 @@ class MemoryAccessDeniedError(Exception):
 
 
 class MemoryController(object):
-
-    def __init__(self, cart, screen):
+    # Layout of the shared RAM buffer. Cartridge RAM has its own buffer, see
+    # get_external_ram.
+    VIDEO_OFFSET = 0x0000   # 0x8000-0x9FFF
+    IMEM_OFFSET = 0x2000    # 0xC000-0xDFFF
+    OAM_OFFSET = 0x4000     # 0xFE00-0xFE9F
+    HREG_OFFSET = 0x40A0    # 0xFF00-0xFF7F
+    HMEM_OFFSET = 0x4120    # 0xFF80-0xFFFE
+    RAM_SIZE = 0x419F
+
+    # Layout of get_state: interrupts enabled, ROM bank. Controllers with
+    # more state append to it. The RAM buffer is saved separately.
+    STATE_FORMAT = "<BH"
+
+    def __init__(self, cart, screen, external_ram=None):
         """
         :type cart: Cartridge
         :type screen: Screen
+        :param external_ram: Writable buffer of cart.ram_size bytes backing
+                             cartridge RAM, e.g. a mapped save file. A new
+                             one is allocated if not given.
         """
         self.type = "GenericMemoryUnit"
         self.cart = cart
         self.screen = screen
         self._log = logging.getLogger("MemoryController")
 
+        # Every RAM region of the Gameboy itself lives in one contiguous
+        # buffer, and is accessed through a memoryview slice of it.
+        self._ram = bytearray(self.RAM_SIZE)
+        view = memoryview(self._ram)
+
         # Video RAM
-        self._video = [0]*(0xA000-0x8000)
+        self._video = view[self.VIDEO_OFFSET:self.VIDEO_OFFSET + 0x2000]
 
-        # External and Internal memory
-        self._emem = None
-        self._imem = [0]*(0xE000-0xC000)
-        self._hmem = [0]*(0xFFFF-0xFF80)
+        # Internal memory
+        self._imem = view[self.IMEM_OFFSET:self.IMEM_OFFSET + 0x2000]
+        self._hmem = view[self.HMEM_OFFSET:self.HMEM_OFFSET + 0x7F]
 
         # Object Attribute Memory
         # Stores attributes for each of the sprites being drawn on the screen.
-        self._oam = [0]*(0xFEA0-0xFE00)
+        self._oam = view[self.OAM_OFFSET:self.OAM_OFFSET + 0xA0]
 
         # Hardware Registers
-        self._hreg = [0]*(0xFF80-0xFF00)
+        self._hreg = view[self.HREG_OFFSET:self.HREG_OFFSET + 0x80]
+
+        # One flag for each of the 384 tiles at 0x8000-0x97FF, set when the
+        # tile is written to. Cleared by the renderer once it decoded it.
+        self.tile_dirty = bytearray(b"\x01" * 384)
+
+        # Handlers for hardware registers owned by a peripheral, see map_io.
+        # Registers without a handler are plain bytes in _hreg.
+        self._io_reads = [None] * 0x80
+        self._io_writes = [None] * 0x80
+        self._io_changes = [None] * 0x80
 
         # Interrupt Enable Register
         self.interrupts_enabled = True
 
+        # ROM bank mapped in to 0x4000-0x7FFF. Controllers without banking
+        # always map bank 1 there.
+        self.rom_bank = 1
+
+        # The 16 KB ROM banks mapped at 0x0000-0x3FFF and 0x4000-0x7FFF, which
+        # read16 reads from directly. None while a region isn't backed by a
+        # whole bank.
+        self.rom_views = [None, None]
+
+        # The 64 page views of each ROM bank, so that switching banks only
+        # swaps page table entries, see map_rom_bank.
+        self._rom_bank_pages = {}
+
+        # External memory, see use_external_ram.
+        if external_ram is None:
+            external_ram = bytearray(cart.ram_size)
+        self.use_external_ram(external_ram)
+
+        # Pages of RAM holding cached code, see BlockCache.
+        self.block_cache = None
+        self.code_pages = bytearray(0x100)
+
+        self._init_pages()
+        self.map_io(0xFF40, 0xFF4B, screen.read, screen.write, screen.changes)
+
+    def _init_pages(self):
+        """
+        Builds the page tables used by read() and write(). There is one entry
+        for each 256 byte page of the address space, indexed by (byte >> 8).
+        Memory pages hold a 256 byte memoryview which is indexed directly,
+        I/O and protected pages hold None and are passed on to the handler in
+        the matching entry of the handler table.
+        """
+        self._read_pages = [None] * 0x100
+        self._write_pages = [None] * 0x100
+        self._read_handlers = [self._read_unmapped] * 0x100
+        self._write_handlers = [self._write_unmapped] * 0x100
+
+        # Video Memory, writes to tile data mark the tile dirty.
+        self.map_pages(0x80, 0x9F, self._video, 0x8000)
+        self.map_handlers(0x80, 0x97, write=self._write_tile_data)
+
+        # Internal Memory
+        self.map_pages(0xC0, 0xDF, self._imem, 0xC000)
+
+        # Reserved Memory
+        self.map_handlers(0xE0, 0xFD, self._read_echo, self._write_echo)
+
+        # Object Attribute Memory and Unused Memory
+        self.map_handlers(0xFE, 0xFE, self._read_oam, self._write_oam)
+
+        # Hardware Registers, High memory and the Interrupt Enabled register
+        self.map_handlers(0xFF, 0xFF, self._read_high, self._write_high)
+
+    def map_pages(self, first, last, buf, base, read=True, write=True):
+        """
+        Points the pages [first, last] at a backing buffer.
+        :param first: The first page (address >> 8) to map.
+        :param last: The last page to map, inclusive.
+        :param buf: The backing buffer, which must cover every mapped page.
+        :param base: The address which maps to buf[0].
+        :param read: Map the pages for reading.
+        :param write: Map the pages for writing.
+        """
+        view = memoryview(buf)
+        for page in range(first, last + 1):
+            offset = (page << 8) - base
+            entry = view[offset:offset + 0x100]
+            if read:
+                self._read_pages[page] = entry
+            if write:
+                self._write_pages[page] = entry
+
+    @staticmethod
+    def _pages(buf):
+        """
+        :return: A list of 256 byte memoryviews covering buf. A short last
+                 page, and the pages past the end of buf up to 8 KB, are None.
+        """
+        view = memoryview(buf)
+        pages = [view[offset:offset + 0x100]
+                 for offset in range(0, len(view) - 0xFF, 0x100)]
+        return pages + [None] * (0x20 - len(pages))
+
+    def use_external_ram(self, buf):
+        """
+        Backs cartridge RAM with a buffer, and pre-slices the 32 page views
+        of each of its 8 KB banks, see map_ram_bank. A bank which is mapped
+        keeps using the previous buffer until it is mapped again.
+        :param buf: Writable buffer of cart.ram_size bytes.
+        """
+        self._emem = memoryview(buf)
+        self._ram_bank_pages = [self._pages(self._emem[offset:offset + 0x2000])
+                                for offset in range(0, len(self._emem), 0x2000)]
+
+    def map_rom_bank(self, region, bank):
+        """
+        Maps a ROM bank in to 0x0000-0x3FFF (region 0) or 0x4000-0x7FFF
+        (region 1), by swapping in its pre-sliced pages.
+        :param region: 0 or 1.
+        :param bank: The bank, see Cartridge.get_rom_bank.
+        """
+        mapping = self._rom_bank_pages.get(bank)
+        if mapping is None:
+            view = self.cart.get_rom_bank(bank)
+            mapping = view, [view[offset:offset + 0x100]
+                             for offset in range(0, 0x4000, 0x100)]
+            self._rom_bank_pages[bank] = mapping
+
+        first = region << 6
+        self.rom_views[region], self._read_pages[first:first + 0x40] = mapping
+
+    def map_ram_bank(self, bank, writable):
+        """
+        Maps a bank of cartridge RAM in to 0xA000-0xBFFF, by swapping in its
+        pre-sliced pages. Accesses to pages which aren't mapped, because the
+        bank doesn't exist or isn't writable, go to the handlers of the
+        0xA0-0xBF pages.
+        :param bank: The 8 KB bank, or None to unmap cartridge RAM.
+        :param writable: Map the bank for writing as well as reading.
+        """
+        if bank is not None and bank < len(self._ram_bank_pages):
+            pages = self._ram_bank_pages[bank]
+        else:
+            pages = _NO_RAM_PAGES
+        self._read_pages[0xA0:0xC0] = pages
+        self._write_pages[0xA0:0xC0] = pages if writable else _NO_RAM_PAGES
+
+    def map_handlers(self, first, last, read=None, write=None):
+        """
+        Routes the pages [first, last] through handler functions.
+        :param first: The first page (address >> 8) to map.
+        :param last: The last page to map, inclusive.
+        :param read: Called as read(byte) for reads, if given.
+        :param write: Called as write(byte, value) for writes, if given.
+        """
+        for page in range(first, last + 1):
+            if read is not None:
+                self._read_pages[page] = None
+                self._read_handlers[page] = read
+            if write is not None:
+                self._write_pages[page] = None
+                self._write_handlers[page] = write
+
+    def map_io(self, first, last, read, write, changes=None):
+        """
+        Routes the hardware registers [first, last] to a peripheral, which
+        computes their values when they are read.
+        :param first: The first register, e.g. 0xFF04.
+        :param last: The last register, inclusive.
+        :param read: Called as read(byte) for reads.
+        :param write: Called as write(byte, value) for writes.
+        :param changes: Called as changes(byte, cycle), returns the next cycle
+                        after cycle at which the value read may change, see
+                        next_change.
+        """
+        for byte in range(first - 0xFF00, last - 0xFF00 + 1):
+            self._io_reads[byte] = read
+            self._io_writes[byte] = write
+            self._io_changes[byte] = changes
+
+    def next_change(self, byte, cycle):
+        """
+        Finds the earliest cycle after cycle at which reading byte may return
+        a different value, without the CPU writing to memory or a scheduled
+        event firing.
+        :param byte: The address.
+        :param cycle: The cycle at which it was read.
+        :return: The cycle, or NEVER if the value can't change by itself.
+        """
+        if 0xFF00 <= byte <= 0xFF7F:
+            index = byte - 0xFF00
+            changes = self._io_changes[index]
+            if changes is not None:
+                return changes(byte, cycle)
+            if self._io_reads[index] is not None:
+                # No way to know, so assume it changes straight away.
+                return cycle
+        return NEVER
+
+    def get_state(self):
+        """
+        :return: The values packed by STATE_FORMAT, see state.py.
+        """
+        return int(self.interrupts_enabled), self.rom_bank
+
+    def set_state(self, values):
+        """
+        :param values: Values unpacked by STATE_FORMAT.
+        """
+        interrupts_enabled, self.rom_bank = values
+        self.interrupts_enabled = bool(interrupts_enabled)
+
+    def touch_video(self):
+        """
+        Marks every tile dirty, after video memory was changed without
+        going through write().
+        """
+        self.tile_dirty[:] = b"\x01" * len(self.tile_dirty)
+
+    def close(self):
+        """
+        Releases anything the controller holds on to, e.g. a save file.
+        """
+        pass
+
+    def get_ram(self):
+        """
+        :return: A memoryview of the buffer backing every RAM region, other
+                 than cartridge RAM.
+        """
+        return memoryview(self._ram)
+
+    def get_external_ram(self):
+        """
+        :return: A memoryview of the buffer backing cartridge RAM.
+        """
+        return self._emem
+
     def read(self, byte, size=1):
         """
         Generic read which will read from any of the Gameboy's memory units.
@@ -49,75 +305,105 @@ class MemoryController(object):
         :param size: The number of bytes to read. Currently not implemented.
         :return:
         """
+        # Addresses wrap around, e.g. SP + 1 with SP at 0xFFFF.
+        byte &= 0xFFFF
+        page = self._read_pages[byte >> 8]
+        if page is None:
+            return self._read_handlers[byte >> 8](byte)
+        return page[byte & 0xFF]
+
+    def read16(self, byte):
+        """
+        Reads a little endian 16-bit value, such as an instruction's
+        immediate operand. Within a ROM bank this is a single read of the
+        bank, anywhere else it is two reads.
+        :param byte: The address of the low byte.
+        :return: The value.
+        """
+        byte &= 0xFFFF
+        if byte < 0x8000 and byte & 0x3FFF != 0x3FFF:
+            view = self.rom_views[byte >> 14]
+            if view is not None:
+                return _unpack_16(view, byte & 0x3FFF)[0]
+        return self.read(byte) | self.read(byte + 1) << 8
+
+    def write(self, byte, value, size=1):
+        byte &= 0xFFFF
+        page = self._write_pages[byte >> 8]
+        if page is None:
+            return self._write_handlers[byte >> 8](byte, value)
+
+        page[byte & 0xFF] = value & 0xFF
+        if self.code_pages[byte >> 8]:
+            self.block_cache.invalidate(byte)
+        return None
 
-        # Video Memory
-        if 0x8000 <= byte <= 0x9FFF:
-            return self._video[byte-0x8000]
+    def _read_unmapped(self, byte):
+        return 0xFF
 
-        # Internal Memory
-        if 0xC000 <= byte <= 0xDFFF:
-            val = self._imem[byte-0xC000]
-            return val
+    def _write_unmapped(self, byte, value):
+        return None
 
-        # Reserved Memory
-        if 0xE000 <= byte <= 0xFDFF:
-            self._log.warning("Nintendo standards specify that reading from "
-                              "[E000-FDFF] is discouraged.")
-            return self._imem[(byte-0xE000)]
+    def _write_tile_data(self, byte, value):
+        offset = byte - 0x8000
+        self._video[offset] = value & 0xFF
+        self.tile_dirty[offset >> 4] = 1
+
+    def _read_echo(self, byte):
+        self._log.warning("Nintendo standards specify that reading from "
+                          "[E000-FDFF] is discouraged.")
+        return self._imem[(byte-0xE000)]
 
+    def _write_echo(self, byte, value):
+        raise MemoryAccessDeniedError("Cannot write to ECHO RAM")
+
+    def _read_oam(self, byte):
         # Unused Memory
-        if 0xFEA0 <= byte <= 0xFEFF:
+        if byte >= 0xFEA0:
             raise MemoryAccessDeniedError("Attempted to read from unused RAM"
                                           " space.")
+        return self._oam[byte - 0xFE00]
 
+    def _write_oam(self, byte, value):
+        # Unused Memory
+        if byte >= 0xFEA0:
+            raise MemoryAccessDeniedError("Cannot write to Unused Memory")
+        self._oam[byte - 0xFE00] = value & 0xFF
+
+    def _read_high(self, byte):
         # Hardware Registers
-        if 0xFF00 <= byte <= 0xFF7F:
-            if 0xFF40 <= byte <= 0xFF4B:
-                self.screen.read(byte)
+        if byte <= 0xFF7F:
+            read = self._io_reads[byte - 0xFF00]
+            if read is not None:
+                return read(byte)
             return self._hreg[byte - 0xFF00]
 
         # High memory
-        if 0xFF80 <= byte <= 0xFFFE:
+        if byte <= 0xFFFE:
             return self._hmem[byte - 0xFF80]
 
         # Interrupt Enabled register
-        if byte == 0xFFFF:
-            return 1 if self.interrupts_enabled else 0
-
-        return 0xFF
-
-    def write(self, byte, value, size=1):
-        # Video Memory
-        if 0x8000 <= byte <= 0x9FFF:
-            self._video[byte-0x8000] = value
-
-        # Internal Memory
-        elif 0xC000 <= byte <= 0xDFFF:
-            self._imem[byte-0xC000] = value
-
-        # Reserved Memory
-        elif 0xE000 <= byte <= 0xFDFF:
-            raise MemoryAccessDeniedError("Cannot write to ECHO RAM")
-
-        # Unused Memory
-        elif 0xFEA0 <= byte <= 0xFEFF:
-            raise MemoryAccessDeniedError("Cannot write to Unused Memory")
+        return 1 if self.interrupts_enabled else 0
 
+    def _write_high(self, byte, value):
         # Hardware Registers
-        elif 0xFF00 <= byte <= 0xFF7F:
+        if byte <= 0xFF7F:
             self._log.debug("HReg [{:02x}] set to {:02x}".format(byte, value))
 
-            if self.screen.in_range(byte):
-                self.screen.write(byte, value)
+            write = self._io_writes[byte - 0xFF00]
+            if write is not None:
+                write(byte, value & 0xFF)
             else:
-                self._hreg[byte - 0xFF00] = value
+                self._hreg[byte - 0xFF00] = value & 0xFF
 
         # High memory
-        elif 0xFF80 <= byte <= 0xFFFE:
-            self._hmem[byte - 0xFF80] = value
+        elif byte <= 0xFFFE:
+            self._hmem[byte - 0xFF80] = value & 0xFF
+            if self.code_pages[0xFF]:
+                self.block_cache.invalidate(byte)
 
         # Interrupt Enabled register
-        elif byte == 0xFFFF:
+        else:
             self.interrupts_enabled = 1 if value == 0x1 else 0
 
         return None
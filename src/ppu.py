@@ -0,0 +1,187 @@
+"""
+Scanline renderer.
+
+Draws one line at a time from video memory and OAM in to a 160x144 array of
+shades (0 = white, 3 = black), using the register values of that line:
+
+    LCDC Bit 7 -> LCD on
+         Bit 6 -> Window tile map, 0x9800 or 0x9C00
+         Bit 5 -> Window enabled
+         Bit 4 -> Tile data, 0x8800 (signed tile numbers) or 0x8000
+         Bit 3 -> Background tile map, 0x9800 or 0x9C00
+         Bit 2 -> Sprite size, 8x8 or 8x16
+         Bit 1 -> Sprites enabled
+         Bit 0 -> Background and window enabled
+
+Tiles are 16 bytes, two per row of 8 pixels. The first byte holds the low bit
+of each pixel's colour and the second the high bit, with the leftmost pixel
+in bit 7. The 384 tiles at 0x8000-0x97FF are kept decoded, and a tile is only
+decoded again after the memory controller marks it dirty.
+"""
+import numpy as np
+
+WIDTH = 160
+HEIGHT = 144
+
+# Sprites drawn per line, at most.
+MAX_SPRITES = 10
+
+# Shift which moves each pixel's bit in to bit 0, leftmost pixel first.
+SHIFTS = np.arange(7, -1, -1, dtype=np.uint8)
+
+
+def decode_rows(low, high):
+    """
+    Decodes rows of 2bpp tile data.
+    :param low: Array of the first byte of each row.
+    :param high: Array of the second byte of each row, of the same shape.
+    :return: Array of colour indices, of the same shape plus an axis of 8.
+    """
+    low = (low[..., None] >> SHIFTS) & 1
+    high = (high[..., None] >> SHIFTS) & 1
+    return (high << 1) | low
+
+
+def palette(value):
+    """
+    :param value: A palette register, e.g. BGP.
+    :return: Array mapping colour indices to shades.
+    """
+    return np.array([(value >> (2 * i)) & 0x3 for i in range(4)], dtype=np.uint8)
+
+
+class Renderer(object):
+
+    def __init__(self, mem):
+        """
+        :type mem: MemoryController
+        """
+        ram = np.frombuffer(mem.get_ram(), dtype=np.uint8)
+        self._video = ram[mem.VIDEO_OFFSET:mem.VIDEO_OFFSET + 0x2000]
+        self._oam = ram[mem.OAM_OFFSET:mem.OAM_OFFSET + 0xA0].reshape(40, 4)
+
+        # Decoded tiles, indexed by [tile, row, column], and the dirty flags
+        # telling which of them are stale.
+        self._tile_data = self._video[:0x1800].reshape(384, 8, 2)
+        self._tiles = np.zeros((384, 8, 8), dtype=np.uint8)
+        self._dirty = np.frombuffer(mem.tile_dirty, dtype=np.uint8)
+
+        self.framebuffer = np.zeros((HEIGHT, WIDTH), dtype=np.uint8)
+
+        # Line of the window drawn next. It only advances on lines which
+        # show the window.
+        self._window_line = 0
+
+        # Background colour indices of the current line, before the palette
+        # is applied, which decide whether low priority sprites are hidden.
+        self._background = np.zeros(WIDTH, dtype=np.uint8)
+
+        self._x = np.arange(WIDTH)
+
+    def _update_tiles(self):
+        """
+        Decodes every dirty tile.
+        """
+        dirty = np.flatnonzero(self._dirty)
+        if len(dirty):
+            data = self._tile_data[dirty]
+            self._tiles[dirty] = decode_rows(data[..., 0], data[..., 1])
+            self._dirty[dirty] = 0
+
+    def _tile_row(self, tiles, row):
+        """
+        :param tiles: Array of tile numbers in [0, 384).
+        :param row: The row of the tiles.
+        :return: Array of shape (len(tiles), 8) of colour indices.
+        """
+        return self._tiles[tiles, row]
+
+    def _map_tiles(self, lcdc, base, row):
+        """
+        :return: The tile numbers of a row of a tile map.
+        """
+        tiles = self._video[base + row * 32:base + row * 32 + 32].astype(np.intp)
+        if not lcdc & 0x10:
+            # Tile numbers are signed, relative to tile 256 (0x9000).
+            tiles = (tiles ^ 0x80) + 128
+        return tiles
+
+    def blank(self, line):
+        self.framebuffer[line] = 0
+
+    def render_line(self, line, lcdc, scy, scx, bgp, obp0, obp1, wy, wx):
+        """
+        Draws a line of the framebuffer.
+        :param line: The line, LY.
+        """
+        if line == 0:
+            self._window_line = 0
+        self._update_tiles()
+
+        background = self._background
+        if lcdc & 0x01:
+            y = (line + scy) & 0xFF
+            base = 0x1C00 if lcdc & 0x08 else 0x1800
+            pixels = self._tile_row(self._map_tiles(lcdc, base, y >> 3), y & 7).ravel()
+            background[:] = pixels[(self._x + scx) & 0xFF]
+
+            left = wx - 7
+            if lcdc & 0x20 and wy <= line and left < WIDTH:
+                base = 0x1C00 if lcdc & 0x40 else 0x1800
+                y = self._window_line
+                pixels = self._tile_row(self._map_tiles(lcdc, base, y >> 3), y & 7).ravel()
+                start = max(left, 0)
+                background[start:] = pixels[start - left:WIDTH - left]
+                self._window_line += 1
+        else:
+            background[:] = 0
+
+        out = self.framebuffer[line]
+        out[:] = palette(bgp)[background]
+
+        if lcdc & 0x02:
+            self._render_sprites(line, lcdc, obp0, obp1, out)
+
+    def _render_sprites(self, line, lcdc, obp0, obp1, out):
+        height = 16 if lcdc & 0x04 else 8
+        oam = self._oam
+
+        top = oam[:, 0].astype(np.intp) - 16
+        visible = np.flatnonzero((top <= line) & (line < top + height))[:MAX_SPRITES]
+        if not len(visible):
+            return
+
+        # Sprites further left are drawn on top, and for equal x the one
+        # earlier in OAM. The first opaque sprite pixel in that order takes
+        # the pixel, even when it is then hidden behind the background.
+        order = sorted(visible, key=lambda i: (oam[i, 1], i))
+        palettes = (palette(obp0), palette(obp1))
+        taken = np.zeros(WIDTH, dtype=bool)
+        for i in order:
+            y, x, tile, attributes = oam[i]
+            row = line - (int(y) - 16)
+            if attributes & 0x40:
+                row = height - 1 - row
+            if height == 16:
+                tile &= 0xFE
+
+            # The rows of 8x16 sprites continue in to the next tile.
+            pixels = self._tiles[int(tile) + (row >> 3), row & 7]
+            if attributes & 0x20:
+                pixels = pixels[::-1]
+
+            left = int(x) - 8
+            start = max(left, 0)
+            end = min(left + 8, WIDTH)
+            if start >= end:
+                continue
+            pixels = pixels[start - left:end - left]
+
+            opaque = pixels != 0
+            shown = opaque & ~taken[start:end]
+            taken[start:end] |= opaque
+            if attributes & 0x80:
+                # Behind background colours 1-3.
+                shown &= self._background[start:end] == 0
+            target = out[start:end]
+            target[shown] = palettes[(attributes >> 4) & 1][pixels[shown]]
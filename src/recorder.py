@@ -0,0 +1,151 @@
+"""
+Headless frame recording.
+
+Every shown frame (see Screen.frame_skip) is copied in to a bounded queue, and
+a background thread hands queued frames to a sink, which does the encoding and
+I/O. When the sink falls behind, the queue fills up and new frames are either
+dropped or the emulator waits for room, depending on drop.
+
+Sinks write frames as 8-bit greyscale, 160 pixels wide and 144 high:
+    RawSink  -> Every frame, one after the other, in one file.
+    PNGSink  -> One PNG file per frame.
+    PipeSink -> Every frame, to the stdin of another program, e.g.
+                ffmpeg -f rawvideo -pix_fmt gray -s 160x144 -r 60 -i - out.mp4
+"""
+import logging
+import os
+import queue
+import struct
+import subprocess
+import threading
+import zlib
+
+import numpy as np
+
+from ppu import HEIGHT, WIDTH
+
+# Grey level of each shade.
+GREYS = np.array([0xFF, 0xAA, 0x55, 0x00], dtype=np.uint8)
+
+
+class RawSink(object):
+
+    def __init__(self, path):
+        self._handle = open(path, "wb")
+
+    def write(self, sequence, frame):
+        self._handle.write(GREYS[frame].tobytes())
+
+    def close(self):
+        self._handle.close()
+
+
+class PNGSink(object):
+
+    def __init__(self, directory, pattern="frame{:06d}.png"):
+        """
+        :param directory: Directory to write the files to.
+        :param pattern: File name, formatted with the frame's number.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._pattern = pattern
+
+    @staticmethod
+    def _chunk(kind, data):
+        chunk = kind + data
+        return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk))
+
+    def write(self, sequence, frame):
+        # Every row is prefixed with filter type 0, none.
+        rows = np.zeros((HEIGHT, WIDTH + 1), dtype=np.uint8)
+        rows[:, 1:] = GREYS[frame]
+
+        png = b"".join([
+            b"\x89PNG\r\n\x1a\n",
+            self._chunk(b"IHDR", struct.pack(">IIBBBBB", WIDTH, HEIGHT, 8, 0, 0, 0, 0)),
+            self._chunk(b"IDAT", zlib.compress(rows.tobytes())),
+            self._chunk(b"IEND", b""),
+        ])
+        with open(os.path.join(self._directory, self._pattern.format(sequence)), "wb") as handle:
+            handle.write(png)
+
+    def close(self):
+        pass
+
+
+class PipeSink(object):
+
+    def __init__(self, command):
+        """
+        :param command: The program to start, as a list of arguments.
+        """
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, sequence, frame):
+        self._process.stdin.write(GREYS[frame].tobytes())
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+
+class FrameRecorder(object):
+
+    def __init__(self, screen, sink, queue_size=64, drop=True):
+        """
+        Starts recording every shown frame of the screen.
+        :type screen: Screen
+        :param sink: RawSink, PNGSink, PipeSink or any object with the same
+                     write(sequence, frame) and close() methods.
+        :param queue_size: Number of frames which may wait for the sink.
+        :param drop: Drop frames when the queue is full, instead of waiting.
+        """
+        self._log = logging.getLogger("FrameRecorder")
+        self._screen = screen
+        self._sink = sink
+        self._queue = queue.Queue(queue_size)
+        self.drop = drop
+
+        self.sequence = 0
+        self.dropped = 0
+        self.error = None
+
+        self._thread = threading.Thread(target=self._encode, name="FrameRecorder", daemon=True)
+        self._thread.start()
+        screen.add_frame_listener(self._frame)
+
+    def _frame(self):
+        frame = (self.sequence, self._screen.framebuffer.copy())
+        self.sequence += 1
+        if not self.drop:
+            self._queue.put(frame)
+            return
+        try:
+            self._queue.put_nowait(frame)
+        except queue.Full:
+            self.dropped += 1
+
+    def _encode(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # Keep draining, so that the emulator never blocks.
+                continue
+            try:
+                self._sink.write(*item)
+            except Exception as e:
+                self.error = e
+                self._log.exception(e)
+
+    def close(self):
+        """
+        Stops recording, waits for every queued frame to be written, and
+        closes the sink.
+        """
+        self._screen.remove_frame_listener(self._frame)
+        self._queue.put(None)
+        self._thread.join()
+        self._sink.close()
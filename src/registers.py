@@ -0,0 +1,91 @@
+"""
+CPU register file.
+
+The eight 8-bit registers are stored in a bytearray, in the order in which
+the opcodes encode them (B, C, D, E, H, L, (HL), A). The flag register takes
+the otherwise unused (HL) slot, so the flags only ever exist packed in F:
+    Bit 7 -> Z -> Zero
+    Bit 6 -> N -> Subtract
+    Bit 5 -> H -> Half-carry
+    Bit 4 -> C -> Carry
+
+Register pairs are (high, low) tuples of register indices, so rc[0] and rc[1]
+index the two halves of a pair directly.
+"""
+
+B, C, D, E, H, L, F, A = range(8)
+
+BC = (B, C)
+DE = (D, E)
+HL = (H, L)
+AF = (A, F)
+
+NAMES = ("B", "C", "D", "E", "H", "L", "F", "A")
+
+# Flag masks within F.
+FLAG_Z = 0x80
+FLAG_N = 0x40
+FLAG_H = 0x20
+FLAG_C = 0x10
+
+
+class Registers(bytearray):
+    """
+    The 8-bit register file, with accessors for the 16-bit register pairs.
+    Storing a value outside [0x00, 0xFF] raises a ValueError.
+    """
+
+    def __init__(self):
+        super().__init__(8)
+
+    def pair(self, rc):
+        """
+        :param rc: A register pair, e.g. BC.
+        :return: The 16-bit value held in the pair.
+        """
+        return self[rc[0]] << 8 | self[rc[1]]
+
+    def set_pair(self, rc, value):
+        """
+        :param rc: A register pair, e.g. BC.
+        :param value: The 16-bit value to store in the pair.
+        """
+        self[rc[0]] = (value >> 8) & 0xFF
+        self[rc[1]] = value & 0xFF
+
+    @property
+    def bc(self):
+        return self[B] << 8 | self[C]
+
+    @bc.setter
+    def bc(self, value):
+        self[B] = (value >> 8) & 0xFF
+        self[C] = value & 0xFF
+
+    @property
+    def de(self):
+        return self[D] << 8 | self[E]
+
+    @de.setter
+    def de(self, value):
+        self[D] = (value >> 8) & 0xFF
+        self[E] = value & 0xFF
+
+    @property
+    def hl(self):
+        return self[H] << 8 | self[L]
+
+    @hl.setter
+    def hl(self, value):
+        self[H] = (value >> 8) & 0xFF
+        self[L] = value & 0xFF
+
+    @property
+    def af(self):
+        return self[A] << 8 | self[F]
+
+    @af.setter
+    def af(self, value):
+        # The lower nibble of F is always zero.
+        self[A] = (value >> 8) & 0xFF
+        self[F] = value & 0xF0
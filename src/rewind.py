@@ -0,0 +1,133 @@
+"""
+Rewind buffer.
+
+Every interval frames a save state is captured. Only the newest state is kept
+whole, every older one is kept as a delta against the state which followed
+it: the two states are XORed, which zeroes every unchanged byte, and only the
+runs of changed bytes are stored. Rewinding walks back from the newest state,
+and the oldest deltas are dropped first once the buffer exceeds its budget.
+
+A delta is a sequence of runs, each of which is:
+    Offset -> uint32, where the run starts in the state.
+    Length -> uint32, the length of the run.
+    Data   -> The XOR of the two states over the run.
+"""
+import collections
+import logging
+import re
+import struct
+
+import state
+
+RUN = struct.Struct("<II")
+
+# Runs of changed bytes, merging runs separated by fewer unchanged bytes than
+# it takes to start a new run.
+CHANGED = re.compile(b"[^\\x00]+(?:\\x00{1,%d}[^\\x00]+)*" % (RUN.size - 1))
+
+
+def _xor(a, b):
+    size = len(a)
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(size, "little")
+
+
+def encode(old, new):
+    """
+    :return: The delta which turns new back in to old.
+    """
+    runs = []
+    for match in CHANGED.finditer(_xor(old, new)):
+        runs.append(RUN.pack(match.start(), match.end() - match.start()))
+        runs.append(match.group())
+    return b"".join(runs)
+
+
+def decode(new, delta):
+    """
+    :return: The state which delta was encoded against.
+    """
+    changes = bytearray(len(new))
+    offset = 0
+    while offset < len(delta):
+        start, length = RUN.unpack_from(delta, offset)
+        offset += RUN.size
+        changes[start:start + length] = delta[offset:offset + length]
+        offset += length
+    return _xor(new, changes)
+
+
+class Rewind(object):
+
+    def __init__(self, cpu, interval=60, budget=32 * 1024 * 1024):
+        """
+        Starts recording the machine the CPU is part of.
+        :type cpu: CPU
+        :param interval: Number of frames between two states.
+        :param budget: Maximum number of bytes to hold on to.
+        """
+        self._log = logging.getLogger("Rewind")
+        self._cpu = cpu
+        self.interval = interval
+        self.budget = budget
+
+        self._latest = None
+        self._deltas = collections.deque()
+        self.size = 0
+
+        cpu.screen.add_vblank_listener(self._vblank)
+
+    def __len__(self):
+        """
+        :return: The number of states which can be rewound to.
+        """
+        return len(self._deltas) + (self._latest is not None)
+
+    def close(self):
+        """
+        Stops recording, and drops every state.
+        """
+        self._cpu.screen.remove_vblank_listener(self._vblank)
+        self._latest = None
+        self._deltas.clear()
+        self.size = 0
+
+    def _vblank(self):
+        if self._cpu.screen.frames % self.interval == 0:
+            self.record()
+
+    def record(self):
+        """
+        Captures the current state.
+        """
+        current = state.save_state(self._cpu)
+        if self._latest is not None:
+            delta = encode(self._latest, current)
+            self._deltas.append(delta)
+            self.size += len(delta) - len(self._latest)
+        self._latest = current
+        self.size += len(current)
+
+        while self._deltas and self.size > self.budget:
+            self.size -= len(self._deltas.popleft())
+
+    def rewind(self, count=1):
+        """
+        Restores the state recorded count states before the newest, and drops
+        every state after it. Rewinding 0 states restores the newest one.
+        :param count: The number of states to go back.
+        :return: The number of states actually gone back, which is smaller
+                 than count if the buffer doesn't go back that far.
+        """
+        if self._latest is None:
+            return 0
+
+        count = min(count, len(self._deltas))
+        current = self._latest
+        for i in range(count):
+            delta = self._deltas.pop()
+            self.size -= len(delta)
+            current = decode(current, delta)
+        self._latest = current
+
+        state.load_state(self._cpu, current)
+        return count
@@ -0,0 +1,69 @@
+"""
+Event scheduler.
+
+Peripherals don't count cycles themselves. Instead they schedule a callback
+at the absolute cycle (on CPU.cycles) at which something next happens to
+them, e.g. the screen reaching vblank. The CPU only compares its cycle count
+against the earliest deadline once per block, and calls run when it has been
+reached, so a peripheral with nothing due costs nothing.
+"""
+import heapq
+
+# Deadline used when nothing is scheduled.
+NEVER = float("inf")
+
+
+class Scheduler(object):
+
+    def __init__(self):
+        # Heap of [deadline, sequence, callback]. The sequence number keeps
+        # events with the same deadline in the order they were scheduled.
+        self._events = []
+        self._sequence = 0
+
+        # The earliest deadline, or NEVER.
+        self.deadline = NEVER
+
+    def schedule(self, at, callback):
+        """
+        Schedules callback(at) to be called once the CPU reaches cycle at.
+        :param at: The absolute cycle at which to call the callback.
+        :param callback: Called with the cycle it was scheduled for, which may
+                         be slightly in the past, as events fire between blocks.
+        :return: The event, which can be passed to cancel.
+        """
+        event = [at, self._sequence, callback]
+        self._sequence += 1
+        heapq.heappush(self._events, event)
+        if at < self.deadline:
+            self.deadline = at
+        return event
+
+    def cancel(self, event):
+        """
+        Cancels a scheduled event. Cancelling an event which already fired
+        does nothing.
+        :param event: The event returned by schedule.
+        """
+        # Cancelled events are skipped when they reach the top of the heap.
+        event[2] = None
+
+    def clear(self):
+        """
+        Drops every scheduled event.
+        """
+        self._events = []
+        self.deadline = NEVER
+
+    def run(self, now):
+        """
+        Calls every callback which is due at cycle now, in deadline order.
+        Callbacks may schedule further events.
+        :param now: The current cycle.
+        """
+        events = self._events
+        while events and events[0][0] <= now:
+            at, _, callback = heapq.heappop(events)
+            if callback is not None:
+                callback(at)
+        self.deadline = events[0][0] if events else NEVER
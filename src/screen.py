@@ -16,9 +16,34 @@ Required Hardware Registers:
     FF4B -> WX   -> Window X
 """
 import logging
+from ppu import Renderer
+from scheduler import NEVER
+
+# Number of cycles in a frame, and the number of lines in it. Lines
+# [0, 144) are drawn, [144, 154) are vblank.
+FRAME_CYCLES = 83836
+LINES = 154
+VBLANK_LINE = 144
+
+# Length of a line in dots, and where modes 2 and 3 end within it.
+LINE_DOTS = 456
+OAM_DOTS = 80
+TRANSFER_DOTS = 252
+
+# Registers which change how a line is drawn, indexed by byte - 0xFF40:
+# LCDC, SCY, SCX, BGP, OBP0, OBP1, WY, WX.
+RASTER_REGISTERS = frozenset([0x0, 0x2, 0x3, 0x7, 0x8, 0x9, 0xA, 0xB])
+
+# STAT modes.
+MODE_HBLANK = 0
+MODE_VBLANK = 1
+MODE_OAM = 2
+MODE_TRANSFER = 3
 
 
 class Screen(object):
+    # Layout of get_state: origin, frames, LCDC, STAT, other registers.
+    STATE_FORMAT = "<QQBB12s"
 
     def __init__(self):
         """
@@ -30,7 +55,30 @@ class Screen(object):
         self._log = logging.getLogger("Screen")
         self._cpu = None
 
-        self.cycles = 0
+        # Number of frames completed, i.e. vblanks.
+        self.frames = 0
+
+        # Called after every vblank, see add_vblank_listener.
+        self._vblank_listeners = []
+
+        # Only every frame_skip-th frame is passed on to the frame listeners,
+        # see add_frame_listener.
+        self.frame_skip = 1
+        self._frame_listeners = []
+
+        # Frames are only drawn when the framebuffer is asked for. Until
+        # then, a frame is kept as the raster registers at its start and a
+        # list of (line, register, value) writes made while it was drawn,
+        # so that it can be drawn line by line later. See framebuffer.
+        self._renderer = None
+        self._frame_started = 0
+        self._frame_start = None
+        self._frame_writes = []
+        self._completed = None
+
+        # The cycle at which the first frame started. LY and the STAT mode
+        # are never stored, but computed from the CPU cycles since then.
+        self._origin = 0
 
         self._lcd_control = 1
         self._window_tile_map = 0
@@ -41,7 +89,12 @@ class Screen(object):
         self._obj_display = 0
         self._bg_display = 1
 
-        self._cur_line = 0
+        # Writable bits of STAT, i.e. the interrupt selection.
+        self._stat = 0
+
+        # Plain registers, indexed by byte - 0xFF40. LCDC, STAT and LY are
+        # computed instead.
+        self._regs = bytearray(12)
 
     def _get_lcdc(self):
         return (self._lcd_control << 7) | (self._window_tile_map << 6) | (self._window_display << 5) | \
@@ -49,41 +102,232 @@ class Screen(object):
                (self._obj_display << 1) | self._bg_display
 
     def _set_lcdc(self, value):
-        self._lcd_control = value & 0b10000000
-        self._window_tile_map = value & 0b01000000
-        self._window_display = value & 0b00100000
-        self._bg_tile_data = value & 0b00010000
-        self._bg_tile_map = value & 0b00001000
-        self._obj_sprite_size = value & 0b00000100
-        self._obj_display = value & 0b00000010
-        self._bg_display = value & 0b00000000
-
-    def in_range(self, byte):
-        # TODO: Implement remaining screen registers.
-        return byte == 0xFF40
+        self._lcd_control = (value >> 7) & 1
+        self._window_tile_map = (value >> 6) & 1
+        self._window_display = (value >> 5) & 1
+        self._bg_tile_data = (value >> 4) & 1
+        self._bg_tile_map = (value >> 3) & 1
+        self._obj_sprite_size = (value >> 2) & 1
+        self._obj_display = (value >> 1) & 1
+        self._bg_display = value & 1
+
+    def _position(self, cycle=None):
+        """
+        :return: (line, dot) of the cycle, by default the current one.
+        """
+        if cycle is None:
+            cycle = self._cpu.cycles
+        dots = (cycle - self._origin) % FRAME_CYCLES * LINES * LINE_DOTS // FRAME_CYCLES
+        return divmod(dots, LINE_DOTS)
+
+    def _cycle_at(self, cycle, line, dot):
+        """
+        :return: The cycle at which the frame containing cycle reaches
+                 (line, dot), which may be line LINES to mean the start of
+                 the next frame.
+        """
+        frame = cycle - (cycle - self._origin) % FRAME_CYCLES
+        dots = line * LINE_DOTS + dot
+        return frame - (-dots * FRAME_CYCLES // (LINES * LINE_DOTS))
+
+    def _get_ly(self):
+        if not self._lcd_control:
+            return 0
+        return self._position()[0]
+
+    def _get_stat(self):
+        if not self._lcd_control:
+            return 0x80 | self._stat
+
+        line, dot = self._position()
+        if line >= VBLANK_LINE:
+            mode = MODE_VBLANK
+        elif dot < OAM_DOTS:
+            mode = MODE_OAM
+        elif dot < TRANSFER_DOTS:
+            mode = MODE_TRANSFER
+        else:
+            mode = MODE_HBLANK
+
+        coincidence = 0x04 if line == self._regs[0x05] else 0
+        return 0x80 | self._stat | coincidence | mode
 
     def read(self, byte):
         op = byte - 0xFF40
         if op == 0:
             return self._get_lcdc()
+        elif op == 1:
+            return self._get_stat()
+        elif op == 4:
+            return self._get_ly()
+        return self._regs[op]
+
+    def changes(self, byte, cycle):
+        """
+        :return: The next cycle after cycle at which the register may read
+                 differently, see MemoryController.next_change.
+        """
+        op = byte - 0xFF40
+        if not self._lcd_control or op not in (1, 4):
+            return NEVER
+
+        line, dot = self._position(cycle)
+        if op == 1 and line < VBLANK_LINE:
+            if dot < OAM_DOTS:
+                return self._cycle_at(cycle, line, OAM_DOTS)
+            elif dot < TRANSFER_DOTS:
+                return self._cycle_at(cycle, line, TRANSFER_DOTS)
+        return self._cycle_at(cycle, line + 1, 0)
 
     def write(self, byte, value):
         op = byte - 0xFF40
         if op == 0:
             self._set_lcdc(value)
+        elif op == 1:
+            self._stat = value & 0x78
+        elif op == 4:
+            # LY is read only.
+            pass
+        else:
+            self._regs[op] = value
+
+        if op in RASTER_REGISTERS:
+            self._frame_writes.append((self._first_line_affected(), op, value))
+
+    def _first_line_affected(self):
+        """
+        :return: The first line drawn after the current cycle. Lines are drawn
+                 all at once as they enter hblank.
+        """
+        if not self._lcd_control:
+            return 0
+        cycle = self._cpu.cycles
+        line, dot = self._position(cycle)
+        if line >= VBLANK_LINE:
+            # Events fire between blocks, so the vblank which starts the next
+            # frame may not have fired yet.
+            if self._frame_started >= self._cycle_at(cycle, VBLANK_LINE, 0):
+                return 0
+            return VBLANK_LINE
+        return line if dot < TRANSFER_DOTS else line + 1
+
+    def _raster_registers(self):
+        """
+        :return: The raster registers, indexed by byte - 0xFF40.
+        """
+        regs = bytearray(self._regs)
+        regs[0] = self._get_lcdc()
+        return regs
+
+    @property
+    def framebuffer(self):
+        """
+        Draws the last completed frame, if it hasn't been drawn yet. Register
+        writes made while it was drawn are replayed line by line, but video
+        memory and OAM are read as they are now, so the frame is exact when
+        asked for from a vblank listener.
+        :return: A 144x160 NumPy array of shades, 0 (white) to 3 (black).
+        """
+        if self._completed is not None:
+            regs, writes = self._completed
+            self._completed = None
+            self._render(regs, writes)
+        return self._renderer.framebuffer
+
+    def _render(self, regs, writes):
+        """
+        Draws a frame.
+        :param regs: The raster registers at the start of the frame.
+        :param writes: List of (line, register, value) writes to replay.
+        """
+        renderer = self._renderer
+        pending = iter(writes)
+        write = next(pending, None)
+        for line in range(VBLANK_LINE):
+            while write is not None and write[0] <= line:
+                regs[write[1]] = write[2]
+                write = next(pending, None)
+
+            lcdc = regs[0]
+            if lcdc & 0x80:
+                renderer.render_line(line, lcdc, regs[0x2], regs[0x3], regs[0x7],
+                                     regs[0x8], regs[0x9], regs[0xA], regs[0xB])
+            else:
+                renderer.blank(line)
+
+    def _start_frame(self):
+        self._frame_started = self._cpu.cycles
+        self._frame_start = self._raster_registers()
+        self._frame_writes = []
 
     def vblank(self):
         self._log.debug("vblank called.")
         self._cpu.vblank()
 
-    def tick(self, cycles):
+    def _vblank_event(self, at):
+        self.frames += 1
+        self._completed = self._frame_start, self._frame_writes
+        self._start_frame()
+        self.vblank()
+        self._cpu.scheduler.schedule(at + FRAME_CYCLES, self._vblank_event)
+        for listener in self._vblank_listeners:
+            listener()
+        if self.frames % self.frame_skip == 0:
+            for listener in self._frame_listeners:
+                listener()
 
-        self.cycles += cycles
-        if self.cycles >= 83836:
-            self.vblank()
-            self.cycles -= 83836
+    def add_vblank_listener(self, listener):
+        """
+        Calls listener() at the end of every frame, once the vblank interrupt
+        has been raised.
+        :param listener: The function to call.
+        """
+        self._vblank_listeners.append(listener)
 
-    def set_cpu(self, cpu):
-        self._cpu = cpu
+    def remove_vblank_listener(self, listener):
+        self._vblank_listeners.remove(listener)
+
+    def add_frame_listener(self, listener):
+        """
+        Calls listener() at the end of every frame which is shown, which is
+        every frame_skip-th frame, after the vblank listeners. Listeners which
+        want the picture read framebuffer, which draws it.
+        :param listener: The function to call.
+        """
+        self._frame_listeners.append(listener)
+
+    def remove_frame_listener(self, listener):
+        self._frame_listeners.remove(listener)
+
+    def _schedule_vblank(self):
+        # frames counts the vblanks which already fired.
+        at = self._origin + FRAME_CYCLES * VBLANK_LINE // LINES + self.frames * FRAME_CYCLES
+        self._cpu.scheduler.schedule(at, self._vblank_event)
+
+    def get_state(self):
+        """
+        :return: The values packed by STATE_FORMAT, see state.py.
+        """
+        return self._origin, self.frames, self._get_lcdc(), self._stat, bytes(self._regs)
 
+    def set_state(self, values):
+        """
+        Restores the registers, and schedules the next vblank. Expects the
+        scheduler to have been cleared.
+        :param values: Values unpacked by STATE_FORMAT.
+        """
+        self._origin, self.frames, lcdc, self._stat, regs = values
+        self._set_lcdc(lcdc)
+        self._regs[:] = regs
+        self._schedule_vblank()
 
+        # The frame in progress can't be drawn exactly any more, start over.
+        self._completed = None
+        self._start_frame()
+
+    def set_cpu(self, cpu):
+        self._cpu = cpu
+        self._origin = cpu.cycles
+        self._renderer = Renderer(cpu.mem)
+        self._start_frame()
+        self._schedule_vblank()
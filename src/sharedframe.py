@@ -0,0 +1,188 @@
+"""
+Framebuffer shared with other processes.
+
+Every shown frame (see Screen.frame_skip) is copied in to a block of shared
+memory, either a multiprocessing.shared_memory block or an mmap'd file, which
+other processes map and read frames from without copying or pickling them:
+
+    Header -> Magic, "GBFB"
+              Sequence, uint64. Number of frames published so far.
+              Front, uint8. Which of the two frames was published last.
+    Frames -> Two 144x160 arrays of shades.
+
+Frames are double buffered: the next frame is written to the frame which
+isn't the front one, and only then published by updating front and sequence.
+A reader holding on to a frame has until the frame after next is published
+before it gets overwritten, which it can detect by checking the sequence.
+"""
+import mmap
+import multiprocessing
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from ppu import HEIGHT, WIDTH
+
+MAGIC = b"GBFB"
+
+# Magic, sequence, front.
+HEADER = struct.Struct("<4s4xQB7x")
+SEQUENCE_OFFSET = 8
+FRONT_OFFSET = 16
+
+FRAME_SIZE = HEIGHT * WIDTH
+SIZE = HEADER.size + 2 * FRAME_SIZE
+
+
+# Shared memory blocks created by this process, by name.
+_created = {}
+
+
+class SharedFramebufferError(Exception):
+    pass
+
+
+def _open(name, path, create):
+    """
+    :return: (buffer, closer) for the shared block, where closer releases it.
+    """
+    if path is not None:
+        mode = "w+b" if create else "r+b"
+        handle = open(path, mode)
+        if create:
+            handle.truncate(SIZE)
+        buf = mmap.mmap(handle.fileno(), SIZE)
+        handle.close()
+        return buf, buf.close
+
+    if create:
+        block = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        _created[block.name] = block
+
+        def close():
+            del _created[block.name]
+            block.close()
+            block.unlink()
+        return block, close
+
+    block = _created.get(name)
+    if block is not None:
+        # A reader in the creating process shares its block, which the
+        # creator releases.
+        return block, lambda: None
+
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching registers the block with the resource
+        # tracker, which unlinks it when the tracker exits. A process started
+        # by multiprocessing shares its parent's tracker, where unregistering
+        # would drop the creator's registration. Any other process has its
+        # own tracker, and unregisters so as not to unlink the creator's
+        # block.
+        block = shared_memory.SharedMemory(name=name)
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(block._name, "shared_memory")
+    return block, block.close
+
+
+def _frames(buf):
+    return np.ndarray((2, HEIGHT, WIDTH), dtype=np.uint8, buffer=buf, offset=HEADER.size)
+
+
+class SharedFramebuffer(object):
+    """
+    Publishes every shown frame of a screen.
+    """
+
+    def __init__(self, screen, name=None, path=None):
+        """
+        Creates the shared block and starts publishing frames to it.
+        :type screen: Screen
+        :param name: Name of the shared memory block, a random one is used
+                     if neither name nor path is given.
+        :param path: File to mmap instead of using shared memory.
+        """
+        self._screen = screen
+        self._block, self._close = _open(name, path, True)
+        buf = self._buffer()
+        HEADER.pack_into(buf, 0, MAGIC, 0, 0)
+        self._frames = _frames(buf)
+        self._header = np.ndarray(1, dtype=np.uint64, buffer=buf, offset=SEQUENCE_OFFSET)
+
+        self.name = None if path is not None else self._block.name
+        self.path = path
+        self.sequence = 0
+        self._front = 0
+
+        screen.add_frame_listener(self.publish)
+
+    def _buffer(self):
+        return getattr(self._block, "buf", self._block)
+
+    def publish(self):
+        """
+        Copies the screen's framebuffer in to the back frame, and makes it
+        the front one.
+        """
+        back = self._front ^ 1
+        self._frames[back] = self._screen.framebuffer
+
+        buf = self._buffer()
+        buf[FRONT_OFFSET] = back
+        self.sequence += 1
+        self._header[0] = self.sequence
+        self._front = back
+
+    def close(self):
+        """
+        Stops publishing, and releases the shared block.
+        """
+        self._screen.remove_frame_listener(self.publish)
+        self._frames = self._header = None
+        self._close()
+
+
+class SharedFramebufferReader(object):
+    """
+    Reads frames published by a SharedFramebuffer, possibly in another process.
+    """
+
+    def __init__(self, name=None, path=None):
+        """
+        :param name: Name of the shared memory block.
+        :param path: mmap'd file, instead of a shared memory block.
+        """
+        self._block, self._close = _open(name, path, False)
+        buf = getattr(self._block, "buf", self._block)
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            self._close()
+            raise SharedFramebufferError("Not a shared framebuffer.")
+
+        self._buf = buf
+        self._frames = _frames(buf)
+        self._header = np.ndarray(1, dtype=np.uint64, buffer=buf, offset=SEQUENCE_OFFSET)
+
+    @property
+    def sequence(self):
+        """
+        :return: The number of frames published so far.
+        """
+        return int(self._header[0])
+
+    def read(self):
+        """
+        :return: (sequence, frame). The frame is a view of the shared block,
+                 which stays valid until sequence + 2 is published.
+        """
+        sequence = self.sequence
+        frame = self._frames[self._buf[FRONT_OFFSET]]
+        if self.sequence != sequence:
+            # Published again while reading front, front is now settled.
+            return self.read()
+        return sequence, frame
+
+    def close(self):
+        self._buf = self._frames = self._header = None
+        self._close()
@@ -0,0 +1,86 @@
+"""
+Save states.
+
+A state is a small fixed header, followed by the state of each component
+packed with its STATE_FORMAT, followed by a copy of the memory controller's
+RAM buffers:
+
+    Header     -> Magic, version, total length of the RAM buffers.
+    CPU        -> CPU.STATE_FORMAT
+    Memory     -> STATE_FORMAT of the memory controller in use.
+    Screen     -> Screen.STATE_FORMAT
+    Timer      -> Timer.STATE_FORMAT
+    RAM        -> MemoryController.get_ram()
+    Cart RAM   -> MemoryController.get_external_ram()
+
+Scheduled events aren't saved. Each peripheral schedules its next event again
+from its own state when it is restored.
+"""
+import struct
+
+MAGIC = b"GEEBOY"
+VERSION = 2
+
+HEADER = struct.Struct("<6sBI")
+
+
+class StateError(Exception):
+    pass
+
+
+def _components(cpu):
+    return cpu, cpu.mem, cpu.screen, cpu.timer
+
+
+def save_state(cpu):
+    """
+    Captures the state of the machine the CPU is part of.
+    :type cpu: CPU
+    :return: The state, as bytes.
+    """
+    ram = cpu.mem.get_ram()
+    external = cpu.mem.get_external_ram()
+    parts = [HEADER.pack(MAGIC, VERSION, len(ram) + len(external))]
+    for component in _components(cpu):
+        parts.append(struct.pack(component.STATE_FORMAT, *component.get_state()))
+    parts += [ram, external]
+    return b"".join(parts)
+
+
+def load_state(cpu, data):
+    """
+    Restores a state captured by save_state. Registers and RAM are copied in
+    to the existing buffers, as the instruction handlers hold on to them.
+    :type cpu: CPU
+    :param data: The state.
+    """
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise StateError("State is truncated.")
+
+    magic, version, ram_size = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise StateError("Not a save state.")
+    if version != VERSION:
+        raise StateError("Unsupported save state version {}.".format(version))
+
+    ram = cpu.mem.get_ram()
+    external = cpu.mem.get_external_ram()
+    components = _components(cpu)
+    size = HEADER.size + sum(struct.calcsize(c.STATE_FORMAT) for c in components)
+    if ram_size != len(ram) + len(external) or len(view) != size + ram_size:
+        raise StateError("State does not match this cartridge.")
+
+    # Peripherals schedule their next events as they're restored.
+    cpu.scheduler.clear()
+
+    offset = HEADER.size
+    for component in components:
+        component.set_state(struct.unpack_from(component.STATE_FORMAT, view, offset))
+        offset += struct.calcsize(component.STATE_FORMAT)
+    ram[:] = view[offset:offset + len(ram)]
+    external[:] = view[offset + len(ram):]
+    cpu.mem.touch_video()
+
+    # Code in RAM, and the selected ROM bank, may have changed.
+    cpu.blocks.clear()
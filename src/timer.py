@@ -0,0 +1,164 @@
+"""
+Required Hardware Registers:
+    FF04 -> DIV  -> Divider, counts up every 256 cycles. Writing resets it.
+    FF05 -> TIMA -> Timer counter, counts up at the rate selected by TAC.
+                    When it overflows it is reloaded from TMA and a timer
+                    interrupt is requested.
+    FF06 -> TMA  -> Timer modulo.
+    FF07 -> TAC  -> Timer control.
+                    Bit 2   -> Timer enabled
+                    Bit 1-0 -> Rate, see TAC_PERIODS.
+
+Neither counter is stepped. DIV and TIMA are computed from the CPU cycles when
+they are read, and the only scheduled event is TIMA's next overflow.
+
+An overflow sets the timer bit of IF and wakes the CPU from HALT. IE only
+models the vblank interrupt, so the timer interrupt isn't dispatched to its
+vector: a program waiting for it resumes after the HALT, where it can poll IF.
+"""
+import logging
+from scheduler import NEVER
+
+# Cycles per DIV increment.
+DIV_PERIOD = 256
+
+# Cycles per TIMA increment, indexed by the rate bits of TAC.
+TAC_PERIODS = (1024, 16, 64, 256)
+
+# Bit of IF requested on overflow.
+TIMER_INTERRUPT = 2
+
+
+class Timer(object):
+    # Layout of get_state: DIV origin, TIMA, TIMA origin, TMA, TAC.
+    STATE_FORMAT = "<QBQBB"
+
+    def __init__(self, cpu, mem):
+        """
+        :type cpu: CPU
+        :type mem: MemoryController
+        """
+        self._log = logging.getLogger("Timer")
+        self._cpu = cpu
+        self._mem = mem
+
+        # The cycle at which DIV was last reset. TIMA counts on the same
+        # clock, so its increments line up with DIV's.
+        self._div_origin = cpu.cycles
+
+        # The value TIMA had at cycle _tima_origin.
+        self._tima = 0
+        self._tima_origin = cpu.cycles
+
+        self._tma = 0
+        self._tac = 0
+        self._overflow = None
+
+        mem.map_io(0xFF04, 0xFF07, self.read, self.write, self.changes)
+
+    def _enabled(self):
+        return self._tac & 0x4
+
+    def _period(self):
+        return TAC_PERIODS[self._tac & 0x3]
+
+    def _ticks(self, since, now):
+        """
+        :return: The number of TIMA increments in (since, now].
+        """
+        period = self._period()
+        return (now - self._div_origin) // period - (since - self._div_origin) // period
+
+    def _get_tima(self, now):
+        if not self._enabled():
+            return self._tima
+
+        tima = self._tima + self._ticks(self._tima_origin, now)
+        if tima > 0xFF:
+            # The overflow is due, but events only fire between blocks.
+            tima = self._tma + tima - 0x100
+        return tima & 0xFF
+
+    def _latch(self):
+        """
+        Stores the current value of TIMA, before the clock it counts on or
+        its rate changes.
+        """
+        now = self._cpu.cycles
+        self._tima = self._get_tima(now)
+        self._tima_origin = now
+
+    def _schedule_overflow(self):
+        scheduler = self._cpu.scheduler
+        if self._overflow is not None:
+            scheduler.cancel(self._overflow)
+            self._overflow = None
+
+        if self._enabled():
+            period = self._period()
+            tick = (self._tima_origin - self._div_origin) // period + 0x100 - self._tima
+            self._overflow = scheduler.schedule(self._div_origin + tick * period, self._overflow_event)
+
+    def _overflow_event(self, at):
+        self._tima = self._tma
+        self._tima_origin = at
+        self._overflow = None
+        self._schedule_overflow()
+
+        self._mem.set_bit(0xFF0F, TIMER_INTERRUPT, 1)
+        self._cpu.halt = False
+
+    def read(self, byte):
+        op = byte - 0xFF04
+        if op == 0:
+            return ((self._cpu.cycles - self._div_origin) // DIV_PERIOD) & 0xFF
+        elif op == 1:
+            return self._get_tima(self._cpu.cycles)
+        elif op == 2:
+            return self._tma
+        return 0xF8 | self._tac
+
+    def changes(self, byte, cycle):
+        """
+        :return: The next cycle after cycle at which the register may read
+                 differently, see MemoryController.next_change.
+        """
+        op = byte - 0xFF04
+        if op == 0:
+            period = DIV_PERIOD
+        elif op == 1 and self._enabled():
+            period = self._period()
+        else:
+            return NEVER
+        return cycle + period - (cycle - self._div_origin) % period
+
+    def get_state(self):
+        """
+        :return: The values packed by STATE_FORMAT, see state.py.
+        """
+        return self._div_origin, self._tima, self._tima_origin, self._tma, self._tac
+
+    def set_state(self, values):
+        """
+        Restores the registers, and schedules the next overflow. Expects the
+        scheduler to have been cleared.
+        :param values: Values unpacked by STATE_FORMAT.
+        """
+        self._div_origin, self._tima, self._tima_origin, self._tma, self._tac = values
+        self._overflow = None
+        self._schedule_overflow()
+
+    def write(self, byte, value):
+        self._latch()
+
+        op = byte - 0xFF04
+        if op == 0:
+            self._div_origin = self._cpu.cycles
+        elif op == 1:
+            self._tima = value
+        elif op == 2:
+            self._tma = value
+        else:
+            self._tac = value & 0x7
+
+        self._schedule_overflow()
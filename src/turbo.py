@@ -0,0 +1,74 @@
+"""
+Turbo mode.
+
+The CPU is never throttled, so the emulator already runs as fast as it can.
+What slows it down is drawing and passing on every frame, so turbo mode only
+shows every skip-th frame, see Screen.frame_skip. Frames in between still
+raise vblank and run the vblank listeners, but are never drawn.
+
+With a target FPS, the skip is adapted instead: every MEASURE_FRAMES frames the
+emulated frames per second of wall time are measured, and the skip goes up
+while the emulator is slower than the target, and back down while it is
+comfortably faster.
+"""
+import time
+
+# Frames between two measurements of the speed.
+MEASURE_FRAMES = 60
+
+# How much faster than the target the emulator has to be before the skip
+# goes back down, so that it doesn't flip between two values.
+HEADROOM = 1.2
+
+
+class Turbo(object):
+
+    def __init__(self, screen, skip=4, target_fps=None, max_skip=60):
+        """
+        Starts turbo mode.
+        :type screen: Screen
+        :param skip: Show every skip-th frame, or the initial skip when
+                     adapting to target_fps.
+        :param target_fps: Emulated frames per second to aim for, or None to
+                           keep skip fixed.
+        :param max_skip: The largest skip to adapt up to.
+        """
+        self._screen = screen
+        self.target_fps = target_fps
+        self.max_skip = max_skip
+        self.fps = None
+
+        screen.frame_skip = max(1, skip)
+
+        self._started = time.perf_counter()
+        self._counted = 0
+        if target_fps is not None:
+            screen.add_vblank_listener(self._vblank)
+
+    @property
+    def skip(self):
+        return self._screen.frame_skip
+
+    def _vblank(self):
+        self._counted += 1
+        if self._counted < MEASURE_FRAMES:
+            return
+
+        now = time.perf_counter()
+        self.fps = self._counted / max(now - self._started, 1e-9)
+        self._started = now
+        self._counted = 0
+
+        screen = self._screen
+        if self.fps < self.target_fps:
+            screen.frame_skip = min(screen.frame_skip + 1, self.max_skip)
+        elif self.fps > self.target_fps * HEADROOM:
+            screen.frame_skip = max(screen.frame_skip - 1, 1)
+
+    def close(self):
+        """
+        Stops turbo mode, showing every frame again.
+        """
+        if self.target_fps is not None:
+            self._screen.remove_vblank_listener(self._vblank)
+        self._screen.frame_skip = 1
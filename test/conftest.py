@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+sys.path.insert(0, SRC)
+
+from cartridge import Cartridge
+from cpu import CPU
+from instruction import OpcodeParser
+from mem import create_mapper
+from screen import Screen
+
+
+def make_rom(code, at=0x150):
+    """
+    Builds a 32KB ROM only cartridge, which jumps to at on startup.
+    :param code: The bytes of the program.
+    :param at: The address the program is placed at.
+    """
+    rom = bytearray(0x8000)
+    rom[0x100:0x104] = bytes([0x00, 0xC3, at & 0xFF, at >> 8])
+    rom[0x134:0x138] = b"TEST"
+    rom[at:at + len(code)] = code
+    return rom
+
+
+@pytest.fixture
+def machine(tmp_path, monkeypatch):
+    """
+    Returns a function which loads a ROM built by make_rom, and returns its
+    CPU ready to run. Battery backed RAM is kept in save_path, if given.
+    """
+    # The opcode table is loaded relative to src, like GeeBoy does.
+    monkeypatch.chdir(SRC)
+
+    def load(rom, save_path=None):
+        path = tmp_path / "test.gb"
+        path.write_bytes(bytes(rom))
+        cart = Cartridge(str(path))
+        codes = OpcodeParser()
+        codes.load_instructions("./dat/opcodes.json")
+        screen = Screen()
+        cpu = CPU(cart, create_mapper(cart, screen, save_path), codes, screen)
+        screen.set_cpu(cpu)
+        return cpu
+    return load
@@ -0,0 +1,131 @@
+from conftest import make_rom
+from registers import A, B, F, FLAG_C, FLAG_H, FLAG_N, FLAG_Z, H, L
+
+# The flag rules the handlers followed before the tables, as reference.
+
+
+def add(op1, op2, carry):
+    op2 += carry
+    ret = op1 + op2
+    f = 0
+    if ret > 255:
+        f |= FLAG_C
+    if ((op1 & 0xF) + (op2 & 0xF) & 0x10) > 0:
+        f |= FLAG_H
+    if ret == 0:
+        f |= FLAG_Z
+    return ret & 0xFF, f
+
+
+def sub(op1, op2, carry):
+    op2 += carry
+    ret = op1 - op2
+    f = FLAG_N
+    if ret < 0:
+        f |= FLAG_C
+    if (((op1 & 0xF) - (op2 & 0xF)) & 0x10) > 0:
+        f |= FLAG_H
+    if ret == 0:
+        f |= FLAG_Z
+    return ret & 0xFF, f
+
+
+def cp(op1, op2, carry):
+    f = FLAG_N
+    if op1 == op2:
+        f |= FLAG_Z
+    if (((op1 & 0xF) - (op2 & 0xF)) & 0x10) == 0:
+        f |= FLAG_H
+    if op1 < op2:
+        f |= FLAG_C
+    return op1, f
+
+
+def inc(value, carry):
+    ret = (value + 1) & 0xFF
+    f = FLAG_C if carry else 0
+    if ret == 0:
+        f |= FLAG_Z
+    if ((ret & 0xF) + 1 & 0x10) > 0:
+        f |= FLAG_H
+    return ret, f
+
+
+def dec(value, carry):
+    ret = (value - 1) & 0xFF
+    f = (FLAG_C if carry else 0) | FLAG_N
+    if ret == 0:
+        f |= FLAG_Z
+    return ret, f
+
+
+def daa(op1, f_reg):
+    if f_reg & FLAG_N:
+        if f_reg & FLAG_H or (op1 * 0xF) > 0x9:
+            op1 += 0x06
+        if f_reg & FLAG_C or op1 > 0x9F:
+            op1 += 0x60
+    else:
+        if f_reg & FLAG_H:
+            op1 = (op1 - 0x6) & 0xFF
+        if f_reg & FLAG_C:
+            op1 -= 0x60
+    f_reg &= ~0xa0
+    if (op1 & 0x100) == 0x100:
+        f_reg |= 0x10
+    op1 &= 0xFF
+    if op1 == 0:
+        f_reg |= 0x80
+    return op1, f_reg
+
+
+def check_binary(cpu, opcode, reference, with_carry):
+    handler = cpu.instructions.map[opcode]
+    r = cpu.r
+    for carry in range(2) if with_carry else (0,):
+        for op1 in range(256):
+            for op2 in range(256):
+                r[A], r[B], r[F] = op1, op2, carry << 4
+                handler()
+                assert (r[A], r[F]) == reference(op1, op2, carry), (opcode, op1, op2, carry)
+
+
+def test_add(machine):
+    cpu = machine(make_rom(b""))
+    check_binary(cpu, 0x80, add, False)     # ADD A,B
+    check_binary(cpu, 0x88, add, True)      # ADC A,B
+
+
+def test_sub(machine):
+    cpu = machine(make_rom(b""))
+    check_binary(cpu, 0x90, sub, False)     # SUB B
+    check_binary(cpu, 0x98, sub, True)      # SBC A,B
+    check_binary(cpu, 0xB8, cp, False)      # CP B
+
+
+def test_inc_dec(machine):
+    cpu = machine(make_rom(b""))
+    r = cpu.r
+    r[H], r[L] = 0xC0, 0x00
+    for carry in range(2):
+        for value in range(256):
+            for opcode, reference in ((0x04, inc), (0x05, dec)):   # INC/DEC B
+                r[B], r[F] = value, carry << 4
+                cpu.instructions.map[opcode]()
+                assert (r[B], r[F]) == reference(value, carry)
+
+            for opcode, reference in ((0x34, inc), (0x35, dec)):   # INC/DEC (HL)
+                cpu.mem.write(0xC000, value)
+                r[F] = carry << 4
+                cpu.instructions.map[opcode]()
+                assert (cpu.mem.read(0xC000), r[F]) == reference(value, carry)
+
+
+def test_daa(machine):
+    cpu = machine(make_rom(b""))
+    r = cpu.r
+    for value in range(256):
+        for flags in range(0, 0x80, 0x10):
+            r[A], r[F] = value, flags
+            cpu.instructions.map[0x27]()
+            assert (r[A], r[F]) == daa(value, flags), (value, flags)
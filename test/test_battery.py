@@ -0,0 +1,66 @@
+import logging
+
+from conftest import make_rom
+from state import load_state, save_state
+
+
+def battery_rom():
+    rom = make_rom(b"")
+    rom[0x147], rom[0x149] = 0x03, 0x03     # MBC1+RAM+BATT, 32 KB of RAM
+    return rom
+
+
+def test_save_file_reload(machine, tmp_path):
+    path = str(tmp_path / "test.sav")
+    mem = machine(battery_rom(), path).mem
+    mem.write(0x6000, 0x01)
+    mem.write(0x4000, 0x02)
+    mem.write(0xA010, 0x5A)
+
+    # RAM is the save file, writes are in it straight away.
+    with open(path, "rb") as handle:
+        assert handle.read()[0x4010] == 0x5A
+    mem.close()
+
+    # RAM carries on in memory after the save file is closed.
+    assert mem.read(0xA010) == 0x5A
+    mem.write(0xA011, 0x01)
+
+    mem = machine(battery_rom(), path).mem
+    mem.write(0x6000, 0x01)
+    mem.write(0x4000, 0x02)
+    assert mem.read(0xA010) == 0x5A
+    assert mem.read(0xA011) == 0x00
+    mem.close()
+
+
+def test_flush(machine, tmp_path):
+    path = str(tmp_path / "test.sav")
+    cpu = machine(battery_rom(), path)
+    battery = cpu.mem.battery
+    battery.flush()
+
+    cpu.mem.write(0xA000, 0x01)
+    cpu.mem.write(0xA1FF, 0x02)
+    cpu.mem.write(0xBF00, 0x03)
+    battery.flush()
+    assert bytes(battery._flushed) == bytes(battery.ram)
+
+    # Loading a state writes straight in to the save file too.
+    state = save_state(cpu)
+    cpu.mem.write(0xA000, 0xFF)
+    load_state(cpu, state)
+    assert battery.ram[0] == 0x01
+    cpu.mem.close()
+
+
+def test_unwritable_save_file(machine, tmp_path, caplog):
+    path = str(tmp_path / "missing" / "test.sav")
+    with caplog.at_level(logging.WARNING):
+        mem = machine(battery_rom(), path).mem
+    assert "RAM won't be saved" in caplog.text
+    assert mem.battery is None
+
+    mem.write(0xA000, 0x42)
+    assert mem.read(0xA000) == 0x42
+    mem.close()
@@ -0,0 +1,59 @@
+from conftest import make_rom
+from registers import A, B, C, D, E, F, FLAG_C, FLAG_H, FLAG_Z, H, L
+
+# The operand encoded in the low three bits of a CB opcode, None for (HL).
+OPERANDS = (B, C, D, E, H, L, None, A)
+
+
+def reference(op, value, carry):
+    """
+    The CB prefixed instructions, decoded from the bits of the opcode.
+    :return: (result, flags), from a value and the C flag.
+    """
+    kind, bit = op >> 6, op >> 3 & 7
+    flags = FLAG_C if carry else 0
+    if kind == 1:       # BIT
+        return value, flags | (FLAG_H if value & 1 << bit else FLAG_Z | FLAG_H)
+    if kind == 2:       # RES
+        return value & ~(1 << bit), flags
+    if kind == 3:       # SET
+        return value | 1 << bit, flags
+
+    if bit == 0:        # RLC
+        ret, out = (value << 1 | value >> 7) & 0xFF, value >> 7
+    elif bit == 1:      # RRC
+        ret, out = (value >> 1 | value << 7) & 0xFF, value & 1
+    elif bit == 2:      # RL
+        ret, out = (value << 1 | carry) & 0xFF, value >> 7
+    elif bit == 3:      # RR
+        ret, out = value >> 1 | carry << 7, value & 1
+    elif bit == 4:      # SLA
+        ret, out = (value << 1) & 0xFF, value >> 7
+    elif bit == 5:      # SRA
+        ret, out = value >> 1 | value & 0x80, value & 1
+    elif bit == 6:      # SWAP
+        ret, out = (value << 4 | value >> 4) & 0xFF, 0
+    else:               # SRL
+        ret, out = value >> 1, value & 1
+    return ret, (FLAG_C if out else 0) | (FLAG_Z if ret == 0 else 0)
+
+
+def test_every_cb_instruction(machine):
+    cpu = machine(make_rom(b""))
+    r = cpu.r
+    for op in range(256):
+        handler = cpu.instructions.cb_map[op]
+        operand = OPERANDS[op & 7]
+        for carry in range(2):
+            for value in range(256):
+                r[F] = carry << 4
+                if operand is None:
+                    r[H], r[L] = 0xC0, 0x00
+                    cpu.mem.write(0xC000, value)
+                    handler()
+                    result = cpu.mem.read(0xC000)
+                else:
+                    r[operand] = value
+                    handler()
+                    result = r[operand]
+                assert (result, r[F]) == reference(op, value, carry), (op, value, carry)
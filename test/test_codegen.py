@@ -0,0 +1,11 @@
+from conftest import make_rom
+from registers import H, L
+
+
+def test_ld_hl_d8_writes_memory(machine):
+    cpu = machine(make_rom(bytes([0x36, 0x5A])))     # 0150 LD (HL),$5A
+    cpu.r[H], cpu.r[L] = 0xC0, 0x10
+    cpu.pc = 0x0150
+    cpu.instructions.map[0x36]()
+    assert cpu.mem.read(0xC010) == 0x5A
+    assert (cpu.r[H], cpu.r[L]) == (0xC0, 0x10)
@@ -0,0 +1,78 @@
+from conftest import make_rom
+
+# test/simple-rom/simple.asm, from main.
+SIMPLE = bytes([
+    0x31, 0xFF, 0xCF,           # 0150 LD SP,$CFFF
+    0x3E, 0x0A,                 # 0153 LD A,$0A
+    0x47, 0x4F, 0x57, 0x5F,     # 0155 LD B,A / LD C,A / LD D,A / LD E,A
+    0x67, 0x6F,                 # 0159 LD H,A / LD L,A
+    0x3E, 0x0C,                 # 015B LD A,$0C
+    0x01, 0x0C, 0x00,           # 015D LD BC,$000C
+    0x0E, 0x00,                 # 0160 LD C,$00
+    0xF2,                       # 0162 LD A,($FF00+C)
+    0x3E, 0x0A,                 # 0163 LD A,$0A
+    0xD6, 0x01,                 # 0165 SUB 1
+    0xC2, 0x65, 0x01,           # 0167 JP NZ,$0165
+    0x76, 0x00,                 # 016A HALT
+    0x18, 0xE2,                 # 016C JR $0150
+    0xD9,                       # 016E RETI
+])
+
+
+def simple_rom():
+    rom = make_rom(SIMPLE)
+    for vector in range(0x40, 0x68, 8):
+        rom[vector:vector + 3] = bytes([0xC3, 0x6E, 0x01])     # JP $016E
+    return rom
+
+
+def peek16(cpu, address):
+    return cpu.mem.read(address) | cpu.mem.read(address + 1) << 8
+
+
+def step(cpu, count):
+    for _ in range(count):
+        cpu.step()
+
+
+def test_vblank_returns_after_halt(machine):
+    cpu = machine(simple_rom())
+    for _ in range(5):
+        cpu.run_frame()
+        # Taken while halted, the interrupt returns to the instruction after
+        # the HALT.
+        assert cpu.pc == 0x40
+        assert cpu.sp == 0xCFFD
+        assert peek16(cpu, cpu.sp) == 0x016B
+
+        step(cpu, 2)    # JP $016E / RETI
+        assert cpu.pc == 0x016B
+        assert cpu.sp == 0xCFFF
+
+
+def test_call_and_ret(machine):
+    cpu = machine(make_rom(bytes([
+        0x31, 0xFE, 0xDF,       # 0150 LD SP,$DFFE
+        0xCD, 0x60, 0x01,       # 0153 CALL $0160
+        0x00,                   # 0156 NOP
+    ]) + bytes(9) + bytes([
+        0xC9,                   # 0160 RET
+    ])))
+    step(cpu, 4)    # NOP / JP $0150 / LD SP / CALL
+    assert (cpu.pc, cpu.sp) == (0x0160, 0xDFFC)
+    assert peek16(cpu, cpu.sp) == 0x0156
+    cpu.step()
+    assert (cpu.pc, cpu.sp) == (0x0156, 0xDFFE)
+
+
+def test_rst_and_ret(machine):
+    rom = make_rom(bytes([
+        0x31, 0xFE, 0xDF,       # 0150 LD SP,$DFFE
+        0xEF,                   # 0153 RST $28
+    ]))
+    rom[0x28] = 0xC9            # 0028 RET
+    cpu = machine(rom)
+    step(cpu, 4)    # NOP / JP $0150 / LD SP / RST
+    assert (cpu.pc, cpu.sp) == (0x0028, 0xDFFC)
+    cpu.step()
+    assert (cpu.pc, cpu.sp) == (0x0154, 0xDFFE)
@@ -0,0 +1,55 @@
+from conftest import make_rom
+from registers import A
+
+PROGRAM = bytes([
+    0x31, 0xFE, 0xDF,           # 0150 LD SP,$DFFE
+    0x21, 0x00, 0xC0,           # 0153 LD HL,$C000
+    0x3E, 0x05,                 # 0156 LD A,$05
+    0xFE, 0x05,                 # 0158 CP $05
+    0x28, 0x02,                 # 015A JR Z,$015E
+    0x36, 0xAA,                 # 015C LD (HL),$AA
+    0x2C,                       # 015E INC L
+    0x06, 0x00,                 # 015F LD B,$00
+    0x3E, 0x07,                 # 0161 LD A,$07
+    0x78,                       # 0163 LD A,B
+    0xB7,                       # 0164 OR A
+    0x28, 0x02,                 # 0165 JR Z,$0169
+    0x36, 0xBB,                 # 0167 LD (HL),$BB
+    0x2C,                       # 0169 INC L
+    0x0E, 0x10,                 # 016A LD C,$10
+    0x0D,                       # 016C DEC C
+    0x20, 0xFD,                 # 016D JR NZ,$016C
+    0x71,                       # 016F LD (HL),C
+    0x2C,                       # 0170 INC L
+    0x77,                       # 0171 LD (HL),A
+    0x18, 0xFE,                 # 0172 JR $0172
+])
+
+
+def run(machine, enabled):
+    cpu = machine(make_rom(PROGRAM))
+    cpu.blocks.fusion.enabled = enabled
+    cpu.run_cycles(2000)
+    return cpu
+
+
+def test_fused_and_unfused_agree(machine):
+    fused = run(machine, True)
+    unfused = run(machine, False)
+    assert set(fused.blocks.fusion.sites) >= {"compare", "test_pair", "countdown"}
+    assert not unfused.blocks.fusion.sites
+
+    for cpu in (fused, unfused):
+        assert cpu.pc == 0x0172
+        # Both forward branches were taken.
+        assert bytes(cpu.mem.read(0xC000 + i) for i in range(4)) == bytes(4)
+    assert bytes(fused.r) == bytes(unfused.r)
+    assert fused.sp == unfused.sp
+    assert fused.cycles == unfused.cycles
+
+
+def test_or_a_tests_the_loaded_value(machine):
+    cpu = run(machine, True)
+    assert cpu.blocks.fusion.sites["test_pair"] == 1
+    assert cpu.r[A] == 0
+    assert cpu.mem.read(0xC001) == 0
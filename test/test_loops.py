@@ -0,0 +1,27 @@
+from conftest import make_rom
+from loops import IDLE
+
+POLL = bytes([
+    0x21, 0x44, 0xFF,           # 0150 LD HL,$FF44      LY
+    0x3E, 0x10,                 # 0153 LD A,$10
+    0xBE,                       # 0155 CP (HL)
+    0x20, 0xFD,                 # 0156 JR NZ,$0155
+    0xC3, 0x58, 0x01,           # 0158 JP $0158
+])
+
+
+def test_cp_hl_poll_is_idle(machine):
+    cpu = machine(make_rom(POLL))
+    assert cpu.blocks.lookup(0x0155).loop[0] == IDLE
+
+    cpu.run_cycles(20000)
+    assert cpu.pc == 0x0158
+    assert cpu.mem.read(0xFF44) >= 0x10
+
+
+def test_writes_to_memory_are_not_idle(machine):
+    cpu = machine(make_rom(bytes([
+        0x34,                   # 0150 INC (HL)
+        0x20, 0xFD,             # 0151 JR NZ,$0150
+    ])))
+    assert cpu.blocks.lookup(0x0150).loop is None
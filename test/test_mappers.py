@@ -0,0 +1,161 @@
+import logging
+
+from conftest import make_rom
+from mem.mbc1 import MBC1
+from mem.mbc3 import MBC3
+from mem.mbc5 import MBC5
+from mem.romonly import ROMOnly
+from state import load_state, save_state
+
+ROM_SIZES = {2: 0x00, 4: 0x01, 8: 0x02, 16: 0x03, 32: 0x04, 64: 0x05, 128: 0x06}
+
+
+def banked_rom(banks, cart_type, ram_type=0x00):
+    """
+    Builds a ROM whose banks each start with their own number.
+    """
+    rom = make_rom(b"") + bytearray(0x4000 * (banks - 2))
+    rom[0x147], rom[0x148], rom[0x149] = cart_type, ROM_SIZES[banks], ram_type
+    for bank in range(1, banks):
+        rom[bank * 0x4000] = bank
+    return rom
+
+
+def test_get_rom_bank(machine):
+    cart = machine(banked_rom(4, 0x01)).cart
+    assert cart.get_rom_bank(3)[0] == 3
+    # Bits beyond the number of banks are ignored.
+    assert cart.get_rom_bank(7)[0] == 3
+    assert len(cart.get_rom_bank(1)) == 0x4000
+
+
+def test_mbc1_rom_banks(machine):
+    mem = machine(banked_rom(64, 0x01)).mem
+    assert mem.read(0x4000) == 1
+    for bank in (2, 5, 0x1F):
+        mem.write(0x2000, bank)
+        assert mem.read(0x4000) == bank
+        assert mem.read16(0x4000) == bank
+    # Bank 0 can't be selected in the upper half.
+    mem.write(0x2000, 0)
+    assert mem.read(0x4000) == 1
+
+    # The upper two bits, in ROM banking mode.
+    mem.write(0x2000, 0x02)
+    mem.write(0x4000, 0x01)
+    assert mem.read(0x4000) == 0x22
+
+
+def test_mbc1_rom_banks_wrap(machine):
+    mem = machine(banked_rom(8, 0x01)).mem
+    mem.write(0x2000, 0x0B)
+    assert mem.read(0x4000) == 3
+
+
+def test_mbc1_ram_banks(machine):
+    mem = machine(banked_rom(4, 0x03, ram_type=0x03)).mem
+    mem.write(0x0000, 0x0A)     # Enable RAM
+    mem.write(0x6000, 0x01)     # RAM banking mode
+    for bank in range(4):
+        mem.write(0x4000, bank)
+        mem.write(0xA000, 0x40 + bank)
+    for bank in range(4):
+        mem.write(0x4000, bank)
+        assert mem.read(0xA000) == 0x40 + bank
+
+    # Writes are dropped while RAM is disabled.
+    mem.write(0x0000, 0x00)
+    mem.write(0xA000, 0xFF)
+    mem.write(0x0000, 0x0A)
+    assert mem.read(0xA000) == 0x43
+
+
+def test_create_mapper(machine, caplog):
+    assert type(machine(banked_rom(2, 0x00)).mem) is ROMOnly
+    assert type(machine(banked_rom(4, 0x03, ram_type=0x03)).mem) is MBC1
+    assert type(machine(banked_rom(4, 0x13, ram_type=0x03)).mem) is MBC3
+    assert type(machine(banked_rom(4, 0x1B, ram_type=0x03)).mem) is MBC5
+
+    # Unsupported mappers fall back to MBC1.
+    with caplog.at_level(logging.WARNING):
+        assert type(machine(banked_rom(4, 0x05)).mem) is MBC1
+    assert "not supported" in caplog.text
+
+
+def test_mbc3_banks(machine):
+    mem = machine(banked_rom(128, 0x13, ram_type=0x03)).mem
+    for bank in (1, 0x45, 0x7F):
+        mem.write(0x2000, bank)
+        assert mem.read(0x4000) == bank
+    mem.write(0x2000, 0x00)
+    assert mem.read(0x4000) == 1
+    mem.write(0x2000, 0x85)     # Only 7 bits
+    assert mem.read(0x4000) == 0x05
+
+    mem.write(0x0000, 0x0A)
+    for bank in range(4):
+        mem.write(0x4000, bank)
+        mem.write(0xBFFF, 0x40 + bank)
+    for bank in range(4):
+        mem.write(0x4000, bank)
+        assert mem.read(0xBFFF) == 0x40 + bank
+
+
+def test_mbc3_clock_latch(machine):
+    cpu = machine(banked_rom(4, 0x10, ram_type=0x03))
+    mem = cpu.mem
+    mem.write(0x0000, 0x0A)
+    mem.write(0x4000, 0x08)     # Seconds
+    mem.write(0xA000, 0x2A)
+    assert mem.read(0xA000) == 0x00
+
+    mem.write(0x6000, 0x00)
+    mem.write(0x6000, 0x01)
+    assert mem.read(0xA000) == 0x2A
+    mem.write(0xA000, 0x2B)
+    assert mem.read(0xA000) == 0x2A
+
+    # The clock registers and the latch are part of the state.
+    state = save_state(cpu)
+    restored = machine(banked_rom(4, 0x10, ram_type=0x03))
+    load_state(restored, state)
+    assert restored.mem.read(0xA000) == 0x2A
+    restored.mem.write(0x6000, 0x00)
+    restored.mem.write(0x6000, 0x01)
+    assert restored.mem.read(0xA000) == 0x2B
+
+
+def test_mbc5_banks(machine):
+    mem = machine(banked_rom(128, 0x1B, ram_type=0x04)).mem
+    mem.write(0x2000, 0x00)
+    assert mem.read(0x4000) == 0
+    mem.write(0x2000, 0x7F)
+    assert mem.read(0x4000) == 0x7F
+    # Bank 0x17F wraps to 0x7F on a 128 bank ROM.
+    mem.write(0x3000, 0x01)
+    assert mem.read(0x4000) == 0x7F
+    mem.write(0x3000, 0x00)
+    mem.write(0x2000, 0x80)
+    assert mem.read(0x4000) == 0
+
+    mem.write(0x0000, 0x0A)
+    for bank in range(16):
+        mem.write(0x4000, bank)
+        mem.write(0xA123, bank)
+    for bank in range(16):
+        mem.write(0x4000, bank)
+        assert mem.read(0xA123) == bank
+
+
+def test_bank_state(machine):
+    cpu = machine(banked_rom(8, 0x03, ram_type=0x03))
+    cpu.mem.write(0x2000, 0x05)
+    cpu.mem.write(0x6000, 0x01)
+    cpu.mem.write(0x4000, 0x02)
+    cpu.mem.write(0xA000, 0x99)
+    state = save_state(cpu)
+
+    restored = machine(banked_rom(8, 0x03, ram_type=0x03))
+    load_state(restored, state)
+    assert restored.mem.read(0x4000) == 5
+    assert restored.mem.read(0xA000) == 0x99
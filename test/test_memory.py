@@ -0,0 +1,20 @@
+from conftest import make_rom
+
+
+def test_addresses_wrap(machine):
+    cpu = machine(make_rom(b""))
+    cpu.mem.write(0xC000 - 0x10000, 0x42)
+    assert cpu.mem.read(0xC000) == 0x42
+    assert cpu.mem.read(0x1C000) == 0x42
+
+
+def test_read16(machine):
+    rom = make_rom(b"")
+    rom[0x0000] = 0x12
+    rom[0x3FFF], rom[0x4000] = 0x34, 0x56
+    cpu = machine(rom)
+    cpu.mem.write(0xFFFF, 0x01)
+    assert cpu.mem.read16(0x3FFF) == 0x5634
+    # The high byte of 0xFFFF is read from 0x0000.
+    assert cpu.mem.read16(0xFFFF) == 0x1201
+    assert cpu.mem.read16(-1) == 0x1201
@@ -0,0 +1,49 @@
+from conftest import make_rom
+from rewind import Rewind, decode, encode
+from state import save_state
+
+# Counts in to $C000 forever.
+COUNTER = bytes([
+    0x21, 0x00, 0xC0,           # 0150 LD HL,$C000
+    0x34,                       # 0153 INC (HL)
+    0xC3, 0x53, 0x01,           # 0154 JP $0153
+])
+
+
+def test_encode_decode():
+    old = bytes(range(64)) * 4
+    new = bytearray(old)
+    new[3] ^= 0xFF
+    new[100:110] = bytes(10)
+    delta = encode(old, bytes(new))
+    assert len(delta) < len(old)
+    assert decode(bytes(new), delta) == old
+    assert encode(old, old) == b""
+
+
+def test_rewind_restores_earlier_frame(machine):
+    cpu = machine(make_rom(COUNTER))
+    rewind = Rewind(cpu, interval=1)
+    states = []
+    for _ in range(5):
+        cpu.run_frame()
+        states.append(save_state(cpu))
+    assert len(rewind) == 5
+
+    assert rewind.rewind(2) == 2
+    assert save_state(cpu) == states[2]
+    assert len(rewind) == 3
+
+    # Going back further than recorded stops at the oldest state.
+    assert rewind.rewind(10) == 2
+    assert save_state(cpu) == states[0]
+
+
+def test_budget_drops_oldest_states(machine):
+    cpu = machine(make_rom(COUNTER))
+    rewind = Rewind(cpu, interval=1, budget=0)
+    for _ in range(5):
+        cpu.run_frame()
+    assert len(rewind) == 1
+    rewind.close()
+    assert len(rewind) == 0
@@ -0,0 +1,61 @@
+import subprocess
+import sys
+
+from conftest import SRC
+
+# Publishes a frame, reads it from the same process and from a process
+# started by multiprocessing, and releases the block.
+SCRIPT = """
+import multiprocessing
+import sys
+sys.path.insert(0, {src!r})
+import numpy as np
+import sharedframe
+
+
+class Screen(object):
+    framebuffer = np.full((144, 160), 2, dtype=np.uint8)
+
+    def add_frame_listener(self, listener):
+        pass
+
+    def remove_frame_listener(self, listener):
+        pass
+
+
+def child(name, queue):
+    reader = sharedframe.SharedFramebufferReader(name=name)
+    queue.put(reader.read()[0])
+    reader.close()
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method({method!r})
+    shared = sharedframe.SharedFramebuffer(Screen())
+    shared.publish()
+
+    reader = sharedframe.SharedFramebufferReader(name=shared.name)
+    sequence, frame = reader.read()
+    print(sequence, int(frame.sum()))
+    del frame
+    reader.close()
+
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=child, args=(shared.name, queue))
+    process.start()
+    print(queue.get())
+    process.join()
+    shared.close()
+"""
+
+
+def test_readers_keep_the_creators_registration(tmp_path):
+    for method in ("fork", "spawn"):
+        script = tmp_path / "shared.py"
+        script.write_text(SCRIPT.format(src=SRC, method=method))
+        out = subprocess.run([sys.executable, str(script)], capture_output=True,
+                             text=True, timeout=60)
+        assert out.returncode == 0, out.stderr
+        assert out.stdout.split() == ["1", str(144 * 160 * 2), "1"]
+        # The creator unlinks the block without the resource tracker failing.
+        assert "Traceback" not in out.stderr, out.stderr
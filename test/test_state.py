@@ -0,0 +1,51 @@
+import pytest
+
+from conftest import make_rom
+from state import StateError, load_state, save_state
+
+PROGRAM = bytes([
+    0x31, 0xFE, 0xFF,           # 0150 LD SP,$FFFE
+    0xC1,                       # 0153 POP BC
+    0x3E, 0x5A,                 # 0154 LD A,$5A
+    0xEA, 0x00, 0xC0,           # 0156 LD ($C000),A
+    0x3C,                       # 0159 INC A
+    0xC3, 0x59, 0x01,           # 015A JP $0159
+])
+
+
+def step(cpu, count):
+    for _ in range(count):
+        cpu.step()
+
+
+def test_pop_at_top_of_stack(machine):
+    cpu = machine(make_rom(PROGRAM))
+    step(cpu, 4)    # NOP / JP $0150 / LD SP / POP
+    assert cpu.sp == 0x0000
+    save_state(cpu)
+
+
+def test_round_trip(machine):
+    cpu = machine(make_rom(PROGRAM))
+    step(cpu, 6)
+    cpu.run_cycles(1000)
+    state = save_state(cpu)
+
+    restored = machine(make_rom(PROGRAM))
+    load_state(restored, state)
+    assert save_state(restored) == state
+    assert (restored.pc, restored.sp) == (cpu.pc, cpu.sp)
+    assert restored.mem.read(0xC000) == 0x5A
+
+    # Both carry on exactly alike.
+    cpu.run_frame()
+    restored.run_frame()
+    assert save_state(restored) == save_state(cpu)
+
+
+def test_rejects_other_data(machine):
+    cpu = machine(make_rom(PROGRAM))
+    with pytest.raises(StateError):
+        load_state(cpu, b"NOT A STATE")
+    with pytest.raises(StateError):
+        load_state(cpu, save_state(cpu)[:-1])
@@ -0,0 +1,24 @@
+from conftest import make_rom
+
+
+def test_overflow_wakes_halt(machine):
+    cpu = machine(make_rom(bytes([
+        0x3E, 0x05,             # 0150 LD A,$05
+        0xE0, 0x07,             # 0152 LDH ($07),A      TAC: enabled, 16 cycles
+        0x3E, 0xF0,             # 0154 LD A,$F0
+        0xE0, 0x05,             # 0156 LDH ($05),A      TIMA
+        0x76,                   # 0158 HALT
+        0x00,                   # 0159 NOP
+    ])))
+    while not cpu.halt:
+        cpu.step()
+    start = cpu.cycles
+
+    # Other events, e.g. the screen's, may end a step before the overflow.
+    while cpu.halt and cpu.cycles - start <= 16 * 16:
+        cpu.step()
+    assert not cpu.halt
+    assert cpu.pc == 0x0159
+    # Woken by the overflow, 16 increments later, well before vblank.
+    assert cpu.cycles - start <= 16 * 16
+    assert cpu.mem.read(0xFF0F) & 0x04